@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Minimal local NATS broker for offline benchmarks and tests
+
+It speaks the subset of the NATS text protocol the bus uses: INFO, CONNECT,
+PING/PONG, SUB, UNSUB and PUB/MSG with '*' and '>' wildcards. There is no
+authentication, clustering, queue group balancing or headers.
+"""
+
+import asyncio
+import json
+from logzero import logger
+from bus.traffic import subject_match
+
+
+class _Subscription(object):
+    def __init__(self, client, sid, subject, max_msgs=None):
+        self.client = client
+        self.sid = sid
+        self.subject = subject
+        self.wildcard = '*' in subject or '>' in subject
+        self.max_msgs = max_msgs
+        self.delivered = 0
+
+
+class _ClientConnection(object):
+    def __init__(self, broker, reader, writer):
+        self._broker = broker
+        self._reader = reader
+        self.writer = writer
+        self.subs = {}
+
+    async def serve(self):
+        self.writer.write(self._broker.info_line())
+        try:
+            while True:
+                line = await self._reader.readline()
+                if not line:
+                    break
+                await self._handle(line)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for sub in list(self.subs.values()):
+                self._broker.remove_subscription(sub)
+            self.writer.close()
+
+    async def _handle(self, line):
+        op, _, args = line.rstrip(b'\r\n').partition(b' ')
+        op = op.upper()
+        if op == b'PUB':
+            tokens = args.split()
+            size = int(tokens[-1])
+            reply = tokens[1] if len(tokens) == 3 else None
+            payload = await self._reader.readexactly(size + 2)
+            self._broker.route(tokens[0], reply, payload[:size])
+        elif op == b'SUB':
+            tokens = args.split()
+            sid = tokens[-1]
+            sub = _Subscription(self, sid, tokens[0].decode())
+            self.subs[sid] = sub
+            self._broker.add_subscription(sub)
+        elif op == b'UNSUB':
+            tokens = args.split()
+            sub = self.subs.get(tokens[0])
+            if sub is None:
+                return
+            if len(tokens) > 1 and int(tokens[1]) > sub.delivered:
+                sub.max_msgs = int(tokens[1])
+                return
+            self.subs.pop(tokens[0], None)
+            self._broker.remove_subscription(sub)
+        elif op == b'PING':
+            self.writer.write(b'PONG\r\n')
+        elif op in (b'PONG', b'CONNECT'):
+            pass
+        elif op:
+            self.writer.write(b"-ERR 'Unknown Protocol Operation'\r\n")
+
+
+class LocalBroker(object):
+    """ Asyncio NATS broker bound to localhost
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, max_payload=1048576):
+        """
+        Args:
+            port (int): 0 to pick a free port, see LocalBroker.port
+        """
+        self.host = host
+        self.port = port
+        self.max_payload = max_payload
+        self._server = None
+        self._exact = {}
+        self._wildcards = []
+
+    def info_line(self):
+        info = {
+            "server_id": "turing-local-broker",
+            "version": "1.0.0",
+            "proto": 0,
+            "host": self.host,
+            "port": self.port,
+            "max_payload": self.max_payload,
+            "auth_required": False,
+            "tls_required": False,
+        }
+        return b'INFO ' + json.dumps(info).encode() + b'\r\n'
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._on_client, self.host,
+                                                  self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info("Local broker listens on %s:%d", self.host, self.port)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _on_client(self, reader, writer):
+        await _ClientConnection(self, reader, writer).serve()
+
+    def add_subscription(self, sub):
+        if sub.wildcard:
+            self._wildcards.append(sub)
+        else:
+            self._exact.setdefault(sub.subject, []).append(sub)
+
+    def remove_subscription(self, sub):
+        if sub.wildcard:
+            if sub in self._wildcards:
+                self._wildcards.remove(sub)
+        else:
+            subs = self._exact.get(sub.subject, [])
+            if sub in subs:
+                subs.remove(sub)
+
+    def route(self, subject, reply, payload):
+        subject_str = subject.decode()
+        subs = list(self._exact.get(subject_str, []))
+        subs.extend(sub for sub in self._wildcards
+                    if subject_match(sub.subject, subject_str))
+        for sub in subs:
+            if reply is None:
+                header = b'MSG %s %s %d\r\n' % (subject, sub.sid, len(payload))
+            else:
+                header = b'MSG %s %s %s %d\r\n' % (subject, sub.sid, reply,
+                                                    len(payload))
+            sub.client.writer.write(header + payload + b'\r\n')
+            sub.delivered += 1
+            if sub.max_msgs is not None and sub.delivered >= sub.max_msgs:
+                sub.client.subs.pop(sub.sid, None)
+                self.remove_subscription(sub)
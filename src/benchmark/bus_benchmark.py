@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Bus throughput and latency benchmark
+
+Runs offline against LocalBroker by default, against a real NATS server
+with --transport nats, or through the in-process LoopbackBus with
+--transport loopback. The results are printed as JSON for regression
+comparison.
+
+Usage:
+    python -m benchmark.bus_benchmark [--transport broker|nats|loopback]
+        [--scenario pub_fanout|req_rep|large_brew] [--codec json|binary]
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from benchmark.broker import LocalBroker
+from bus.codec import get_codec
+from bus.loopback_bus import LoopbackBus, LoopbackRouter
+from bus.nats_bus import NatsBus, NatsConnection
+
+DISPATCH_CONFIG = {'workers': 8, 'max_pending': 4096}
+
+
+def _percentile(samples, percent):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(percent / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _report(latencies, elapsed, **extra):
+    report = {
+        "messages": len(latencies),
+        "elapsed_s": elapsed,
+        "msgs_per_sec": len(latencies) / elapsed if elapsed > 0 else 0.0,
+        "p50_ms": _percentile(latencies, 50) * 1000,
+        "p99_ms": _percentile(latencies, 99) * 1000,
+        "max_ms": max(latencies) * 1000 if latencies else 0.0,
+    }
+    report.update(extra)
+    return report
+
+
+class BusFactory(object):
+    """ Create the bus clients of one benchmark run
+
+    Every NATS client gets its own connection, as if each one was another
+    machine, except the loopback transport which runs in this process.
+    """
+
+    def __init__(self, transport, host, port, codec):
+        self._transport = transport
+        self._host = host
+        self._port = port
+        self._codec = codec
+        self._router = LoopbackRouter()
+        self._buses = []
+
+    async def create(self, path):
+        if self._transport == 'loopback':
+            bus = LoopbackBus(path, self._router)
+        else:
+            bus = NatsBus(self._host, self._port, path,
+                          connection=NatsConnection(self._host, self._port),
+                          codec=self._codec, dispatch_config=DISPATCH_CONFIG)
+        await bus.start()
+        self._buses.append(bus)
+        return bus
+
+    async def flush(self):
+        # Make sure the broker knows every subscription before sending
+        for bus in self._buses:
+            if isinstance(bus, NatsBus):
+                await bus._nats_client.flush()
+
+    async def close(self):
+        for bus in self._buses:
+            await bus.close()
+        self._buses = []
+
+
+async def pub_fanout(factory, subscribers=4, messages=2000):
+    """ One publisher, every message is delivered to each subscriber
+    """
+    publisher = await factory.create('bench.temperature')
+    expected = subscribers * messages
+    latencies = []
+    done = asyncio.Event()
+
+    def on_status(status):
+        latencies.append(time.perf_counter() - status['sent'])
+        if len(latencies) >= expected:
+            done.set()
+
+    for index in range(subscribers):
+        subscriber = await factory.create('bench.subscriber.%d' % index)
+        await subscriber.reg_sub('bench.temperature', on_status)
+    await factory.flush()
+
+    start = time.perf_counter()
+    for index in range(messages):
+        await publisher.pub('bench.temperature', {
+            'status': 'ok',
+            'temperature': 90 + index % 10 * 0.0078125,
+            'sent': time.perf_counter()
+        })
+    await asyncio.wait_for(done.wait(), 60)
+    return _report(latencies, time.perf_counter() - start,
+                   subscribers=subscribers)
+
+
+async def _serve(factory, path, method, callback):
+    server = await factory.create(path)
+    await server.reg_rpc_api(method, callback)
+    await factory.flush()
+    return server
+
+
+async def req_rep(factory, clients=8, requests=250):
+    """ N clients send requests concurrently, each waits for its reply
+    """
+    status = {'status': 'ok', 'temperature': 92.5}
+
+    async def get(_):
+        return status
+
+    await _serve(factory, 'bench.rpc', 'get', get)
+    buses = [await factory.create('bench.client.%d' % index)
+             for index in range(clients)]
+    await factory.flush()
+
+    latencies = []
+
+    async def run_client(bus):
+        for _ in range(requests):
+            sent = time.perf_counter()
+            await bus.call('bench.rpc', 'get', {'command': 'get'}, timeout=5)
+            latencies.append(time.perf_counter() - sent)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[run_client(bus) for bus in buses])
+    return _report(latencies, time.perf_counter() - start, clients=clients)
+
+
+async def large_brew(factory, points=2000, requests=20):
+    """ Barista brew requests carrying a long recipe
+    """
+    async def brew(parameters):
+        return {'status': 'ok', 'points': len(parameters['points'])}
+
+    await _serve(factory, 'bench.barista', 'brew', brew)
+    client = await factory.create('bench.brew_client')
+    await factory.flush()
+
+    recipe = [{'type': 'point',
+               'point': [10.0 + index * 0.1, 20.0, 180.0, 5000, 0.5, None,
+                         None, 92, 0.1]} for index in range(points)]
+    payload_size = len(get_codec().encode({'points': recipe}))
+
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(requests):
+        sent = time.perf_counter()
+        await client.call('bench.barista', 'brew', {'points': recipe},
+                          timeout=10)
+        latencies.append(time.perf_counter() - sent)
+    return _report(latencies, time.perf_counter() - start, points=points,
+                   json_payload_bytes=payload_size)
+
+
+SCENARIOS = {
+    "pub_fanout": pub_fanout,
+    "req_rep": req_rep,
+    "large_brew": large_brew,
+}
+
+
+async def run(transport, scenarios, codec_name, host=None, port=None):
+    """
+    Returns:
+        dict: report of each scenario
+    """
+    broker = None
+    if transport == 'broker':
+        broker = LocalBroker()
+        await broker.start()
+        host, port = broker.host, broker.port
+
+    results = {
+        "transport": transport,
+        "codec": codec_name,
+        "scenarios": {},
+    }
+    try:
+        for name in scenarios:
+            factory = BusFactory(transport, host, port, get_codec(codec_name))
+            try:
+                results["scenarios"][name] = await SCENARIOS[name](factory)
+            finally:
+                await factory.close()
+    finally:
+        if broker is not None:
+            await broker.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bus benchmark")
+    parser.add_argument('--transport', default='broker',
+                        choices=['broker', 'nats', 'loopback'])
+    parser.add_argument('--scenario', action='append',
+                        choices=sorted(SCENARIOS.keys()),
+                        help='run only this scenario, can be repeated')
+    parser.add_argument('--codec', default='json', choices=['json', 'binary'])
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='nats server host for --transport nats')
+    parser.add_argument('--port', type=int, default=4222,
+                        help='nats server port for --transport nats')
+    args = parser.parse_args()
+
+    scenarios = args.scenario or sorted(SCENARIOS.keys())
+    loop = asyncio.get_event_loop()
+    results = loop.run_until_complete(
+        run(args.transport, scenarios, args.codec, args.host, args.port))
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Replay a session recorded by BusRecorder against a NATS server
+
+Usage:
+    python -m benchmark.bus_replay bus.rec [--host alarm] [--port 4222]
+        [--speed 1] [--subject tank.temp.pub ...]
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from bus.nats_bus import NatsBus
+from bus.recorder import BusReplayer
+
+
+async def run(path, host, port, speed, subjects=None, start_time=None):
+    """
+    Returns:
+        dict: replayed message counters and elapsed time
+    """
+    bus = NatsBus(host, port, 'bus.replay')
+    await bus.start()
+    replayer = BusReplayer(path, start_time=start_time, subjects=subjects)
+    start = time.perf_counter()
+    try:
+        await replayer.replay(bus, speed=speed)
+    finally:
+        await bus.close()
+    return {
+        "published": replayer.published,
+        "requested": replayer.requested,
+        "failed": replayer.failed,
+        "elapsed_s": time.perf_counter() - start,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bus replayer")
+    parser.add_argument('path', help='the log written by BusRecorder')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=4222)
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='1 for the recorded timing, 0 as fast as possible')
+    parser.add_argument('--subject', action='append',
+                        help='replay only this subject, can be repeated')
+    parser.add_argument('--start-time', type=float,
+                        help='skip the records before this unix time')
+    args = parser.parse_args()
+
+    loop = asyncio.get_event_loop()
+    results = loop.run_until_complete(
+        run(args.path, args.host, args.port, args.speed, args.subject,
+            args.start_time))
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Microbenchmark of the bus payload codecs
+
+Usage:
+    python -m benchmark.codec_benchmark [--number N]
+"""
+
+import argparse
+import json
+import timeit
+
+from bus import codec as bus_codec
+
+PAYLOADS = {
+    "telemetry": {
+        "status": "ok",
+        "temperature": 92.5078125,
+        "error_count": 0
+    },
+    "rpc_request": {
+        "id": 1024,
+        "method": "get",
+        "parameters": {"command": "get"}
+    },
+    "brew_points": {
+        "command": "brew",
+        "points": [{"point": [10.0 + i, 20.0, 180.0, 5000, 0.5, None, None,
+                              92, 0.1]} for i in range(100)]
+    },
+}
+
+
+def _legacy_encode(payload):
+    return json.dumps(payload).encode('utf-8')
+
+
+def _legacy_decode(data):
+    return json.loads(data.decode())
+
+
+def _measure(func, arg, number):
+    seconds = min(timeit.repeat(lambda: func(arg), number=number, repeat=3))
+    return {"ops_per_sec": number / seconds, "us_per_op": seconds * 1e6 / number}
+
+
+def run(number):
+    results = {}
+    for name, payload in PAYLOADS.items():
+        legacy_data = _legacy_encode(payload)
+        results[name] = {
+            "legacy_json": {
+                "bytes": len(legacy_data),
+                "encode": _measure(_legacy_encode, payload, number),
+                "decode": _measure(_legacy_decode, legacy_data, number),
+            }
+        }
+        for codec_name, codec in bus_codec.CODECS.items():
+            data = codec.encode(payload)
+            results[name][codec_name] = {
+                "bytes": len(data),
+                "encode": _measure(codec.encode, payload, number),
+                "decode": _measure(bus_codec.decode, data, number),
+            }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bus codec microbenchmark")
+    parser.add_argument('--number', type=int, default=20000,
+                        help='operations per measurement')
+    args = parser.parse_args()
+    print(json.dumps(run(args.number), indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
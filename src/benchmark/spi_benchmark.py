@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" SPI transfer path benchmark
+
+Compares the list based transfer (spidev xfer on writedata + [0] * size)
+with the preallocated buffer path of HWSPI. Runs offline by default, the
+wire is skipped so only the Python overhead is measured. With --device the
+transfers go to the real SPI device. The results are printed as JSON.
+
+Usage:
+    python -m benchmark.spi_benchmark [--device 0 --ce 0] [--calls 100000]
+"""
+
+import argparse
+import gc
+import json
+import time
+
+from hardware.max31856 import MAX31856, MAX31856Config
+from hardware.spi import HWSPI, SPIConfig, SPIController, _ChipSelect
+from lib import tracing
+
+
+class ListSPI(HWSPI):
+    """ The transfer before the buffers, a new list for every step """
+
+    def transfer_into(self, writedata, readsize):
+        with tracing.span('spi.transfer', 'spi',
+                          {'device': self._device, 'ce': self._ce}):
+            buf = self._controller.spidev(self._ce).xfer(
+                list(writedata) + [0] * readsize)
+        return buf[len(writedata):]
+
+
+class _OfflineSpiDev(object):
+    mode = 0
+
+    def fileno(self):
+        return -1
+
+    def close(self):
+        pass
+
+    # spidev returns a new list of the received bytes
+    def xfer(self, data):
+        return list(data)
+
+
+class OfflineController(SPIController):
+    def open(self, ce):
+        chip_select = self._chip_selects.get(ce)
+        if chip_select is None:
+            chip_select = _ChipSelect(_OfflineSpiDev())
+            self._chip_selects[ce] = chip_select
+        chip_select.ref_count += 1
+        return chip_select.fd
+
+
+class OfflineBufferSPI(HWSPI):
+    def _message(self):
+        pass
+
+
+def _run(func, calls):
+    gc.collect()
+    collections = sum(stats['collections'] for stats in gc.get_stats())
+    start = time.perf_counter()
+    for _ in range(calls):
+        func()
+    elapsed = time.perf_counter() - start
+    return {
+        "calls": calls,
+        "elapsed_s": elapsed,
+        "calls_per_sec": calls / elapsed if elapsed > 0 else 0.0,
+        "gc_collections": sum(stats['collections']
+                              for stats in gc.get_stats()) - collections,
+    }
+
+
+def _scenarios(spi):
+    command = bytearray([MAX31856.ADDR_LTCBH])
+    sensor = MAX31856(spi, MAX31856Config())
+    # Read the raw registers, a zero reading is not an error here
+    sensor._is_connected = True
+
+    def read_temperature():
+        [temp0, temp1, temp2, _] = sensor._read_reg(MAX31856.ADDR_LTCBH, 4)
+        return ((temp0 << 16) | (temp1 << 8) | temp2) >> 5
+
+    return {
+        'transfer': lambda: spi.transfer_into(command, 4),
+        'max31856_read': read_temperature,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SPI transfer benchmark")
+    parser.add_argument('--device', type=int,
+                        help='SPI device number, offline without it')
+    parser.add_argument('--ce', type=int, default=0)
+    parser.add_argument('--calls', type=int, default=100000)
+    args = parser.parse_args()
+
+    if args.device is None:
+        controller = OfflineController(0)
+        transports = {
+            'list': ListSPI(0, 0, SPIConfig(), controller),
+            'buffer': OfflineBufferSPI(0, 0, SPIConfig(), controller)
+        }
+    else:
+        controller = SPIController(args.device)
+        transports = {
+            'list': ListSPI(args.device, args.ce, SPIConfig(), controller),
+            'buffer': HWSPI(args.device, args.ce, SPIConfig(), controller)
+        }
+    for spi in transports.values():
+        spi.open()
+
+    results = {}
+    for name, spi in transports.items():
+        for scenario, func in _scenarios(spi).items():
+            results['%s.%s' % (scenario, name)] = _run(func, args.calls)
+        spi.close()
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
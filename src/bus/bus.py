@@ -2,14 +2,31 @@
 # -*- coding: utf-8 -*-
 
 
+class RpcError(Exception):
+    """ The remote handler replied an error for a request
+
+    Attributes:
+        busy (bool): the handler rejected the request because its queue is
+            full, the request may succeed when sent again later
+    """
+
+    def __init__(self, path, method, msg, busy=False):
+        super(RpcError, self).__init__(
+            "'%s' of '%s' got error: %s" % (method, path, msg))
+        self.path = path
+        self.method = method
+        self.message = msg
+        self.busy = busy
+
+
 class Bus(object):
     async def start(self):
         raise NotImplementedError()
 
-    async def req(self, path, timeout):
+    async def req(self, path, payload, timeout=1):
         raise NotImplementedError()
 
-    async def reg_rep(self, path, callback):
+    async def reg_rep(self, path, callback, idempotent=False):
         raise NotImplementedError()
 
     async def pub(self, path, payload):
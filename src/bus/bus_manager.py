@@ -1,29 +1,147 @@
-from bus.nats_bus import NatsBus
-from bus.chatroom_bus import ChatroomBus
+from bus.nats_bus import NatsBus, NatsConnection
+from bus.loopback_bus import LoopbackBus, LoopbackRouter
+from bus.codec import get_codec
+from bus.metrics import BusMetrics
+from bus.outbox import create_outbox, outbox_options
+from bus.publisher import PublishPipeline
+from bus.recorder import BusRecorder
+from bus.traffic import TrafficClasses, TrafficRoute
 
 class BusManager:
     NATS = "nats"
-    CHATROOM = "chatroom"
+    LOOPBACK = "loopback"
 
     def __init__(self):
         self.host = None
         self.port = None
+        self.bus_type = None
+        self.codec = None
+        self.dispatch_config = None
+        self.forward = True
+        self.outbox_config = None
+        self.subscriber_config = None
+        self.recorder = None
+        self.publisher_config = None
+        self.metrics = None
+        self.metrics_dump_interval = None
+        self.traffic_classes = TrafficClasses()
+        self._nats_connections = {}
+        self._outboxes = {}
+        self._publishers = {}
+        self._loopback_router = LoopbackRouter()
 
     def import_config(self, config):
         self.host =  config['host']
         self.port = config['port']
-        self.bus_type = config['type']
+        self.bus_type = config.get('type', self.NATS)
+        if self.bus_type not in (self.NATS, self.LOOPBACK):
+            # ChatroomBus addresses clients by name, not the service paths
+            raise ValueError("Unsupported bus type '%s', use '%s' or '%s'" %
+                             (self.bus_type, self.NATS, self.LOOPBACK))
+        self.codec = get_codec(config.get('codec'))
+        self.dispatch_config = config.get('dispatch')
+        self.forward = config.get('forward', True)
+        self.traffic_classes = TrafficClasses(config.get('traffic_classes'))
+        self.outbox_config = config.get('outbox')
+        self.subscriber_config = config.get('subscriber')
+        # Fail on a bad outbox config before any client is created
+        outbox_options(self.outbox_config)
+
+        publisher_config = config.get('publisher', {})
+        if publisher_config.get('enable', False):
+            self.publisher_config = publisher_config
+
+        recorder_config = config.get('recorder', {})
+        if recorder_config.get('enable', False):
+            self.recorder = BusRecorder(
+                recorder_config['path'],
+                segment_records=recorder_config.get('segment_records', 1000))
+
+        metrics_config = config.get('metrics', {})
+        if metrics_config.get('enable', False):
+            self.metrics = BusMetrics()
+            self.metrics_dump_interval = metrics_config.get('dump_interval_s')
 
     def create_bus_client(self, path):
         if self.bus_type == self.NATS:
-            self._create_nats_bus_client(path)
-        elif self.bus_type == self.CHATROOM:
-            self._create_chatroom_bus_client(path)
+            return self._create_nats_bus_client(path)
+        elif self.bus_type == self.LOOPBACK:
+            return self._create_loopback_bus_client(path)
         else:
             raise RuntimeError("Unknown bus type {}".format(self.bus_type))
 
     def _create_nats_bus_client(self, path):
-        return NatsBus(self.host, self.port, path)
+        # The class of the path serves its requests, the messages it sends
+        # go by the class of their target, see route
+        traffic_class = self.traffic_classes.classify(path)
+        return NatsBus(self.host, self.port, path,
+                       connection=self._get_nats_connection(traffic_class),
+                       codec=self.codec,
+                       dispatch_config=traffic_class.dispatch_config(
+                           self.dispatch_config),
+                       metrics=self.metrics,
+                       metrics_dump_interval=self.metrics_dump_interval,
+                       publisher=self.get_publisher(traffic_class),
+                       priority=traffic_class.priority,
+                       subscriber_config=self.subscriber_config,
+                       recorder=self.recorder,
+                       route=self.route)
+
+    def route(self, subject):
+        """
+        Returns:
+            TrafficRoute: the connection and publisher of the messages to
+                subject, by the traffic class of its path
+        """
+        traffic_class = self.traffic_classes.classify_subject(subject)
+        return TrafficRoute(traffic_class,
+                            self._get_nats_connection(traffic_class),
+                            self.get_publisher(traffic_class))
+
+    def get_publisher(self, traffic_class):
+        """
+        Returns:
+            PublishPipeline: the writer task of the pubs to traffic_class, a
+                stalled class does not hold up the others. None if the
+                publisher is disabled
+        """
+        if self.publisher_config is None:
+            return None
+        publisher = self._publishers.get(traffic_class.name)
+        if publisher is None:
+            publisher = PublishPipeline(
+                max_depth=self.publisher_config.get('max_depth', 256),
+                batch_size=self.publisher_config.get('batch_size', 32))
+            self._publishers[traffic_class.name] = publisher
+        return publisher
+
+    def _get_nats_connection(self, traffic_class):
+        # The nats bus clients share one pooled connection, except the
+        # classes with a dedicated one, so their frames do not queue behind
+        # the others. A connection is closed when its last client releases it
+        key = traffic_class.name if traffic_class.dedicated_connection else None
+        connection = self._nats_connections.get(key)
+        if connection is None or connection.ref_count == 0:
+            connection = NatsConnection(self.host, self.port,
+                                        outbox=self._get_outbox(key))
+            self._nats_connections[key] = connection
+        return connection
+
+    def _get_outbox(self, key):
+        # One outbox per connection, kept for its next connection, so the
+        # messages and offsets of a spill file have a single owner
+        outbox = self._outboxes.get(key)
+        if outbox is None:
+            config = dict(self.outbox_config or {})
+            if key is not None and 'spill_path' in config:
+                config['spill_path'] = '%s.%s' % (config['spill_path'], key)
+            outbox = create_outbox(config)
+            self._outboxes[key] = outbox
+        return outbox
 
-    def _create_chatroom_bus_client(self, path):
-        return ChatroomBus(self.host, self.port, path)
+    def _create_loopback_bus_client(self, path):
+        # Services in this process talk directly, the other paths go to nats
+        forward = None
+        if self.forward:
+            forward = self._create_nats_bus_client(path)
+        return LoopbackBus(path, self._loopback_router, forward)
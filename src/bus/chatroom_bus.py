@@ -3,14 +3,28 @@
 from chatroom.async_client import AsyncClient as ChatroomClient
 from logzero import logger
 import retrying
-import json
+from bus import codec as bus_codec
+from bus.metrics import MetricsMixin
+from bus.single_flight import SingleFlight
+import time
 
-class ChatroomBus(object):
-    def __init__(self, host, port, path, event_loop=None):
+class ChatroomBus(MetricsMixin):
+    """ RPC over a chatroom server, addressed by client name and method
+
+    It does not serve the services API (req and reg_rep by path, pub by
+    path), so BusManager does not create it for the services.
+    """
+
+    def __init__(self, host, port, path, event_loop=None, codec=None,
+                 metrics=None, metrics_dump_interval=None):
         self._host = host
         self._path = path
+        self._codec = bus_codec.get_codec() if codec is None else codec
+        self._metrics = metrics
+        self._metrics_dump_interval = metrics_dump_interval
         self._chatroom_client = ChatroomClient(path, server_name=host, event_loop=event_loop)
         self._retry_times = 0
+        self._handler_flights = SingleFlight()
 
     async def start(self):
         try:
@@ -23,8 +37,14 @@ class ChatroomBus(object):
 
         self._retry_times = 0
         logger.info("Connect to chatroom server '%s' successfully", self._host)
+        await self._start_metrics(self._metrics_dump_interval)
+
+    async def close(self):
+        # The chatroom client does not hold a shared connection, nothing to release
+        return True
 
     async def req(self, target_path, method, parameters, timeout=1):
+        start = time.perf_counter()
         event = await self._chatroom_client.send_rpc_request(
             target=target_path,
             method=method,
@@ -32,13 +52,22 @@ class ChatroomBus(object):
         )
 
         result = await event.wait(timeout)
+        self._observe_round_trip(target_path, method, start)
         return result
 
-    def reg_rep(self, method_name, callback):
+    def reg_rep(self, method_name, callback, idempotent=False):
+        callback = self._timed_handler(self._path, method_name, callback)
+        if idempotent:
+            callback = self._handler_flights.wrap(method_name, callback)
         return self._chatroom_client.register_rpc_api(method_name, callback)
 
+    def reg_rpc_api(self, method_name, callback, idempotent=False):
+        # The name MetricsMixin registers the metrics method by
+        return self.reg_rep(method_name, callback, idempotent)
+
     async def pub(self, payload):
-        await self._chatroom_client.publish(json.dumps(payload).encode('utf-8'))
+        await self._chatroom_client.publish(
+            self._encode(self._path, 'pub', payload))
         return True
 
     async def reg_sub(self, path, callback):
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import struct
+
+
+class Codec(object):
+    """ Payload codec (abstract)
+
+    Attributes:
+        name (str): the name used to select this codec in config.yaml
+        content_type (str): the content type of the encoded payload
+    """
+
+    name = None
+    content_type = None
+
+    def encode(self, payload):
+        """
+        Args:
+            payload: python object to encode
+        Returns:
+            bytes: encoded payload
+        """
+        raise NotImplementedError()
+
+    def decode(self, data):
+        """
+        Args:
+            data (bytes): the raw message data, e.g. msg.data
+        Returns:
+            the decoded python object
+        """
+        raise NotImplementedError()
+
+
+class JsonCodec(Codec):
+    """ The JSON codec used by the bus before codecs became pluggable
+    """
+
+    name = 'json'
+    content_type = 'application/json'
+
+    def encode(self, payload):
+        return json.dumps(payload, separators=(',', ':')).encode('utf-8')
+
+    def decode(self, data):
+        # json.loads accepts utf-8 bytes, no intermediate str is needed
+        return json.loads(data)
+
+
+# The content type header of a binary payload. 0xC1 never starts a valid
+# utf-8 document, so a payload beginning with it can never be JSON.
+BINARY_MAGIC = 0xC1
+BINARY_VERSION = 0x01
+BINARY_HEADER = bytes([BINARY_MAGIC, BINARY_VERSION])
+
+_TAG_NONE = 0x00
+_TAG_FALSE = 0x01
+_TAG_TRUE = 0x02
+_TAG_INT8 = 0x03
+_TAG_INT32 = 0x04
+_TAG_INT64 = 0x05
+_TAG_BIGINT = 0x06
+_TAG_FLOAT = 0x07
+_TAG_STR8 = 0x08
+_TAG_STR32 = 0x09
+_TAG_BYTES = 0x0A
+_TAG_LIST8 = 0x0B
+_TAG_LIST32 = 0x0C
+_TAG_DICT8 = 0x0D
+_TAG_DICT32 = 0x0E
+_TAG_FLOAT32 = 0x0F
+
+_INT8 = struct.Struct('<Bb')
+_INT32 = struct.Struct('<Bi')
+_INT64 = struct.Struct('<Bq')
+_FLOAT = struct.Struct('<Bd')
+_FLOAT32 = struct.Struct('<Bf')
+_LEN8 = struct.Struct('<BB')
+_LEN32 = struct.Struct('<BI')
+
+_B_NONE = bytes([_TAG_NONE])
+_B_FALSE = bytes([_TAG_FALSE])
+_B_TRUE = bytes([_TAG_TRUE])
+
+
+class BinaryCodec(Codec):
+    """ Compact tagged binary codec
+
+    Every value is a one byte tag followed by a fixed size body. Floats
+    which survive a float32 round-trip (e.g. readings in MAX31856 0.0078125
+    steps) take 5 bytes, others are kept as doubles so values are exact.
+    """
+
+    name = 'binary'
+    content_type = 'application/x-turing-binary'
+
+    def encode(self, payload):
+        parts = [BINARY_HEADER]
+        self._encode(payload, parts.append)
+        return b''.join(parts)
+
+    def decode(self, data):
+        if len(data) < 2 or data[0] != BINARY_MAGIC:
+            raise ValueError("payload is not '%s'" % self.content_type)
+        if data[1] != BINARY_VERSION:
+            raise ValueError("unsupported binary payload version %d" % data[1])
+
+        value, offset = self._decode(data, 2)
+        if offset != len(data):
+            raise ValueError("trailing data in binary payload")
+        return value
+
+    def _encode(self, obj, write):
+        # The subclasses are accepted as JSON does, e.g. an IntEnum or an
+        # OrderedDict. bool goes before int, it is a subclass of int
+        if isinstance(obj, str):
+            raw = obj.encode('utf-8')
+            size = len(raw)
+            if size < 0x100:
+                write(_LEN8.pack(_TAG_STR8, size))
+            else:
+                write(_LEN32.pack(_TAG_STR32, size))
+            write(raw)
+        elif isinstance(obj, float):
+            raw = None
+            if -3.4e38 < obj < 3.4e38:
+                raw = _FLOAT32.pack(_TAG_FLOAT32, obj)
+            if raw is not None and _FLOAT32.unpack(raw)[1] == obj:
+                write(raw)
+            else:
+                write(_FLOAT.pack(_TAG_FLOAT, obj))
+        elif isinstance(obj, bool):
+            write(_B_TRUE if obj else _B_FALSE)
+        elif isinstance(obj, int):
+            if -0x80 <= obj < 0x80:
+                write(_INT8.pack(_TAG_INT8, obj))
+            elif -0x80000000 <= obj < 0x80000000:
+                write(_INT32.pack(_TAG_INT32, obj))
+            elif -0x8000000000000000 <= obj < 0x8000000000000000:
+                write(_INT64.pack(_TAG_INT64, obj))
+            else:
+                raw = str(int(obj)).encode('ascii')
+                write(_LEN32.pack(_TAG_BIGINT, len(raw)))
+                write(raw)
+        elif obj is None:
+            write(_B_NONE)
+        elif isinstance(obj, dict):
+            size = len(obj)
+            if size < 0x100:
+                write(_LEN8.pack(_TAG_DICT8, size))
+            else:
+                write(_LEN32.pack(_TAG_DICT32, size))
+            for key, value in obj.items():
+                if not isinstance(key, str):
+                    raise TypeError("keys must be str, not %s" %
+                                    type(key).__name__)
+                self._encode(key, write)
+                self._encode(value, write)
+        elif isinstance(obj, (list, tuple)):
+            size = len(obj)
+            if size < 0x100:
+                write(_LEN8.pack(_TAG_LIST8, size))
+            else:
+                write(_LEN32.pack(_TAG_LIST32, size))
+            for value in obj:
+                self._encode(value, write)
+        elif isinstance(obj, (bytes, bytearray)):
+            write(_LEN32.pack(_TAG_BYTES, len(obj)))
+            write(obj)
+        else:
+            raise TypeError("Object of type '%s' is not binary serializable" %
+                            type(obj).__name__)
+
+    def _decode(self, data, offset):
+        tag = data[offset]
+        offset += 1
+        if tag == _TAG_STR8:
+            end = offset + 1 + data[offset]
+            return data[offset + 1:end].decode('utf-8'), end
+        elif tag == _TAG_FLOAT32:
+            return _FLOAT32.unpack_from(data, offset - 1)[1], offset + 4
+        elif tag == _TAG_FLOAT:
+            return _FLOAT.unpack_from(data, offset - 1)[1], offset + 8
+        elif tag == _TAG_INT8:
+            return _INT8.unpack_from(data, offset - 1)[1], offset + 1
+        elif tag == _TAG_DICT8 or tag == _TAG_DICT32:
+            if tag == _TAG_DICT8:
+                size = data[offset]
+                offset += 1
+            else:
+                size = _LEN32.unpack_from(data, offset - 1)[1]
+                offset += 4
+            result = {}
+            for _ in range(size):
+                key, offset = self._decode(data, offset)
+                result[key], offset = self._decode(data, offset)
+            return result, offset
+        elif tag == _TAG_LIST8 or tag == _TAG_LIST32:
+            if tag == _TAG_LIST8:
+                size = data[offset]
+                offset += 1
+            else:
+                size = _LEN32.unpack_from(data, offset - 1)[1]
+                offset += 4
+            result = []
+            for _ in range(size):
+                value, offset = self._decode(data, offset)
+                result.append(value)
+            return result, offset
+        elif tag == _TAG_NONE:
+            return None, offset
+        elif tag == _TAG_TRUE:
+            return True, offset
+        elif tag == _TAG_FALSE:
+            return False, offset
+        elif tag == _TAG_INT32:
+            return _INT32.unpack_from(data, offset - 1)[1], offset + 4
+        elif tag == _TAG_INT64:
+            return _INT64.unpack_from(data, offset - 1)[1], offset + 8
+        elif tag == _TAG_STR32:
+            size = _LEN32.unpack_from(data, offset - 1)[1]
+            end = offset + 4 + size
+            return data[offset + 4:end].decode('utf-8'), end
+        elif tag == _TAG_BYTES:
+            size = _LEN32.unpack_from(data, offset - 1)[1]
+            end = offset + 4 + size
+            return bytes(data[offset + 4:end]), end
+        elif tag == _TAG_BIGINT:
+            size = _LEN32.unpack_from(data, offset - 1)[1]
+            end = offset + 4 + size
+            return int(data[offset + 4:end]), end
+
+        raise ValueError("unknown tag 0x%02x at offset %d" % (tag, offset - 1))
+
+
+_JSON_CODEC = JsonCodec()
+_BINARY_CODEC = BinaryCodec()
+
+CODECS = {
+    JsonCodec.name: _JSON_CODEC,
+    BinaryCodec.name: _BINARY_CODEC,
+}
+
+
+def get_codec(name=None):
+    """
+    Args:
+        name (str): codec name in config.yaml, default is 'json'
+    Returns:
+        Codec: the codec instance
+    """
+    if name is None:
+        return _JSON_CODEC
+    if name not in CODECS:
+        raise ValueError("Unknown codec '%s'" % name)
+    return CODECS[name]
+
+
+def content_type_of(data):
+    """
+    Args:
+        data (bytes): raw message data
+    Returns:
+        str: content type of the payload judged by its header
+    """
+    if len(data) > 0 and data[0] == BINARY_MAGIC:
+        return BinaryCodec.content_type
+    return JsonCodec.content_type
+
+
+def codec_of(data):
+    """
+    Args:
+        data (bytes): raw message data
+    Returns:
+        Codec: the codec data is encoded with, judged by its header
+    """
+    if len(data) > 0 and data[0] == BINARY_MAGIC:
+        return _BINARY_CODEC
+    return _JSON_CODEC
+
+
+def decode(data):
+    """ Decode a payload by its content type header
+
+    A bus only chooses the codec it encodes with, it always decodes both
+    formats so machines using different codecs can talk to each other.
+
+    Args:
+        data (bytes): raw message data, e.g. msg.data
+    """
+    return codec_of(data).decode(data)
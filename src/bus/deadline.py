@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import contextlib
+import contextvars
+import time
+
+# The absolute time.time() the request being handled must be answered by
+_deadline = contextvars.ContextVar('bus_deadline', default=None)
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    """ The deadline passed before the request is sent or handled
+
+    It is a timeout, the callers catching the request timeout catch it too.
+    """
+
+
+def current():
+    """
+    Returns:
+        float: the deadline of the request being handled, None if there is
+            no deadline
+    """
+    return _deadline.get()
+
+
+def remaining(default=None):
+    """
+    Returns:
+        float: seconds left before the deadline of the request being
+            handled, can be negative. default if there is no deadline
+    """
+    deadline = _deadline.get()
+    if deadline is None:
+        return default
+    return deadline - time.time()
+
+
+def expired(deadline):
+    return deadline is not None and time.time() >= deadline
+
+
+def derive(timeout):
+    """ The deadline of a new request, never later than the current one
+
+    Args:
+        timeout (float): timeout of the request in second
+    Returns:
+        tuple: (deadline, timeout), the absolute deadline to carry in the
+            envelope and the timeout to wait for the reply
+    Raises:
+        DeadlineExceeded: the current deadline has passed
+    """
+    now = time.time()
+    deadline = now + timeout
+    inherited = _deadline.get()
+    if inherited is not None and inherited < deadline:
+        deadline = inherited
+    if deadline <= now:
+        raise DeadlineExceeded("The deadline passed %.3fs ago" %
+                               (now - deadline))
+    return deadline, deadline - now
+
+
+@contextlib.contextmanager
+def scope(deadline):
+    """ Handle a request under deadline, the nested requests inherit it
+    """
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import time
+from logzero import logger
+from nats.aio.errors import ErrConnectionClosed
+from bus import deadline as bus_deadline
+from lib import tracing
+
+
+class BusyError(Exception):
+    """ The pending queue of the method is full
+    """
+
+    def __init__(self, method):
+        super(BusyError, self).__init__("'%s' is busy" % method)
+        self.method = method
+
+
+class MethodStats(object):
+    """
+    Attributes:
+        handled (int): number of finished calls
+        failed (int): number of calls raised an exception
+        rejected (int): number of calls rejected because the queue is full
+        expired (int): number of calls dropped because their deadline passed
+            while waiting for a worker
+        last_latency (float): handler time of the last call in second
+        max_latency (float): the max handler time in second
+    """
+
+    def __init__(self):
+        self.handled = 0
+        self.failed = 0
+        self.rejected = 0
+        self.expired = 0
+        self.total_latency = 0.0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+
+    def record(self, latency, failed):
+        self.handled += 1
+        if failed:
+            self.failed += 1
+        self.total_latency += latency
+        self.last_latency = latency
+        if latency > self.max_latency:
+            self.max_latency = latency
+
+    def to_dict(self):
+        return {
+            "handled": self.handled,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "expired": self.expired,
+            "avg_latency": (self.total_latency / self.handled
+                            if self.handled > 0 else 0.0),
+            "last_latency": self.last_latency,
+            "max_latency": self.max_latency,
+        }
+
+
+class MethodQueue(object):
+    """ A bounded pending queue served by a fixed number of workers
+    """
+
+    def __init__(self, name, callback, workers, max_pending):
+        """
+        Args:
+            name (str): RPC method name
+            callback (coroutine function): RPC handler
+            workers (int): number of concurrent handler calls
+            max_pending (int): max calls waiting for a worker, 0 to reject the
+                calls when all workers are busy
+        """
+        self.name = name
+        self.callback = callback
+        self._workers = workers
+        self._max_pending = max_pending
+        self._queue = None
+        self._tasks = []
+        self._running = set()
+        self._outstanding = 0
+        self.stats = MethodStats()
+
+    @property
+    def started(self):
+        """ the workers are running """
+        return bool(self._tasks)
+
+    @property
+    def depth(self):
+        """ number of calls waiting for a worker """
+        return max(0, self._outstanding - self._workers)
+
+    def submit(self, parameters, deadline=None, trace=None):
+        """
+        Args:
+            deadline (float): the absolute time.time() the caller waits
+                until, see bus.deadline
+            trace (dict): the span context of the caller, see lib.tracing
+        Returns:
+            asyncio.Future: the result of the handler
+        Raises:
+            BusyError: the pending queue is full
+        """
+        # Queue and workers must be created inside the running event loop
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            loop = asyncio.get_event_loop()
+            self._tasks = [
+                loop.create_task(self._work()) for _ in range(self._workers)
+            ]
+
+        if self._outstanding + 1 - self._workers > self._max_pending:
+            self.stats.rejected += 1
+            raise BusyError(self.name)
+
+        future = asyncio.get_event_loop().create_future()
+        self._outstanding += 1
+        self._queue.put_nowait((parameters, deadline, trace, future))
+        return future
+
+    async def _work(self):
+        while True:
+            parameters, deadline, trace, future = await self._queue.get()
+            if future.cancelled():
+                self._outstanding -= 1
+                continue
+            if bus_deadline.expired(deadline):
+                # The caller has given up, do not start the work
+                self._outstanding -= 1
+                self.stats.expired += 1
+                future.set_exception(bus_deadline.DeadlineExceeded(
+                    "'%s' expired in the queue" % self.name))
+                continue
+
+            start = time.monotonic()
+            failed = False
+            self._running.add(future)
+            try:
+                with bus_deadline.scope(deadline), \
+                        tracing.span(self.name, 'rpc', parent=trace):
+                    result = await self.callback(parameters)
+                if not future.cancelled():
+                    future.set_result(result)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:  # pylint: disable=broad-except
+                failed = True
+                logger.error("RPC method '%s' raised: %s", self.name, e)
+                if not future.cancelled():
+                    future.set_exception(e)
+            finally:
+                self._running.discard(future)
+                self._outstanding -= 1
+            self.stats.record(time.monotonic() - start, failed)
+
+    async def close(self):
+        """ Stop the workers and fail the queued and running calls with
+        ErrConnectionClosed
+        """
+        # The workers drop their running calls once cancelled
+        futures = list(self._running)
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        while self._queue is not None and not self._queue.empty():
+            futures.append(self._queue.get_nowait()[-1])
+        for future in futures:
+            if not future.done():
+                future.set_exception(ErrConnectionClosed())
+        self._tasks = []
+        self._running = set()
+        self._queue = None
+        self._outstanding = 0
+
+
+class RpcDispatcher(object):
+    """ Dispatch RPC requests to per method worker pools
+
+    Every method has its own bounded queue and workers, so a slow handler
+    only delays calls of the same method. Control methods such as
+    'tank.heater' never wait behind a busy 'barista'.
+    """
+
+    DEFAULT_WORKERS = 1
+    DEFAULT_MAX_PENDING = 16
+
+    def __init__(self, config=None):
+        """
+        Args:
+            config (dict): dispatch configuration, e.g.
+                {'workers': 1, 'max_pending': 16,
+                 'methods': {'barista': {'workers': 1, 'max_pending': 4}}}
+        """
+        config = {} if config is None else config
+        self._workers = config.get('workers', self.DEFAULT_WORKERS)
+        self._max_pending = config.get('max_pending', self.DEFAULT_MAX_PENDING)
+        self._method_configs = config.get('methods', {})
+        self._methods = {}
+
+    def register(self, name, callback, workers=None, max_pending=None):
+        """ Register or replace the handler of a method, the calls of the
+        replaced handler fail with ErrConnectionClosed
+        """
+        method_config = self._method_configs.get(name, {})
+        if workers is None:
+            workers = method_config.get('workers', self._workers)
+        if max_pending is None:
+            max_pending = method_config.get('max_pending', self._max_pending)
+        if workers < 1:
+            raise ValueError("RPC method '%s' needs at least one worker" % name)
+        replaced = self._methods.get(name)
+        self._methods[name] = MethodQueue(name, callback, workers, max_pending)
+        if replaced is not None and replaced.started:
+            asyncio.ensure_future(replaced.close())
+
+    def has_method(self, name):
+        return name in self._methods
+
+    def submit(self, name, parameters, deadline=None, trace=None):
+        """
+        Args:
+            deadline (float): the absolute time.time() the caller waits
+                until, the call is dropped if it is still queued by then
+            trace (dict): the span context of the caller, the handler span
+                is its child
+        Returns:
+            asyncio.Future: the result of the handler
+        Raises:
+            KeyError: the method is not registered
+            BusyError: the pending queue of the method is full
+        """
+        return self._methods[name].submit(parameters, deadline, trace)
+
+    def stats(self):
+        """
+        Returns:
+            dict: queue depth and handler latency of each method
+        """
+        result = {}
+        for name, method in self._methods.items():
+            result[name] = method.stats.to_dict()
+            result[name]['depth'] = method.depth
+        return result
+
+    async def close(self):
+        for method in self._methods.values():
+            await method.close()
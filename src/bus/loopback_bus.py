@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import inspect
+from logzero import logger
+
+from lib import tracing
+from bus import deadline as bus_deadline
+from bus.bus import Bus, RpcError
+from bus.single_flight import SingleFlight
+
+
+class LoopbackRouter(object):
+    """ Route messages between the LoopbackBus in the same process
+    """
+
+    def __init__(self):
+        self._buses = {}
+        # {path of req: the bus serving it by reg_rep}
+        self._replies = {}
+        self._subscribers = {}
+        self._local_publishers = set()
+
+    def register(self, bus):
+        self._buses[bus.path] = bus
+
+    def unregister(self, bus):
+        if self._buses.get(bus.path) is bus:
+            del self._buses[bus.path]
+        for path in [path for path, reply_bus in self._replies.items()
+                     if reply_bus is bus]:
+            del self._replies[path]
+
+    def add_reply(self, path, bus):
+        self._replies[path] = bus
+
+    def find_handler(self, path, method):
+        bus = self._buses.get(path)
+        if bus is None:
+            return None
+        return bus.rpc_apis.get(method)
+
+    def find_reply(self, path):
+        bus = self._replies.get(path)
+        if bus is None:
+            return None
+        return bus.rpc_apis.get(path)
+
+    def add_subscriber(self, path, callback):
+        self._subscribers.setdefault(path, []).append(callback)
+
+    def remove_subscriber(self, path, callback):
+        callbacks = self._subscribers.get(path, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+
+    def subscribers(self, path):
+        return self._subscribers.get(path, [])
+
+    def mark_local_publisher(self, path):
+        self._local_publishers.add(path)
+
+    def is_local_publisher(self, path):
+        return path in self._local_publishers
+
+
+class LoopbackBus(Bus):
+    """ In-process bus for services running in the same event loop
+
+    Requests to a path served in this process call the handler directly and
+    publishes are handed to the local subscribers, payloads are passed as
+    python objects without serialization, so handlers and subscribers must
+    not modify them. Paths without a local handler are forwarded to the
+    forward bus (e.g. a NatsBus) when there is one.
+    """
+
+    def __init__(self, path, router, forward=None):
+        """
+        Args:
+            path (str): the path this bus client serves requests on
+            router (LoopbackRouter): the router shared in the process
+            forward (NatsBus): the bus to reach other machines, can be None
+        """
+        self.path = path
+        self._router = router
+        self._forward = forward
+        self._subscriptions = []
+        self._handler_flights = SingleFlight()
+        self.rpc_apis = {}
+
+    async def start(self):
+        self._router.register(self)
+        if self._forward is not None:
+            await self._forward.start()
+
+    async def close(self):
+        self._router.unregister(self)
+        for path, callback in self._subscriptions:
+            self._router.remove_subscriber(path, callback)
+        self._subscriptions = []
+        if self._forward is not None:
+            await self._forward.close()
+
+    ################################################################################
+    #
+    #   Request / Response
+    #
+    ################################################################################
+    def _add_handler(self, name, callback, idempotent):
+        if idempotent:
+            self.rpc_apis[name] = self._handler_flights.wrap(name, callback)
+        else:
+            self.rpc_apis[name] = callback
+
+    async def reg_rpc_api(self, name, callback, idempotent=False, **kwargs):
+        self._add_handler(name, callback, idempotent)
+        if self._forward is not None:
+            await self._forward.reg_rpc_api(name, callback,
+                                            idempotent=idempotent, **kwargs)
+
+    async def reg_rep(self, path, callback, idempotent=False):
+        # Same as NatsBus, the handler is the RPC method named path
+        self._add_handler(path, callback, idempotent)
+        self._router.add_reply(path, self)
+        if self._forward is not None:
+            await self._forward.reg_rep(path, callback, idempotent=idempotent)
+        return True
+
+    async def req(self, path, payload, timeout=1, idempotent=False):
+        callback = self._router.find_reply(path)
+        if callback is not None:
+            return await self._call_local(path, path, callback, payload,
+                                          timeout)
+
+        if self._forward is None:
+            raise RpcError(path, path, "no local handler and no forward bus")
+        return await self._forward.req(path, payload, timeout,
+                                       idempotent=idempotent)
+
+    async def call(self, target_path, method, parameters, timeout=1,
+                   idempotent=False):
+        # Local idempotent handlers are coalesced by the serving bus
+        callback = self._router.find_handler(target_path, method)
+        if callback is not None:
+            return await self._call_local(target_path, method, callback,
+                                          parameters, timeout)
+
+        if self._forward is None:
+            raise RpcError(target_path, method,
+                           "no local handler and no forward bus")
+        return await self._forward.call(target_path, method, parameters,
+                                        timeout, idempotent=idempotent)
+
+    @staticmethod
+    async def _call_local(target_path, method, callback, parameters, timeout):
+        deadline, timeout = bus_deadline.derive(timeout)
+        with bus_deadline.scope(deadline), \
+                tracing.span(target_path, 'bus', {'method': method}):
+            # The handler task copies the context, it sees the deadline
+            task = asyncio.ensure_future(callback(parameters))
+            try:
+                await asyncio.wait_for(asyncio.shield(task), timeout)
+            except asyncio.TimeoutError:
+                if not task.done():
+                    # Same as over nats, the handler keeps running
+                    task.add_done_callback(_discard_result)
+                    raise
+            except Exception:  # pylint: disable=broad-except
+                # Raised below from the task
+                pass
+
+        error = task.exception()
+        if error is not None:
+            # Same as over nats, the caller gets the error of the handler
+            raise RpcError(target_path, method, str(error)) from error
+        return task.result()
+
+    async def req_batch(self, target_path, calls, timeout=1, concurrent=True):
+        local = all(
+            self._router.find_handler(target_path, call['method']) is not None
+            for call in calls)
+        if not local and self._forward is not None:
+            return await self._forward.req_batch(target_path, calls, timeout,
+                                                 concurrent)
+
+        async def _call(call):
+            try:
+                return await self.call(target_path, call['method'],
+                                       call.get('parameters'), timeout)
+            except RpcError as e:
+                return e
+
+        ids = [str(call.get('id', index)) for index, call in enumerate(calls)]
+        if concurrent:
+            outcomes = await asyncio.gather(*[_call(call) for call in calls])
+        else:
+            outcomes = [await _call(call) for call in calls]
+        return dict(zip(ids, outcomes))
+
+    ################################################################################
+    #
+    #   Publish / Subscribe
+    #
+    ################################################################################
+    async def pub(self, path, payload):
+        self._router.mark_local_publisher(path)
+        for callback in list(self._router.subscribers(path)):
+            await self._deliver(callback, payload)
+
+        # Subscribers on other machines cannot be known, always forward
+        if self._forward is not None:
+            await self._forward.pub(path, payload)
+        return True
+
+    async def reg_sub(self, path, callback):
+        self._router.add_subscriber(path, callback)
+        self._subscriptions.append((path, callback))
+
+        if self._forward is not None:
+            router = self._router
+
+            def remote(data):
+                # The local publisher already delivered it
+                if router.is_local_publisher(path):
+                    return None
+                return callback(data)
+
+            await self._forward.reg_sub(path, remote)
+        return True
+
+    @staticmethod
+    async def _deliver(callback, payload):
+        try:
+            result = callback(payload)
+            if inspect.isawaitable(result):
+                await result
+        except Exception as e:  # pylint: disable=broad-except
+            logger.error("Loopback subscriber raised: %s", e)
+
+
+def _discard_result(task):
+    # Nobody waits for a handler which ran over the timeout
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Loopback handler raised after the timeout: %s",
+                     task.exception())
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import inspect
+import time
+from array import array
+from logzero import logger
+from bus import codec as bus_codec
+
+
+class LogHistogram(object):
+    """ Fixed memory histogram with power of two buckets
+
+    Bucket i counts the samples in [2^(i-1), 2^i) units, bucket 0 counts the
+    samples under one unit. The counters live in a preallocated array, so
+    recording a sample does not allocate.
+    """
+
+    BUCKETS = 32
+
+    def __init__(self, unit):
+        """
+        Args:
+            unit (float): the value of one unit, e.g. 1e-6 for microseconds
+        """
+        self._scale = 1.0 / unit
+        self._unit = unit
+        self._buckets = array('Q', [0] * LogHistogram.BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        index = int(value * self._scale).bit_length()
+        if index >= LogHistogram.BUCKETS:
+            index = LogHistogram.BUCKETS - 1
+        self._buckets[index] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        """
+        Returns:
+            float: the upper bound of the bucket the percentile falls in
+        """
+        if self.count == 0:
+            return 0.0
+        rank = self.count * percent / 100.0
+        seen = 0
+        for index, counter in enumerate(self._buckets):
+            seen += counter
+            if seen >= rank:
+                return min(self.max, (1 << index) * self._unit)
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "avg": self.total / self.count if self.count > 0 else 0.0,
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
+
+
+class SubjectMetrics(object):
+    """ Traffic of one subject and method
+    """
+
+    def __init__(self):
+        self.messages_out = 0
+        self.messages_in = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.encode_time = LogHistogram(1e-6)
+        self.decode_time = LogHistogram(1e-6)
+        self.handler_time = LogHistogram(1e-6)
+        self.round_trip_time = LogHistogram(1e-6)
+        self.payload_size = LogHistogram(1)
+
+    def to_dict(self):
+        return {
+            "messages_out": self.messages_out,
+            "messages_in": self.messages_in,
+            "bytes_out": self.bytes_out,
+            "bytes_in": self.bytes_in,
+            "encode_time": self.encode_time.to_dict(),
+            "decode_time": self.decode_time.to_dict(),
+            "handler_time": self.handler_time.to_dict(),
+            "round_trip_time": self.round_trip_time.to_dict(),
+            "payload_size": self.payload_size.to_dict(),
+        }
+
+
+class BusMetrics(object):
+    """ Per subject and method bus metrics, shared by the bus clients
+    """
+
+    def __init__(self):
+        self._subjects = {}
+        self._dump_task = None
+
+    def get(self, subject, method):
+        key = (subject, method)
+        metrics = self._subjects.get(key)
+        if metrics is None:
+            metrics = SubjectMetrics()
+            self._subjects[key] = metrics
+        return metrics
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: {subject: {method: metrics}}
+        """
+        result = {}
+        for (subject, method), metrics in self._subjects.items():
+            result.setdefault(subject, {})[str(method)] = metrics.to_dict()
+        return result
+
+    def dump(self):
+        for (subject, method), metrics in sorted(self._subjects.items(),
+                                                 key=lambda item: str(item[0])):
+            rtt = metrics.round_trip_time
+            handler = metrics.handler_time
+            logger.info(
+                "bus '%s' '%s': out %d msgs/%d bytes, in %d msgs/%d bytes, "
+                "rtt p50 %.6fs p99 %.6fs, handler p50 %.6fs p99 %.6fs",
+                subject, method, metrics.messages_out, metrics.bytes_out,
+                metrics.messages_in, metrics.bytes_in, rtt.percentile(50),
+                rtt.percentile(99), handler.percentile(50),
+                handler.percentile(99))
+
+    def start_dump(self, interval):
+        """ Dump the metrics into log every interval seconds
+        """
+        if interval is None or self._dump_task is not None:
+            return
+        self._dump_task = asyncio.ensure_future(self._dump_periodically(interval))
+
+    async def _dump_periodically(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            self.dump()
+
+    def stop_dump(self):
+        if self._dump_task is not None:
+            self._dump_task.cancel()
+            self._dump_task = None
+
+
+class MetricsMixin(object):
+    """ Instrument the codec, handlers and requests of a bus client
+
+    A bus using this mixin encodes and decodes through _encode/_decode,
+    wraps its RPC handlers with _timed_handler and measures requests with
+    _observe_round_trip. Every helper costs one attribute check when the
+    bus has no metrics.
+    """
+
+    _metrics = None
+
+    def _encode(self, subject, method, payload):
+        if self._metrics is None:
+            return self._codec.encode(payload)
+
+        start = time.perf_counter()
+        data = self._codec.encode(payload)
+        metrics = self._metrics.get(subject, method)
+        metrics.encode_time.record(time.perf_counter() - start)
+        metrics.messages_out += 1
+        metrics.bytes_out += len(data)
+        metrics.payload_size.record(len(data))
+        return data
+
+    def _decode(self, subject, data, method=None):
+        """
+        Args:
+            method (str): the method of the message, read from the decoded
+                envelope if it is None
+        """
+        if self._metrics is None:
+            return bus_codec.decode(data)
+
+        start = time.perf_counter()
+        payload = bus_codec.decode(data)
+        elapsed = time.perf_counter() - start
+        if method is None and isinstance(payload, dict):
+            method = payload.get('method')
+        metrics = self._metrics.get(subject, method)
+        metrics.decode_time.record(elapsed)
+        metrics.messages_in += 1
+        metrics.bytes_in += len(data)
+        metrics.payload_size.record(len(data))
+        return payload
+
+    def _timed_handler(self, subject, method, callback):
+        if self._metrics is None:
+            return callback
+
+        handler_time = self._metrics.get(subject, method).handler_time
+
+        if not asyncio.iscoroutinefunction(callback):
+            def wrap(parameters):
+                start = time.perf_counter()
+                try:
+                    return callback(parameters)
+                finally:
+                    handler_time.record(time.perf_counter() - start)
+
+            return wrap
+
+        async def async_wrap(parameters):
+            start = time.perf_counter()
+            try:
+                return await callback(parameters)
+            finally:
+                handler_time.record(time.perf_counter() - start)
+
+        return async_wrap
+
+    def _observe_round_trip(self, subject, method, start):
+        if self._metrics is not None:
+            self._metrics.get(subject, method).round_trip_time.record(
+                time.perf_counter() - start)
+
+    async def _start_metrics(self, dump_interval=None):
+        """ Serve the 'metrics' RPC method and start the periodic log dump
+        """
+        if self._metrics is None:
+            return
+
+        async def metrics_api(_):
+            return self._metrics.snapshot()
+
+        registered = self.reg_rpc_api('metrics', metrics_api)
+        if inspect.isawaitable(registered):
+            await registered
+        self._metrics.start_dump(dump_interval)
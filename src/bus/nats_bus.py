@@ -2,90 +2,584 @@ from nats.aio.client import Client as NATS
 from nats.aio.errors import ErrConnectionClosed, ErrTimeout, ErrNoServers
 
 from logzero import logger
+from lib import tracing
 from lib.retrying import retry
+from bus import codec as bus_codec
+from bus import deadline as bus_deadline
+from bus.bus import RpcError
+from bus.dispatcher import RpcDispatcher, BusyError
+from bus.metrics import MetricsMixin
+from bus.outbox import create_outbox
+from bus.recorder import IN, OUT
+from bus.request_mux import RequestMultiplexer
+from bus.single_flight import SingleFlight, flight_key
+from bus.subscriber import Subscriber
 
-import json
-import uuid
+import asyncio
+import functools
+import itertools
+import time
 
-def _log_retry_attempt_times(self, message):
+# Only a server which cannot be reached is worth another attempt, e.g. a
+# TypeError of an incompatible client must fail
+_CONNECT_ERRORS = (ErrNoServers, OSError, asyncio.TimeoutError)
+
+def _log_retry_attempt_times(message):
 
     def wrapper(attempt_times):
         logger.info("{}, {} times".format(message, attempt_times))
 
     return wrapper
 
-class NatsBus(object):
-    def __init__(self, host, port, path):
+class NatsConnection(object):
+    """ A reference counted NATS client shared by all NatsBus on the same server
+
+    Every NatsBus created from the same NatsConnection multiplexes its
+    subscriptions over a single TCP connection, reader task and ping loop,
+    and its requests over a single reply inbox.
+    """
+
+    def __init__(self, host, port, outbox=None):
+        """
+        Args:
+            outbox (Outbox): keep the publishes while disconnected, a
+                drop_oldest outbox is created if it is None
+        """
         self._nats_client = NATS()
         self._url = "nats://%s:%d" % (host, port)
+        self._ref_count = 0
+        self._connect_lock = None
+        self._request_mux = None
+        self._outbox = create_outbox() if outbox is None else outbox
+
+    @property
+    def outbox(self):
+        return self._outbox
+
+    @property
+    def client(self):
+        return self._nats_client
+
+    @property
+    def url(self):
+        return self._url
+
+    @property
+    def ref_count(self):
+        return self._ref_count
+
+    @property
+    def is_connected(self):
+        return self._nats_client.is_connected
+
+    def acquire(self):
+        self._ref_count += 1
+        return self
+
+    async def release(self):
+        self._ref_count -= 1
+        if self._ref_count > 0:
+            return
+
+        self._ref_count = 0
+        await self._outbox.close()
+        if self._request_mux is not None:
+            await self._request_mux.close()
+            self._request_mux = None
+        if self._nats_client.is_connected:
+            logger.info("Close nats connection '%s'", self._url)
+            await self._nats_client.close()
+
+    async def connect(self):
+        # The lock must be created inside the running event loop
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+
+        async with self._connect_lock:
+            if self._nats_client.is_connected:
+                return
+            await self._connect()
+        # The messages kept by the last run or a failed connection
+        self._drain_outbox()
+
+    async def publish(self, subject, data):
+        """ Publish now, or keep it in the outbox while disconnected
+
+        Returns:
+            bool: False if the message is kept in the outbox
+        """
+        if self._nats_client.is_connected and len(self._outbox) == 0:
+            try:
+                await self._nats_client.publish(subject, data)
+                return True
+            except ErrConnectionClosed:
+                pass
+
+        # Keep the order, the newer message waits behind the kept ones
+        self._outbox.put(subject, data)
+        self._drain_outbox()
+        return False
+
+    def _drain_outbox(self):
+        if self._nats_client.is_connected:
+            self._outbox.start_drain(self._nats_client.publish,
+                                     lambda: self._nats_client.is_connected)
+
+    async def _on_reconnected(self):
+        logger.info("Reconnect to nats server '%s'", self._url)
+        self._drain_outbox()
+
+    async def request(self, subject, payload, timeout=1):
+        """ Send a request through the shared reply inbox
+
+        Returns:
+            Msg: the reply message
+        Raises:
+            ErrTimeout: no reply within timeout seconds
+        """
+        if self._request_mux is None:
+            self._request_mux = RequestMultiplexer(self._nats_client)
+        return await self._request_mux.request(subject, payload, timeout)
+
+    @retry(wait_exponential_multiplier=100, wait_exponential_max=10000,
+           wait_jitter_max=500, retry_on_exception=_CONNECT_ERRORS,
+           before_attempts=_log_retry_attempt_times("Try to connect to nats server"))
+    async def _connect(self):
+        try:
+            await self._nats_client.connect(
+                servers=[self._url], reconnected_cb=self._on_reconnected)
+        except _CONNECT_ERRORS as e:
+            logger.error("Cannot connect to nats server '%s': %s", self._url,
+                         e)
+            raise e
+
+        logger.info("Connect to nats server '%s' successfully", self._url)
+
+
+class NatsBus(MetricsMixin):
+    def __init__(self, host, port, path, connection=None, codec=None,
+                 dispatch_config=None, metrics=None,
+                 metrics_dump_interval=None, publisher=None, priority=1,
+                 subscriber_config=None, recorder=None, route=None):
+        """
+        Args:
+            host (str): nats server host
+            port (int): nats server port
+            path (str): the path this bus client serves requests on
+            connection (NatsConnection): shared connection, a private one is
+                created if it is None
+            codec (Codec): codec to encode outgoing payloads, default is JSON.
+                Incoming payloads are decoded by their content type header.
+            dispatch_config (dict): workers and pending queue size of the RPC
+                methods, see RpcDispatcher
+            metrics (BusMetrics): record the traffic into it, can be None
+            metrics_dump_interval (int): dump metrics into log every interval
+                seconds, None to disable
+            publisher (PublishPipeline): send the pubs from its writer task,
+                None to send them in pub
+            priority (int): the publisher sends the pubs of a lower priority
+                first, see TrafficClass
+            subscriber_config (dict): default queue of reg_sub, e.g.
+                {'max_pending': 16, 'policy': 'drop'}, see Subscriber
+            recorder (BusRecorder): record the raw messages into it, can be
+                None
+            route (function): route(subject) returns the TrafficRoute of the
+                requests and pubs to subject, None to send them all through
+                connection, publisher and priority
+        """
+        if connection is None:
+            connection = NatsConnection(host, port)
+        self._connection = connection.acquire()
+        self._codec = bus_codec.get_codec() if codec is None else codec
         self._path = path
+        self._sids = []
+        self._dispatcher = RpcDispatcher(dispatch_config)
+        self._metrics = metrics
+        self._metrics_dump_interval = metrics_dump_interval
+        self._publisher = publisher
+        self._priority = priority
+        self._subscriber_config = ({} if subscriber_config is None else
+                                   subscriber_config)
+        self._subscribers = []
+        self._pub_subjects = {}
+        self._recorder = recorder
+        self._route = route
+        # {subject: (connection, publisher, priority)}
+        self._routes = {}
+        # The connections of other traffic classes this bus sends to
+        self._out_connections = []
+        self._connect_tasks = {}
+        self._request_ids = itertools.count(1)
+        self._idempotent_methods = set()
+        self._handler_flights = SingleFlight()
+        self._request_flights = SingleFlight()
+        # Requests dropped because the caller had given up
+        self.expired_requests = 0
         self.rpc_apis = {}
 
+    @property
+    def _nats_client(self):
+        return self._connection.client
+
+    @property
+    def _url(self):
+        return self._connection.url
+
     ################################################################################
     #
     #   Request / Response
     #
     ################################################################################
+    def _tap(self, direction, subject, data):
+        if self._recorder is not None:
+            self._recorder.record(direction, subject, data)
+
     async def on_request(self, msg):
-        error = None 
-        result = None 
+        self._tap(IN, msg.subject, msg.data)
+        data = self._decode(self._path, msg.data)
+        deadline = data.get('deadline')
+        if bus_deadline.expired(deadline):
+            # Nobody waits for the reply
+            self.expired_requests += 1
+            logger.debug("Drop expired request '%s' on '%s'",
+                         data.get('method', 'batch'), self._path)
+            return
 
-        data = json.loads(msg.data.decode())
+        # Reply in another task, so the subscription keeps delivering
+        # requests while the handlers are running
+        if 'batch' in data:
+            asyncio.ensure_future(self._reply_batch(msg.reply, data))
+            return
 
         id = data.get('id')
         method = data.get('method')
         parameters = data.get('parameters')
 
-        callback = self.rpc_apis.get(method)
-        if callback is None:
-            error = "The method is not existing".format(method)
-        else:
-            result = await callback(parameters)
-
-        if error is not None:
-            await self.pub(msg.reply, dict(
+        try:
+            future = self._submit(method, parameters, deadline,
+                                  data.get('trace'))
+        except LookupError as e:
+            await self._reply(msg.reply, method, dict(
+                id=id,
+                error=str(e)
+            ))
+            return
+        except BusyError as e:
+            await self._reply(msg.reply, method, dict(
                 id=id,
-                error=error
+                error=str(e),
+                busy=True
             ))
+            return
+
+        asyncio.ensure_future(self._reply_result(msg.reply, id, method, future))
+
+    def _submit(self, method, parameters, deadline=None, trace=None):
+        if not self._dispatcher.has_method(method):
+            raise LookupError("The method '{}' is not existing".format(method))
+
+        if method in self._idempotent_methods:
+            key = flight_key(method, parameters)
+            if key is not None:
+                return self._handler_flights.join(
+                    key, lambda: self._dispatcher.submit(method, parameters,
+                                                         deadline, trace))
+        return self._dispatcher.submit(method, parameters, deadline, trace)
+
+    async def _call(self, method, parameters, deadline=None, trace=None):
+        try:
+            return dict(result=await self._submit(method, parameters,
+                                                  deadline, trace))
+        except BusyError as e:
+            return dict(error=str(e), busy=True)
+        except Exception as e:  # pylint: disable=broad-except
+            return dict(error=str(e))
+
+    async def _reply_batch(self, reply, data):
+        entries = data['batch']
+        deadline = data.get('deadline')
+        trace = data.get('trace')
+        if data.get('concurrent', True):
+            outcomes = await asyncio.gather(*[
+                self._call(entry.get('method'), entry.get('parameters'),
+                           deadline, trace)
+                for entry in entries
+            ])
         else:
-            await self.pub(msg.reply, dict(
+            outcomes = []
+            for entry in entries:
+                outcomes.append(await self._call(entry.get('method'),
+                                                 entry.get('parameters'),
+                                                 deadline, trace))
+
+        await self._reply(reply, 'batch', dict(
+            id=data.get('id'),
+            results={str(entry.get('id')): outcome
+                     for entry, outcome in zip(entries, outcomes)}
+        ))
+
+    async def _reply_result(self, reply, id, method, future):
+        try:
+            result = await future
+        except Exception as e:  # pylint: disable=broad-except
+            await self._reply(reply, method, dict(
                 id=id,
-                result=result
+                error=str(e)
             ))
+            return
+
+        await self._reply(reply, method, dict(
+            id=id,
+            result=result
+        ))
 
-    async def reg_rpc_api(self, name, callback):
+    async def _reply(self, reply, method, payload):
+        # Reply subjects are unique inboxes, count replies under our path
+        data = self._encode(self._path, method, payload)
+        self._tap(OUT, reply, data)
+        await self._nats_client.publish(reply, data)
+
+    async def reg_rpc_api(self, name, callback, workers=None, max_pending=None,
+                          idempotent=False):
+        """
+        Args:
+            name (str): RPC method name
+            callback (coroutine function): RPC handler
+            workers (int): concurrent calls of this method, default from
+                dispatch_config
+            max_pending (int): requests waiting for a worker, the requests
+                over it get a busy error reply
+            idempotent (bool): concurrent requests with the same parameters
+                share one handler call and its result
+        """
+        self._dispatcher.register(
+            name, self._timed_handler(self._path, name, callback), workers,
+            max_pending)
+        if idempotent:
+            self._idempotent_methods.add(name)
+        else:
+            self._idempotent_methods.discard(name)
         self.rpc_apis[name] = callback
 
-    @retry(before_attempts=_log_retry_attempt_times("Try to connect to nats server"))
+    def rpc_stats(self):
+        """
+        Returns:
+            dict: queue depth and handler latency of each RPC method
+        """
+        return self._dispatcher.stats()
+
+    async def reg_rep(self, path, callback, idempotent=False):
+        """ Serve the req(path, payload) of the services on path + '.rep'
+
+        The handler is registered as the RPC method named path, it is
+        dispatched and configured like the other methods.
+
+        Args:
+            callback (coroutine function): callback(payload) returns the
+                response
+        """
+        self.check_connection()
+
+        await self.reg_rpc_api(path, callback, idempotent=idempotent)
+        sid = await self._nats_client.subscribe(path + '.rep',
+                                                cb=self.on_request)
+        self._sids.append(sid)
+        return True
+
     async def start(self):
-        try:
-            await self._nats_client.connect(servers=[self._url])
-            await self._nats_client.subscribe(self._path, cb=self.on_request)
-        except ErrNoServers as e:
-            logger.error("Cannot connect to nats server '%s'", self._url)
-            raise e
+        await self._connection.connect()
+        sid = await self._nats_client.subscribe(self._path, cb=self.on_request)
+        self._sids.append(sid)
+        await self._start_metrics(self._metrics_dump_interval)
 
-        logger.info("Connect to nats server '%s' successfully", self._url)
+    async def close(self):
+        """ Remove the subscriptions of this bus and release the shared connection
+        """
+        if self._nats_client.is_connected:
+            for sid in self._sids:
+                await self._nats_client.unsubscribe(sid)
+        self._sids = []
+        for subscriber in self._subscribers:
+            await subscriber.close()
+        self._subscribers = []
+        for subject, publisher in self._pub_subjects.items():
+            await publisher.flush(subject)
+        self._pub_subjects = {}
+        await self._dispatcher.close()
+        await self._connection.release()
+        for task in self._connect_tasks.values():
+            task.cancel()
+        self._connect_tasks = {}
+        for connection in self._out_connections:
+            await connection.release()
+        self._out_connections = []
+        self._routes = {}
+
+    def _route_of(self, subject):
+        """ The traffic class of the target, not of this bus, picks the
+        connection, so a control request is not queued behind bulk frames
+
+        Returns:
+            tuple: (NatsConnection, PublishPipeline, priority) of subject
+        """
+        route = self._routes.get(subject)
+        if route is None:
+            if self._route is None:
+                route = (self._connection, self._publisher, self._priority)
+            else:
+                traffic_route = self._route(subject)
+                connection = traffic_route.connection
+                if (connection is not self._connection and
+                        connection not in self._out_connections):
+                    self._out_connections.append(connection.acquire())
+                route = (connection, traffic_route.publisher,
+                         traffic_route.traffic_class.priority)
+            self._routes[subject] = route
+
+        return route
+
+    def _connect_in_background(self, connection):
+        # The pubs go to the outbox meanwhile, the sensor loops must not wait
+        task = self._connect_tasks.get(connection)
+        if task is None or task.done():
+            task = asyncio.ensure_future(connection.connect())
+            self._connect_tasks[connection] = task
+        return task
 
     def check_connection(self):
         if not self._nats_client.is_connected:
             raise ConnectionError("The connection has not been established")
-        
+
         return True
 
-    async def req(self, target_path, method, parameters, timeout=1):
+    async def req(self, path, payload, timeout=1, idempotent=False):
+        """ Send payload to the handler registered by reg_rep(path)
+
+        Returns:
+            the response of the handler
+        Raises:
+            RpcError: the handler raised an error
+        """
+        return await self.call(path + '.rep', path, payload, timeout,
+                               idempotent=idempotent)
+
+    async def call(self, target_path, method, parameters, timeout=1,
+                   idempotent=False):
+        """ Call the RPC method of the bus client serving target_path
+
+        Args:
+            timeout (float): seconds to wait for the reply, shortened to the
+                deadline of the request being handled. The handler drops the
+                request if it is not started before the deadline
+            idempotent (bool): share one in-flight request with the concurrent
+                identical requests of this bus client, the shared result must
+                not be modified
+        Raises:
+            DeadlineExceeded: the deadline of the request being handled has
+                passed
+        """
         self.check_connection()
 
-        id = str(uuid.uuid1())
+        if idempotent:
+            key = flight_key(target_path, method, parameters)
+            if key is not None:
+                return await asyncio.shield(self._request_flights.join(
+                    key, lambda: self._req(target_path, method, parameters,
+                                           timeout)))
+        return await self._req(target_path, method, parameters, timeout)
+
+    async def _req(self, target_path, method, parameters, timeout):
+        deadline, timeout = bus_deadline.derive(timeout)
         payload = dict(
-                id=id,
+                id=next(self._request_ids),
                 method=method,
-                parameters=parameters
-        ) 
-        return await self._nats_client.timed_request(
-                target_path, 
-                json.dumps(payload).encode('utf-8'), 
+                parameters=parameters,
+                deadline=deadline
+        )
+        with tracing.span(target_path, 'bus', {'method': method}) as span:
+            trace = span.context()
+            if trace is not None:
+                payload['trace'] = trace
+            start = time.perf_counter()
+            response = await self.request_raw(
+                    target_path,
+                    self._encode(target_path, method, payload),
+                    timeout)
+            self._observe_round_trip(target_path, method, start)
+
+        data = self._decode(target_path, response.data, method)
+        if data.get('error') is not None:
+            raise RpcError(target_path, method, data['error'],
+                           busy=data.get('busy', False))
+        return data.get('result')
+
+    async def request_raw(self, subject, data, timeout=1):
+        """ Send an encoded request, e.g. replayed by BusReplayer
+
+        Returns:
+            Msg: the reply message
+        """
+        connection, _, _ = self._route_of(subject)
+        if connection is not self._connection and not connection.is_connected:
+            await asyncio.wait_for(
+                asyncio.shield(self._connect_in_background(connection)),
                 timeout)
+        self._tap(OUT, subject, data)
+        response = await connection.request(subject, data, timeout)
+        self._tap(IN, response.subject, response.data)
+        return response
+
+    async def req_batch(self, target_path, calls, timeout=1, concurrent=True):
+        """ Send several RPC calls to target_path in one round-trip
+
+        Args:
+            calls (list): [{'id': str, 'method': str, 'parameters': ...}],
+                'id' is optional, the index of the call is used by default
+            concurrent (bool): run the calls concurrently on the handler
+                side, otherwise one by one in order
+        Returns:
+            dict: the result of each call keyed by id, the result of a
+                failed call is an RpcError instead of raising it
+        """
+        self.check_connection()
+
+        batch = []
+        for index, call in enumerate(calls):
+            batch.append(dict(
+                id=str(call.get('id', index)),
+                method=call['method'],
+                parameters=call.get('parameters')
+            ))
+        deadline, timeout = bus_deadline.derive(timeout)
+        payload = dict(
+                id=next(self._request_ids),
+                batch=batch,
+                concurrent=concurrent,
+                deadline=deadline
+        )
+        with tracing.span(target_path, 'bus', {'method': 'batch'}) as span:
+            trace = span.context()
+            if trace is not None:
+                payload['trace'] = trace
+            start = time.perf_counter()
+            response = await self.request_raw(
+                    target_path,
+                    self._encode(target_path, 'batch', payload),
+                    timeout)
+            self._observe_round_trip(target_path, 'batch', start)
+
+        data = self._decode(target_path, response.data, 'batch')
+        outcomes = data.get('results', {})
+        results = {}
+        for call in batch:
+            outcome = outcomes.get(call['id'], {'error': 'no result'})
+            if outcome.get('error') is not None:
+                results[call['id']] = RpcError(
+                    target_path, call['method'], outcome['error'],
+                    busy=outcome.get('busy', False))
+            else:
+                results[call['id']] = outcome.get('result')
+        return results
 
     ################################################################################
     #
@@ -93,21 +587,74 @@ class NatsBus(object):
     #
     ################################################################################
     async def pub(self, path, payload):
-        self.check_connection()
+        """ Publish payload on path + '.pub' for reg_sub(path)
 
-        await self._nats_client.publish(self._path + '.pub',
-                                        json.dumps(payload).encode('utf-8'))
-        return True
+        Returns:
+            bool: False if it is kept in the outbox until reconnected, or
+                dropped by the full publisher queue
+        """
+        subject = path + '.pub'
+        _, publisher, priority = self._route_of(subject)
+        if publisher is not None:
+            self._pub_subjects[subject] = publisher
+            return publisher.publish(
+                subject, payload, functools.partial(self._send_pub, subject),
+                priority)
+        return await self._send_pub(subject, payload)
+
+    async def _send_pub(self, subject, payload):
+        return await self.publish_raw(subject,
+                                      self._encode(subject, 'pub', payload))
+
+    async def publish_raw(self, subject, data):
+        """ Publish encoded data, e.g. replayed by BusReplayer
+        """
+        connection, _, _ = self._route_of(subject)
+        if connection is not self._connection and not connection.is_connected:
+            self._connect_in_background(connection)
+        self._tap(OUT, subject, data)
+        return await connection.publish(subject, data)
 
-    async def reg_sub(self, path, callback):
+    async def reg_sub(self, path, callback, max_pending=None, policy=None):
+        """
+        Args:
+            callback (function): callback(payload), a plain or coroutine
+                function, called from the own task of this subscription
+            max_pending (int): max messages waiting for the callback,
+                default from subscriber_config
+            policy (str): 'drop' the incoming messages when the queue is
+                full or 'conflate' to the latest message, default from
+                subscriber_config
+        """
         self.check_connection()
 
+        subject = path + '.pub'
+        if max_pending is None:
+            max_pending = self._subscriber_config.get('max_pending', 16)
+        if policy is None:
+            policy = self._subscriber_config.get('policy', Subscriber.DROP)
+        subscriber = Subscriber(
+            subject, callback,
+            decode=lambda data: self._decode(subject, data, 'sub'),
+            max_pending=max_pending, policy=policy)
+
         async def wrap(msg):
-            data = json.loads(msg.data.decode())
-            callback(data)
+            self._tap(IN, msg.subject, msg.data)
+            subscriber.put(msg.data)
 
-        await self._nats_client.subscribe(
-            path + '.pub', 
+        sid = await self._nats_client.subscribe(
+            subject,
             cb=wrap)
+        self._sids.append(sid)
+        self._subscribers.append(subscriber)
 
         return True
+
+    def subscriber_stats(self):
+        """
+        Returns:
+            list: queue depth, drops and lag of each subscriber, in the
+                order of reg_sub
+        """
+        return [dict(subscriber.stats(), subject=subscriber.subject)
+                for subscriber in self._subscribers]
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import os
+import struct
+from collections import OrderedDict, deque
+from logzero import logger
+
+
+class Outbox(object):
+    """ Bounded store of the publishes made while the bus is disconnected (abstract)
+
+    The stored messages are drained in batches after reconnecting, with a
+    pause between two batches so the requests and replies are not starved.
+
+    Attributes:
+        policy (str): the name used to select this outbox in config.yaml
+        options (tuple): the config keys this outbox takes
+        required (tuple): the config keys this outbox cannot go without
+        dropped (int): number of messages dropped because the outbox is full
+    """
+
+    policy = None
+    options = ('drain_batch', 'drain_interval_ms')
+    required = ()
+
+    def __init__(self, drain_batch=20, drain_interval_ms=50):
+        """
+        Args:
+            drain_batch (int): messages published before each pause
+            drain_interval_ms (int): the pause between two batches
+        """
+        self._drain_batch = drain_batch
+        self._drain_interval = float(drain_interval_ms) / 1000
+        self._drain_task = None
+        self.dropped = 0
+
+    def __len__(self):
+        raise NotImplementedError()
+
+    def put(self, subject, data):
+        """
+        Args:
+            subject (str): nats subject
+            data (bytes): encoded payload
+        """
+        raise NotImplementedError()
+
+    def pop(self):
+        """
+        Returns:
+            tuple: (subject, data) of the next message, None if it is empty
+        """
+        raise NotImplementedError()
+
+    def push_front(self, subject, data):
+        """ Give back a popped message which could not be published
+        """
+        raise NotImplementedError()
+
+    async def drain(self, publish, is_connected):
+        """
+        Args:
+            publish (coroutine function): publish(subject, data)
+            is_connected (function): stop draining when it returns False
+        """
+        while is_connected():
+            for _ in range(self._drain_batch):
+                message = self.pop()
+                if message is None:
+                    return
+                try:
+                    await publish(*message)
+                except Exception as e:  # pylint: disable=broad-except
+                    logger.warning("Stop draining the outbox: %s", e)
+                    self.push_front(*message)
+                    return
+            await asyncio.sleep(self._drain_interval)
+
+    def start_drain(self, publish, is_connected):
+        """ Drain in a background task unless it is draining already
+        """
+        if len(self) == 0:
+            return
+        if self._drain_task is not None and not self._drain_task.done():
+            return
+        self._drain_task = asyncio.ensure_future(
+            self.drain(publish, is_connected))
+
+    async def close(self):
+        if self._drain_task is not None:
+            self._drain_task.cancel()
+            try:
+                await self._drain_task
+            except asyncio.CancelledError:
+                pass
+            self._drain_task = None
+
+
+class DropOldestOutbox(Outbox):
+    """ Keep the newest max_messages of each subject
+    """
+
+    policy = 'drop_oldest'
+    options = Outbox.options + ('max_messages',)
+
+    def __init__(self, max_messages=100, **kwargs):
+        super(DropOldestOutbox, self).__init__(**kwargs)
+        self._max_messages = max_messages
+        self._queues = OrderedDict()
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    def put(self, subject, data):
+        queue = self._queues.get(subject)
+        if queue is None:
+            queue = deque()
+            self._queues[subject] = queue
+        if len(queue) >= self._max_messages:
+            queue.popleft()
+            self.dropped += 1
+            self._length -= 1
+        queue.append(data)
+        self._length += 1
+
+    def pop(self):
+        # Round robin, a chatty subject does not delay the others
+        if self._length == 0:
+            return None
+        subject, queue = next(iter(self._queues.items()))
+        data = queue.popleft()
+        self._length -= 1
+        if queue:
+            self._queues.move_to_end(subject)
+        else:
+            del self._queues[subject]
+        return subject, data
+
+    def push_front(self, subject, data):
+        queue = self._queues.get(subject)
+        if queue is None:
+            queue = deque()
+            self._queues[subject] = queue
+        self._queues.move_to_end(subject, last=False)
+        queue.appendleft(data)
+        self._length += 1
+
+
+class KeepLatestOutbox(Outbox):
+    """ Keep only the latest message of each subject
+    """
+
+    policy = 'keep_latest'
+
+    def __init__(self, **kwargs):
+        super(KeepLatestOutbox, self).__init__(**kwargs)
+        self._latest = OrderedDict()
+
+    def __len__(self):
+        return len(self._latest)
+
+    def put(self, subject, data):
+        if subject in self._latest:
+            self.dropped += 1
+        self._latest[subject] = data
+
+    def pop(self):
+        if not self._latest:
+            return None
+        return self._latest.popitem(last=False)
+
+    def push_front(self, subject, data):
+        # A newer message of the subject may have come in meanwhile
+        if subject not in self._latest:
+            self._latest[subject] = data
+            self._latest.move_to_end(subject, last=False)
+
+
+class SpillFileOutbox(Outbox):
+    """ Append the messages to a local file, nothing is dropped until the
+    file reaches max_bytes
+
+    The file survives a restart, the messages in it are drained after the
+    next connect. Each record is a '>HI' header with the subject and data
+    length, followed by the subject and the data.
+    """
+
+    policy = 'spill_file'
+    options = Outbox.options + ('spill_path', 'max_bytes')
+    required = ('spill_path',)
+    _HEADER = struct.Struct('>HI')
+
+    def __init__(self, spill_path, max_bytes=1048576, **kwargs):
+        super(SpillFileOutbox, self).__init__(**kwargs)
+        self._path = spill_path
+        self._max_bytes = max_bytes
+        self._read_offset = 0
+        self._last_size = 0
+        self._count = 0
+        self._size = 0
+        if os.path.exists(spill_path):
+            self._count, self._size = self._scan()
+
+    def _scan(self):
+        count = 0
+        offset = 0
+        size = os.path.getsize(self._path)
+        with open(self._path, 'rb') as spill:
+            while offset + self._HEADER.size <= size:
+                spill.seek(offset)
+                subject_len, data_len = self._HEADER.unpack(
+                    spill.read(self._HEADER.size))
+                record_size = self._HEADER.size + subject_len + data_len
+                if offset + record_size > size:
+                    break
+                offset += record_size
+                count += 1
+
+        # Cut the record torn by a crash, the next one is appended after it
+        if offset < size:
+            os.truncate(self._path, offset)
+        return count, offset
+
+    def __len__(self):
+        return self._count
+
+    def put(self, subject, data):
+        subject = subject.encode()
+        record = self._HEADER.pack(len(subject), len(data)) + subject + data
+        if self._size + len(record) > self._max_bytes:
+            self.dropped += 1
+            return
+        with open(self._path, 'ab') as spill:
+            spill.write(record)
+        self._size += len(record)
+        self._count += 1
+
+    def pop(self):
+        if self._count == 0:
+            return None
+        with open(self._path, 'rb') as spill:
+            spill.seek(self._read_offset)
+            subject_len, data_len = self._HEADER.unpack(
+                spill.read(self._HEADER.size))
+            subject = spill.read(subject_len).decode()
+            data = spill.read(data_len)
+
+        self._last_size = self._HEADER.size + subject_len + data_len
+        self._read_offset += self._last_size
+        self._count -= 1
+        if self._count == 0:
+            # Everything is drained, start the file over
+            open(self._path, 'wb').close()
+            self._read_offset = 0
+            self._size = 0
+        return subject, data
+
+    def push_front(self, subject, data):
+        if self._read_offset >= self._last_size:
+            self._read_offset -= self._last_size
+            self._count += 1
+        else:
+            self.put(subject, data)
+
+
+OUTBOX_POLICIES = {
+    DropOldestOutbox.policy: DropOldestOutbox,
+    KeepLatestOutbox.policy: KeepLatestOutbox,
+    SpillFileOutbox.policy: SpillFileOutbox,
+}
+
+
+def outbox_options(config=None):
+    """ Check the outbox config without creating an outbox
+
+    The options of the other policies are skipped, config.yaml lists them
+    all so the policy can be switched by one line.
+
+    Args:
+        config (dict): 'outbox' field of the bus configuration
+    Returns:
+        tuple: (the Outbox class of the policy, its keyword arguments)
+    Raises:
+        ValueError: unknown policy or option, or a required option is missing
+    """
+    config = {} if config is None else dict(config)
+    policy = config.pop('policy', DropOldestOutbox.policy)
+    if policy not in OUTBOX_POLICIES:
+        raise ValueError("Unknown outbox policy '%s'" % policy)
+    outbox_class = OUTBOX_POLICIES[policy]
+
+    known = set(option for policy_class in OUTBOX_POLICIES.values()
+                for option in policy_class.options)
+    unknown = sorted(set(config) - known)
+    if unknown:
+        raise ValueError("Unknown outbox options: %s" % ', '.join(unknown))
+    missing = [option for option in outbox_class.required
+               if option not in config]
+    if missing:
+        raise ValueError("Outbox policy '%s' needs: %s" %
+                         (policy, ', '.join(missing)))
+    return outbox_class, {key: value for key, value in config.items()
+                          if key in outbox_class.options}
+
+
+def create_outbox(config=None):
+    """
+    Args:
+        config (dict): 'outbox' field of the bus configuration, e.g.
+            {'policy': 'keep_latest', 'drain_batch': 20}
+    Returns:
+        Outbox: a new outbox, drop_oldest by default
+    Raises:
+        ValueError: the config is invalid, see outbox_options
+    """
+    outbox_class, kwargs = outbox_options(config)
+    return outbox_class(**kwargs)
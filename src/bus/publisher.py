@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+from collections import OrderedDict
+from logzero import logger
+
+
+class PublishPipeline(object):
+    """ Decouple the publishers from the broker with a single writer task
+
+    publish only stores the payload and returns. The writer task encodes and
+    sends the pending subjects in batches and yields between two batches,
+    the subjects of a lower priority first. A subject published again before
+    it is sent keeps its place and only the latest payload is sent, so a
+    slow broker delays statuses but never queues stale ones.
+
+    Attributes:
+        published (int): number of payloads sent
+        coalesced (int): number of payloads replaced by a newer one
+        dropped (int): number of payloads dropped because the queue is full
+        failed (int): number of payloads the send function raised for
+    """
+
+    def __init__(self, max_depth=256, batch_size=32):
+        """
+        Args:
+            max_depth (int): max subjects waiting to be sent
+            batch_size (int): payloads sent before yielding to other tasks
+        """
+        self._max_depth = max_depth
+        self._batch_size = batch_size
+        # {priority: OrderedDict(subject: (payload, send))}
+        self._pending = {}
+        self._depth = 0
+        self._wakeup = None
+        self._task = None
+        self.published = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.failed = 0
+
+    @property
+    def depth(self):
+        """ number of subjects waiting to be sent """
+        return self._depth
+
+    def publish(self, subject, payload, send, priority=1):
+        """
+        Args:
+            subject (str): payloads of the same subject are coalesced
+            send (coroutine function): send(payload) encodes and sends it
+            priority (int): lower is sent first
+        Returns:
+            bool: False if it is dropped because the queue is full
+        """
+        pending = self._pending.get(priority)
+        if pending is None:
+            pending = OrderedDict()
+            self._pending[priority] = pending
+            self._pending = dict(sorted(self._pending.items()))
+
+        if subject in pending:
+            self.coalesced += 1
+        elif self._depth >= self._max_depth:
+            self.dropped += 1
+            return False
+        else:
+            self._depth += 1
+        pending[subject] = (payload, send)
+        self._wake()
+        return True
+
+    def _wake(self):
+        # The writer task is created inside the running event loop
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.ensure_future(self._write())
+        self._wakeup.set()
+
+    async def _write(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._depth > 0:
+                await self._write_batch()
+                await asyncio.sleep(0)
+
+    def _pop(self):
+        for pending in self._pending.values():
+            if pending:
+                self._depth -= 1
+                subject, (payload, send) = pending.popitem(last=False)
+                return subject, payload, send
+        return None
+
+    async def _write_batch(self):
+        # Pick the next subject every time, a higher priority pub published
+        # while sending goes before the rest of the batch
+        for _ in range(self._batch_size):
+            message = self._pop()
+            if message is None:
+                return
+            await self._send(*message)
+
+    async def _send(self, subject, payload, send):
+        try:
+            await send(payload)
+            self.published += 1
+        except Exception as e:  # pylint: disable=broad-except
+            self.failed += 1
+            logger.error("Cannot publish '%s': %s", subject, e)
+
+    async def flush(self, subject=None):
+        """ Send the pending payload of subject now, all if subject is None
+        """
+        if subject is not None:
+            for pending in self._pending.values():
+                if subject in pending:
+                    self._depth -= 1
+                    payload, send = pending.pop(subject)
+                    await self._send(subject, payload, send)
+                    return
+            return
+
+        while self._depth > 0:
+            await self._write_batch()
+
+    async def close(self):
+        await self.flush()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        return {
+            "depth": self.depth,
+            "published": self.published,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import os
+import struct
+import time
+from collections import namedtuple
+from logzero import logger
+from bus import codec as bus_codec
+
+Record = namedtuple('Record', ['timestamp', 'direction', 'subject', 'data'])
+
+IN = 0
+OUT = 1
+
+_FILE_HEADER = b'TBR\x01'
+# direction, timestamp, subject length, data length
+_RECORD_HEADER = struct.Struct('>BdHI')
+# offset of the segment, timestamp of its first record
+_INDEX_ENTRY = struct.Struct('>Qd')
+
+
+def index_path_of(path):
+    return path + '.idx'
+
+
+class BusRecorder(object):
+    """ Append every message going through the bus into a binary log
+
+    The log starts with a 4 bytes header, followed by the records. Each
+    record is a '>BdHI' header (direction, time.time(), subject length, data
+    length), the subject and the raw message data. Every segment_records
+    records a new segment starts, its offset and first timestamp are
+    appended to the '.idx' file next to the log, so a reader can seek to a
+    time without scanning the log.
+    """
+
+    def __init__(self, path, segment_records=1000):
+        """
+        Args:
+            path (str): the log file, appended to if it exists
+            segment_records (int): records of each indexed segment
+        """
+        self._path = path
+        self._segment_records = segment_records
+        self._segment_count = 0
+        self._file = open(path, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(_FILE_HEADER)
+        self._index = open(index_path_of(path), 'ab')
+        self.records = 0
+
+    def record(self, direction, subject, data):
+        """
+        Args:
+            direction (int): IN or OUT
+            subject (str): nats subject
+            data (bytes): raw message data
+        """
+        if self._file is None:
+            return
+        timestamp = time.time()
+        if self._segment_count == 0:
+            self._index.write(_INDEX_ENTRY.pack(self._file.tell(), timestamp))
+        subject = subject.encode()
+        self._file.write(_RECORD_HEADER.pack(direction, timestamp,
+                                             len(subject), len(data)))
+        self._file.write(subject)
+        self._file.write(data)
+        self.records += 1
+        self._segment_count += 1
+        if self._segment_count >= self._segment_records:
+            self._segment_count = 0
+            self.flush()
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+            self._index.flush()
+
+    def close(self):
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+            self._index.close()
+            self._file = None
+            self._index = None
+
+
+def read_index(path):
+    """
+    Returns:
+        list: (offset, timestamp) of each segment
+    """
+    entries = []
+    if not os.path.exists(index_path_of(path)):
+        return entries
+    with open(index_path_of(path), 'rb') as index:
+        while True:
+            entry = index.read(_INDEX_ENTRY.size)
+            if len(entry) < _INDEX_ENTRY.size:
+                return entries
+            entries.append(_INDEX_ENTRY.unpack(entry))
+
+
+def read_records(path, start_time=None):
+    """
+    Args:
+        path (str): the log file
+        start_time (float): skip the records before this time.time()
+    Yields:
+        Record: the records in the log, a torn record at the end is ignored
+    """
+    offset = len(_FILE_HEADER)
+    if start_time is not None:
+        for segment_offset, segment_time in read_index(path):
+            if segment_time > start_time:
+                break
+            offset = segment_offset
+
+    with open(path, 'rb') as log:
+        if log.read(len(_FILE_HEADER)) != _FILE_HEADER:
+            raise ValueError("'%s' is not a bus record file" % path)
+        log.seek(offset)
+        while True:
+            header = log.read(_RECORD_HEADER.size)
+            if len(header) < _RECORD_HEADER.size:
+                return
+            direction, timestamp, subject_len, data_len = \
+                _RECORD_HEADER.unpack(header)
+            subject = log.read(subject_len)
+            data = log.read(data_len)
+            if len(subject) < subject_len or len(data) < data_len:
+                return
+            if start_time is not None and timestamp < start_time:
+                continue
+            yield Record(timestamp, direction, subject.decode(), data)
+
+
+class BusReplayer(object):
+    """ Feed a recorded session back into a NatsBus
+
+    The outgoing pubs are published again and the outgoing requests are sent
+    again, their replies are ignored. The incoming messages and the replies
+    are skipped, they are sent by the other side when it is replayed.
+
+    The recorded deadline of a request has passed by then, it is moved to
+    the time of the replay with the budget the request had when it was
+    recorded. The recorded trace context is dropped.
+    """
+
+    def __init__(self, path, start_time=None, subjects=None):
+        """
+        Args:
+            start_time (float): skip the records before this time.time()
+            subjects (list): replay only these subjects, None for all
+        """
+        self._path = path
+        self._start_time = start_time
+        self._subjects = None if subjects is None else set(subjects)
+        self.published = 0
+        self.requested = 0
+        self.failed = 0
+
+    async def replay(self, bus, speed=1.0, request_timeout=1):
+        """
+        Args:
+            bus (NatsBus): provides publish_raw and request_raw
+            speed (float): 1 to keep the recorded timing, 2 for twice as
+                fast, None or 0 to send as fast as possible
+        """
+        loop = asyncio.get_event_loop()
+        requests = []
+        first = None
+        start = loop.time()
+        for record in read_records(self._path, self._start_time):
+            if record.direction != OUT or record.subject.startswith('_INBOX.'):
+                continue
+            if self._subjects is not None and \
+                    record.subject not in self._subjects:
+                continue
+
+            if speed:
+                if first is None:
+                    first = record.timestamp
+                delay = start + (record.timestamp - first) / speed - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            if record.subject.endswith('.pub'):
+                await bus.publish_raw(record.subject, record.data)
+                self.published += 1
+            else:
+                # Keep the pace, do not wait for the reply
+                requests.append(asyncio.ensure_future(self._request(
+                    bus, record, request_timeout)))
+                self.requested += 1
+        if requests:
+            await asyncio.gather(*requests)
+
+    async def _request(self, bus, record, timeout):
+        try:
+            await bus.request_raw(record.subject, _rebase_envelope(record),
+                                  timeout)
+        except Exception as e:  # pylint: disable=broad-except
+            self.failed += 1
+            logger.debug("Replay request '%s' failed: %s", record.subject, e)
+
+
+def _rebase_envelope(record):
+    """
+    Returns:
+        bytes: the request data of record with its deadline moved to now
+    """
+    codec = bus_codec.codec_of(record.data)
+    try:
+        envelope = codec.decode(record.data)
+    except Exception:  # pylint: disable=broad-except
+        return record.data
+    if not isinstance(envelope, dict):
+        return record.data
+
+    envelope = dict(envelope)
+    envelope.pop('trace', None)
+    deadline = envelope.get('deadline')
+    if deadline is not None:
+        envelope['deadline'] = time.time() + (deadline - record.timestamp)
+    return codec.encode(envelope)
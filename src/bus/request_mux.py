@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import uuid
+from logzero import logger
+from nats.aio.errors import ErrConnectionClosed, ErrTimeout
+
+
+class RequestMultiplexer(object):
+    """ Send requests over one wildcard reply inbox of a NATS connection
+
+    timed_request subscribes and unsubscribes a new inbox for every request.
+    Here the inbox '_INBOX.<random>.*' is subscribed once, each request gets
+    the reply subject '_INBOX.<random>.<n>' with an increasing n, and the
+    reply resolves the pending future registered under n.
+    """
+
+    def __init__(self, nats_client):
+        self._nats_client = nats_client
+        self._prefix = '_INBOX.%s' % uuid.uuid4().hex
+        self._sid = None
+        self._subscribe_lock = None
+        self._next_token = 0
+        self._pending = {}
+        self.late_replies = 0
+
+    @property
+    def pending(self):
+        """ number of requests waiting for their reply """
+        return len(self._pending)
+
+    async def request(self, subject, payload, timeout=1):
+        """
+        Returns:
+            Msg: the reply message
+        Raises:
+            ErrTimeout: no reply within timeout seconds
+            ErrConnectionClosed: the multiplexer closed before the reply
+        """
+        if self._sid is None:
+            await self._subscribe()
+
+        self._next_token += 1
+        token = str(self._next_token)
+        future = asyncio.get_event_loop().create_future()
+        self._pending[token] = future
+        try:
+            await self._nats_client.publish_request(
+                subject, '%s.%s' % (self._prefix, token), payload)
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise ErrTimeout
+        finally:
+            # A reply after this is counted as late and dropped
+            self._pending.pop(token, None)
+
+    async def _subscribe(self):
+        # The lock must be created inside the running event loop
+        if self._subscribe_lock is None:
+            self._subscribe_lock = asyncio.Lock()
+
+        async with self._subscribe_lock:
+            if self._sid is None:
+                self._sid = await self._nats_client.subscribe(
+                    self._prefix + '.*', cb=self._on_reply)
+
+    async def _on_reply(self, msg):
+        token = msg.subject[len(self._prefix) + 1:]
+        future = self._pending.pop(token, None)
+        if future is None or future.done():
+            self.late_replies += 1
+            logger.debug("Drop late reply '%s'", msg.subject)
+            return
+        future.set_result(msg)
+
+    async def close(self):
+        """ Fail the pending requests with ErrConnectionClosed and remove the
+        inbox subscription
+        """
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(ErrConnectionClosed())
+        self._pending = {}
+
+        if self._sid is not None and self._nats_client.is_connected:
+            await self._nats_client.unsubscribe(self._sid)
+        self._sid = None
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+
+
+def flight_key(*parts):
+    """
+    Returns:
+        str: the key of the call, None if the parameters cannot be compared
+    """
+    try:
+        return json.dumps(parts, sort_keys=True, separators=(',', ':'))
+    except (TypeError, ValueError):
+        return None
+
+
+class SingleFlight(object):
+    """ Coalesce concurrent identical calls into one in-flight call
+
+    The callers joining a flight share the result object of the first call,
+    so they must not modify it. Only use it for idempotent calls.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self.coalesced = 0
+
+    def join(self, key, factory):
+        """
+        Args:
+            key (str): calls with the same key share one flight
+            factory (function): start the call, returns an awaitable
+        Returns:
+            asyncio.Future: the result of the flight, await it through
+                asyncio.shield so a cancelled caller does not cancel the
+                others
+        """
+        future = self._flights.get(key)
+        if future is not None and not future.done():
+            self.coalesced += 1
+            return future
+
+        future = asyncio.ensure_future(factory())
+        self._flights[key] = future
+        future.add_done_callback(lambda done: self._land(key, done))
+        return future
+
+    def _land(self, key, future):
+        if self._flights.get(key) is future:
+            del self._flights[key]
+        # Retrieve it, the callers may all have been cancelled
+        if not future.cancelled():
+            future.exception()
+
+    def wrap(self, name, callback):
+        """ Coalesce the calls of an RPC handler with the same parameters
+        """
+        async def coalesced(parameters):
+            key = flight_key(name, parameters)
+            if key is None:
+                return await callback(parameters)
+            return await asyncio.shield(
+                self.join(key, lambda: callback(parameters)))
+
+        return coalesced
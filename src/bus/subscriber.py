@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import inspect
+import time
+from collections import deque
+from logzero import logger
+
+
+class Subscriber(object):
+    """ Deliver the messages of one subscription from its own task
+
+    The NATS reader only appends the raw message to the bounded queue of the
+    subscriber, so a slow callback delays its own messages but never the
+    other subscriptions. When the queue is full the 'drop' policy drops the
+    incoming message, the 'conflate' policy keeps only the latest message.
+
+    Attributes:
+        delivered (int): number of messages passed to the callback
+        dropped (int): number of messages dropped or replaced by a newer one
+        last_lag (float): queueing time of the last message in second
+        max_lag (float): the max queueing time in second
+    """
+
+    DROP = 'drop'
+    CONFLATE = 'conflate'
+    POLICIES = (DROP, CONFLATE)
+
+    def __init__(self, subject, callback, decode=None, max_pending=16,
+                 policy=DROP):
+        """
+        Args:
+            subject (str): the subscribed subject
+            callback (function): callback(payload), a plain or coroutine
+                function
+            decode (function): decode the raw message before the callback,
+                None to pass it as it is
+            max_pending (int): max messages waiting for the callback, the
+                'conflate' policy always keeps one
+        """
+        if policy not in self.POLICIES:
+            raise ValueError("Unknown subscriber policy '%s'" % policy)
+        self.subject = subject
+        self._callback = callback
+        self._decode = decode
+        self._max_pending = 1 if policy == self.CONFLATE else max_pending
+        self._policy = policy
+        self._queue = deque()
+        self._wakeup = None
+        self._task = None
+        self.delivered = 0
+        self.dropped = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    @property
+    def pending(self):
+        """ number of messages waiting for the callback """
+        return len(self._queue)
+
+    def put(self, data):
+        """ Queue a message, never blocks
+        """
+        if len(self._queue) >= self._max_pending:
+            self.dropped += 1
+            if self._policy == self.DROP:
+                return
+            self._queue.popleft()
+        self._queue.append((time.monotonic(), data))
+        self._wake()
+
+    def _wake(self):
+        # The consumer task is created inside the running event loop
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.ensure_future(self._consume())
+        self._wakeup.set()
+
+    async def _consume(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._queue:
+                queued, data = self._queue.popleft()
+                self.last_lag = time.monotonic() - queued
+                if self.last_lag > self.max_lag:
+                    self.max_lag = self.last_lag
+                await self._call(data)
+
+    async def _call(self, data):
+        try:
+            payload = data if self._decode is None else self._decode(data)
+            result = self._callback(payload)
+            if inspect.isawaitable(result):
+                await result
+            self.delivered += 1
+        except Exception as e:  # pylint: disable=broad-except
+            logger.error("Subscriber of '%s' raised: %s", self.subject, e)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._queue.clear()
+
+    def stats(self):
+        return {
+            "pending": self.pending,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "last_lag": self.last_lag,
+            "max_lag": self.max_lag,
+        }
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from collections import namedtuple
+
+# The connection and publisher of the messages to a traffic class
+TrafficRoute = namedtuple('TrafficRoute',
+                          ['traffic_class', 'connection', 'publisher'])
+
+
+def subject_match(pattern, subject):
+    """ NATS subject matching, '*' matches one token and '>' the rest
+    """
+    pattern_tokens = pattern.split('.')
+    subject_tokens = subject.split('.')
+    for index, token in enumerate(pattern_tokens):
+        if token == '>':
+            return len(subject_tokens) > index
+        if index >= len(subject_tokens):
+            return False
+        if token != '*' and token != subject_tokens[index]:
+            return False
+    return len(pattern_tokens) == len(subject_tokens)
+
+
+class TrafficClass(object):
+    """ The connection, dispatch and publish priority of a group of paths
+
+    Attributes:
+        name (str): class name in config.yaml
+        priority (int): pubs of a lower priority are sent first
+        dedicated_connection (bool): the bus clients of this class share
+            their own connection instead of the common one
+        dispatch (dict): overrides the bus dispatch config, see RpcDispatcher
+    """
+
+    def __init__(self, name, priority=1, dedicated_connection=False,
+                 dispatch=None, paths=None):
+        self.name = name
+        self.priority = priority
+        self.dedicated_connection = dedicated_connection
+        self.dispatch = dispatch
+        self.paths = [] if paths is None else paths
+
+    def matches(self, path):
+        return any(subject_match(pattern, path) for pattern in self.paths)
+
+    def dispatch_config(self, base):
+        """
+        Args:
+            base (dict): the dispatch config of the bus
+        Returns:
+            dict: base updated by the dispatch config of this class
+        """
+        if self.dispatch is None:
+            return base
+        config = dict({} if base is None else base)
+        methods = dict(config.get('methods', {}))
+        methods.update(self.dispatch.get('methods', {}))
+        config.update(self.dispatch)
+        config['methods'] = methods
+        return config
+
+
+class TrafficClasses(object):
+    """ Map the bus paths to traffic classes, the first matching class wins
+    """
+
+    DEFAULT = 'default'
+
+    def __init__(self, config=None):
+        """
+        Args:
+            config (dict): 'traffic_classes' field of the bus config, e.g.
+                {'control': {'priority': 0, 'dedicated_connection': True,
+                             'paths': ['tank.refill', 'tank.heater']}}
+        """
+        config = {} if config is None else config
+        self._classes = [
+            TrafficClass(name, **class_config)
+            for name, class_config in config.items()
+            if name != self.DEFAULT
+        ]
+        self._default = TrafficClass(self.DEFAULT,
+                                     **config.get(self.DEFAULT, {}))
+
+    def classify(self, path):
+        """
+        Returns:
+            TrafficClass: the class of path, the default class if none matches
+        """
+        for traffic_class in self._classes:
+            if traffic_class.matches(path):
+                return traffic_class
+        return self._default
+
+    def classify_subject(self, subject):
+        """ Classify the nats subject of a message by its path
+
+        Returns:
+            TrafficClass: the class of the path of subject, e.g. of
+                'tank.refill' for 'tank.refill.rep'
+        """
+        path, _, suffix = subject.rpartition('.')
+        if suffix in ('rep', 'pub') and path:
+            return self.classify(path)
+        return self.classify(subject)
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+from lib import tracing
 from lib.proto.textproto import TextProto
 
 class Extruder(object):
@@ -36,7 +37,8 @@ class Extruder(object):
         Args:
             data (str): Hcode to write
         """
-        self._textproto.writeline(data)
+        with tracing.span('extruder.send', 'serial', {'data': data}):
+            self._textproto.writeline(data)
 
     def recv(self):
         return self._textproto.readline().strip()
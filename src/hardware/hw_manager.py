@@ -7,7 +7,7 @@ from hardware.max31856 import MAX31856, MAX31856Config
 from hardware.pwm import SWPWM, PWMConfig
 from hardware.smoothie import Smoothie
 from hardware.extruder import Extruder
-from hardware.spi import HWSPI, SPIConfig
+from hardware.spi import HWSPI, SPIConfig, SPIController
 from hardware.uart import UART, UARTConfig
 from hardware.water_detector import WaterDetector
 from hardware.pid import PID
@@ -19,6 +19,7 @@ class HWManager(object):
 
     def __init__(self):
         self._hardwares = {}
+        self._spi_controllers = {}
 
     def import_config(self, configs):
         """
@@ -40,6 +41,15 @@ class HWManager(object):
             else:
                 logger.warning("Cannot create hardware instance '%s'", name)
 
+    def spi_controller(self, number):
+        """ The controller shared by the hwspi on the same SPI device
+        """
+        controller = self._spi_controllers.get(number)
+        if controller is None:
+            controller = SPIController(number)
+            self._spi_controllers[number] = controller
+        return controller
+
     def find_hardware(self, name):
         if name not in self._hardwares:
             return None
@@ -89,6 +99,17 @@ def create_max31856(hardware_config, hwm):
                      hardware_config['name'], hardware_config['sample_avg'])
         return None
 
+    noise_filter = hardware_config.get('noise_filter', 60)
+    if noise_filter == 60:
+        config.noise_filter = MAX31856.FILTER_60HZ
+    elif noise_filter == 50:
+        config.noise_filter = MAX31856.FILTER_50HZ
+    else:
+        logger.error("Unsupport '%s' - noise filter: '%s'",
+                     hardware_config['name'], noise_filter)
+        return None
+    config.drdy_gpio = hardware_config.get('drdy_gpio')
+
     spidev = hwm.find_hardware(dev)
     if spidev is None:
         logger.warning("Cannot find hardware '%s' for now", dev)
@@ -150,13 +171,15 @@ def create_extruder(hardware_config, hwm):
     return Extruder(uartdev)
 
 
-def create_hwspi(hardware_config, _):
+def create_hwspi(hardware_config, hwm):
     spi_config = SPIConfig()
     spi_config.speed = hardware_config['speed']
     spi_config.mode = hardware_config['mode']
     number = hardware_config['number']
     chipselect = hardware_config['chipselect']
-    return HWSPI(number, chipselect, spi_config)
+    return HWSPI(number, chipselect, spi_config,
+                 controller=hwm.spi_controller(number),
+                 priority=hardware_config.get('priority', 1))
 
 
 def create_uart(hardware_config, _):
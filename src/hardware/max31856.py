@@ -1,18 +1,25 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import asyncio
+import time
 from logzero import logger
+from periphery import GPIO, GPIOError
 from hardware.error import HardwareError
-from hardware.sensor import Sensor
+from hardware.register_map import RegisterMap
+from hardware.sensor import Sample, Sensor
 
 
 class MAX31856Config(object):
     def __init__(self):
         self.tc_type = MAX31856.K_TYPE
         self.sample_avg = MAX31856.SAMPLE_AVG_1
+        self.noise_filter = MAX31856.FILTER_60HZ
+        # The GPIO pin of DRDY, None to wait for the conversion time
+        self.drdy_gpio = None
 
 
-class MAX31856(Sensor):
+class MAX31856(RegisterMap, Sensor):
 
     B_TYPE = 0x0
     E_TYPE = 0x1
@@ -32,6 +39,9 @@ class MAX31856(Sensor):
     SAMPLE_AVG_8 = 0x3
     SAMPLE_AVG_16 = 0x4
 
+    FILTER_60HZ = 0
+    FILTER_50HZ = 1
+
     ADDR_WRITE_MASK = 0x80
 
     ADDR_CR0 = 0x0
@@ -54,15 +64,41 @@ class MAX31856(Sensor):
     RESOLUTION_TC = 0.0078125
     RESOLUTION_CJ = 0.015625
 
+    CR0_MODE_MASK = 0x80
+    CR0_1SHOT_MASK = 0x40
+    CR0_FAULTCLR_MASK = 0x02
+    CR0_FILTER_MASK = 0x01
+    CR1_AVG_MASK = 0x70
+    CR1_TC_TYPE_MASK = 0x0f
+
+    # CR0 to CJTO, the cold junction temperature is a measurement
+    CONFIG_ADDRS = tuple(range(ADDR_CR0, ADDR_CJTO + 1))
+    VOLATILE_BITS = {ADDR_CR0: CR0_1SHOT_MASK | CR0_FAULTCLR_MASK}
+
+    # {(mode, filter): (first sample, each additional sample)} in ms, the
+    # typical conversion times of the datasheet
+    CONVERSION_MS = {
+        (MODE_MANUAL, FILTER_60HZ): (143, 33.33),
+        (MODE_MANUAL, FILTER_50HZ): (169, 40),
+        (MODE_AUTOMATIC, FILTER_60HZ): (83, 33.33),
+        (MODE_AUTOMATIC, FILTER_50HZ): (98, 40),
+    }
+    # Wait a little longer, a read before the end returns the last result
+    CONVERSION_MARGIN = 1.1
+
     def __init__(self, spidev, config):
         """
         Args:
             spidev (SPI): max31856 communication interface
             config (MAX31856Config): max31856 configuration
         """
-        self._spi = spidev
+        super(MAX31856, self).__init__(spidev)
         self._config = config
         self._is_connected = False
+        self._drdy = None
+        # When the automatic conversions started and the last one read
+        self._mode_since = None
+        self._last_conversion = -1
 
     def connect(self):
         """ Connect to max31856
@@ -76,20 +112,41 @@ class MAX31856(Sensor):
 
         logger.info("Connect to max31856")
         self._spi.open()
-        self.tc_type = self._config.tc_type
-        self.sample_avg = self._config.sample_avg
-        self.mode = MAX31856.MODE_AUTOMATIC
+        # Only the registers differ from the config are written
+        self.load_config_regs()
+        self._set_fields(
+            MAX31856.ADDR_CR1,
+            (MAX31856.CR1_TC_TYPE_MASK, 0, self._config.tc_type),
+            (MAX31856.CR1_AVG_MASK, 4, self._config.sample_avg))
+        if self.noise_filter != self._config.noise_filter:
+            # The filter must not change during automatic conversions
+            self._set_fields(
+                MAX31856.ADDR_CR0,
+                (MAX31856.CR0_MODE_MASK, 7, MAX31856.MODE_MANUAL),
+                (MAX31856.CR0_FILTER_MASK, 0, self._config.noise_filter))
+        self._set_mode(MAX31856.MODE_AUTOMATIC)
 
         # Check out this sensor is work or not
-        if self.tc_type != self._config.tc_type:
-            logger.error("max31856 set tc type failed")
-            self._spi.close()
-            return False
-        if self.sample_avg != self._config.sample_avg:
-            logger.error("max31856 set sample average failed")
+        mismatched = self.verify_config_regs()
+        if mismatched:
+            logger.error("max31856 set registers %s failed",
+                         ', '.join('%02x' % addr for addr in mismatched))
+            self.invalidate()
             self._spi.close()
             return False
 
+        if self._config.drdy_gpio is not None:
+            try:
+                self._drdy = GPIO(self._config.drdy_gpio, "in")
+                self._drdy.edge = "falling"
+            except GPIOError as e:
+                logger.error("Cannot open max31856 DRDY gpio %d: %s",
+                             self._config.drdy_gpio, e)
+                self._close_drdy()
+                self.invalidate()
+                self._spi.close()
+                return False
+
         self._is_connected = True
         return True
 
@@ -98,7 +155,9 @@ class MAX31856(Sensor):
             return True
 
         logger.info("Disconnect max31856")
+        self._close_drdy()
         self._spi.close()
+        self.invalidate()
         self._is_connected = False
         return True
 
@@ -114,6 +173,8 @@ class MAX31856(Sensor):
 
         if fault != 0:
             logger.error("MAX31856 get fault: %02x", fault)
+            # The chip may have been reset
+            self.invalidate()
             raise HardwareError('max31856', 'error code: %02d' % fault)
 
         tempc = ((temp0 << 16) | (temp1 << 8) | temp2) >> 5
@@ -126,6 +187,117 @@ class MAX31856(Sensor):
 
         return tempc * MAX31856.RESOLUTION_TC
 
+    async def read_measure_temp_c_async(self):
+        return await self._run_sampling(self.read_measure_temp_c)
+
+    def conversion_time(self, mode):
+        """
+        Args:
+            mode (int): MODE_MANUAL for a one-shot conversion, or
+                MODE_AUTOMATIC for the period of the automatic conversions
+        Returns:
+            float: the conversion time in seconds with the configured sample
+                average and noise filter
+        """
+        first, additional = MAX31856.CONVERSION_MS[(mode,
+                                                    self._config.noise_filter)]
+        samples = 1 << self._config.sample_avg
+        return ((first + additional * (samples - 1)) *
+                MAX31856.CONVERSION_MARGIN / 1000)
+
+    async def sample_async(self, mode=MODE_AUTOMATIC):
+        """ Read the temperature of a new conversion
+
+        In MODE_MANUAL a one-shot conversion is started and read when it
+        completes, the chip is idle between the samples. In MODE_AUTOMATIC
+        the read waits for the next conversion, a conversion is never read
+        twice. The completion is signalled by DRDY if its gpio is configured,
+        otherwise it is predicted from the conversion time.
+
+        Args:
+            mode (int): MODE_MANUAL or MODE_AUTOMATIC
+        Returns:
+            Sample: the temperature and when its conversion completed
+        """
+        if not self.is_connected():
+            logger.error("max31856 is not connected")
+            raise HardwareError('max31856', 'is not connected')
+
+        ready = await self._run_sampling(self._start_conversion, mode)
+        timestamp = await self._wait_conversion(ready)
+        tempc = await self._run_sampling(self.read_measure_temp_c)
+        return Sample(timestamp, tempc)
+
+    def _set_mode(self, mode):
+        self.mode = mode
+        self._mode_since = time.monotonic()
+        self._last_conversion = -1
+
+    def _start_conversion(self, mode):
+        """
+        Returns:
+            float: the monotonic time the conversion to read completes
+        """
+        if self.mode != mode:
+            self._set_mode(mode)
+        if mode == MAX31856.MODE_AUTOMATIC:
+            return self._next_conversion(time.monotonic())
+
+        # The bit clears itself, it is written without touching the cache
+        cr0 = self._get_config_reg(MAX31856.ADDR_CR0)
+        self._write_reg(MAX31856.ADDR_CR0, [cr0 | MAX31856.CR0_1SHOT_MASK])
+        return time.monotonic() + self.conversion_time(MAX31856.MODE_MANUAL)
+
+    def _next_conversion(self, now):
+        # The last completed conversion if it is not read yet, else the next
+        # one. The first conversion takes as long as a one-shot one
+        first = self._mode_since + self.conversion_time(MAX31856.MODE_MANUAL)
+        period = self.conversion_time(MAX31856.MODE_AUTOMATIC)
+        conversion = 0
+        if now >= first:
+            conversion = int((now - first) // period)
+        conversion = max(conversion, self._last_conversion + 1)
+        self._last_conversion = conversion
+        return first + conversion * period
+
+    async def _wait_conversion(self, ready):
+        """
+        Returns:
+            float: the wall clock time the conversion completed
+        """
+        if self._drdy is not None:
+            # Poll the edge in a thread of its own, the SPI thread is shared
+            # by the other chip selects
+            timeout = 2 * self.conversion_time(MAX31856.MODE_MANUAL)
+            if not await asyncio.get_event_loop().run_in_executor(
+                    None, self._wait_drdy, timeout):
+                logger.error("max31856 DRDY timeout")
+                raise HardwareError('max31856', 'conversion timeout')
+            return time.time()
+
+        delay = ready - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return time.time() - max(0, time.monotonic() - ready)
+
+    def _wait_drdy(self, timeout):
+        """
+        Returns:
+            bool: True if DRDY is low, a conversion is not read yet
+        """
+        end = time.monotonic() + timeout
+        # Reading the value also clears the edge poll has seen
+        while self._drdy.read():
+            remaining = end - time.monotonic()
+            if remaining <= 0 or not self._drdy.poll(remaining):
+                return False
+        return True
+
+    def _close_drdy(self):
+        if self._drdy is not None:
+            self._drdy.close()
+            self._drdy = None
+
     def read_coldjunction_temp_c(self):
         [temp0, temp1] = self._read_reg(MAX31856.ADDR_CJTH, 2)
         tempc = ((temp0 << 8) | temp1) >> 2
@@ -136,8 +308,7 @@ class MAX31856(Sensor):
 
     @property
     def tc_type(self):
-        [cr1] = self._read_reg(MAX31856.ADDR_CR1, 1)
-        return cr1 & 0x7
+        return self._get_field(MAX31856.ADDR_CR1, MAX31856.CR1_TC_TYPE_MASK, 0)
 
     @tc_type.setter
     def tc_type(self, tc_type):
@@ -147,34 +318,25 @@ class MAX31856(Sensor):
         """
         if not MAX31856.B_TYPE <= tc_type <= MAX31856.T_TYPE:
             raise ValueError("arg 'value' should be TC TYPE")
-        [cr1] = self._read_reg(MAX31856.ADDR_CR1, 1)
-        cr1 = (cr1 & 0xf0) | tc_type
-        self._write_reg(MAX31856.ADDR_CR1, [cr1])
+        self._set_field(MAX31856.ADDR_CR1, MAX31856.CR1_TC_TYPE_MASK, 0,
+                        tc_type)
 
     @property
     def sample_avg(self):
-        [avg] = self._read_reg(MAX31856.ADDR_CR1, 1)
-        return avg >> 4
+        return self._get_field(MAX31856.ADDR_CR1, MAX31856.CR1_AVG_MASK, 4)
 
     @sample_avg.setter
     def sample_avg(self, sample):
-        [avg] = self._read_reg(MAX31856.ADDR_CR1, 1)
-        avg = (avg & 0x0f) | sample
-        self._write_reg(MAX31856.ADDR_CR1, [avg])
+        self._set_field(MAX31856.ADDR_CR1, MAX31856.CR1_AVG_MASK, 4, sample)
 
     @property
     def mode(self):
-        [cr0] = self._read_reg(MAX31856.ADDR_CR0, 1)
-        return cr0 >> 7
+        return self._get_field(MAX31856.ADDR_CR0, MAX31856.CR0_MODE_MASK, 7)
 
     @mode.setter
     def mode(self, mode):
-        [cr0] = self._read_reg(MAX31856.ADDR_CR0, 1)
-        cr0 = (cr0 & 0x7f) | (mode << 7)
-        self._write_reg(MAX31856.ADDR_CR0, [cr0])
+        self._set_field(MAX31856.ADDR_CR0, MAX31856.CR0_MODE_MASK, 7, mode)
 
-    def _read_reg(self, addr, size):
-        return self._spi.transfer([addr], size)
-
-    def _write_reg(self, addr, data):
-        return self._spi.transfer([addr | MAX31856.ADDR_WRITE_MASK] + data, 0)
+    @property
+    def noise_filter(self):
+        return self._get_field(MAX31856.ADDR_CR0, MAX31856.CR0_FILTER_MASK, 0)
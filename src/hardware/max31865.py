@@ -3,6 +3,7 @@
 
 from logzero import logger
 from hardware.error import HardwareError
+from hardware.register_map import RegisterMap
 from hardware.sensor import Sensor
 
 
@@ -17,7 +18,7 @@ class MAX31865Config(object):
         self.mode = MAX31865.MODE_AUTOMATIC
 
 
-class MAX31865(Sensor):
+class MAX31865(RegisterMap, Sensor):
 
     WIRE_2 = 0
     WIRE_3 = 1
@@ -37,6 +38,19 @@ class MAX31865(Sensor):
     ADDR_LFTL = 0x6
     ADDR_FAULT = 0x7
 
+    CR_BIAS_MASK = 0x80
+    CR_MODE_MASK = 0x40
+    CR_1SHOT_MASK = 0x20
+    CR_WIRE_MASK = 0x10
+    CR_FAULT_CYCLE_MASK = 0x0c
+    CR_FAULTCLR_MASK = 0x02
+
+    # The RTD registers between them are measurements
+    CONFIG_ADDRS = (ADDR_CR, ADDR_HFTH, ADDR_HFTL, ADDR_LFTH, ADDR_LFTL)
+    VOLATILE_BITS = {
+        ADDR_CR: CR_1SHOT_MASK | CR_FAULT_CYCLE_MASK | CR_FAULTCLR_MASK
+    }
+
     R_REF = 400.0  # reference ohm
     RTD_0 = 100.0  # PT100 probe has 100 ohm at 0 degree C
 
@@ -68,7 +82,7 @@ class MAX31865(Sensor):
             spidev (SPI): max31865 communication interface
             config (MAX31865Config): max31865 configuration
         """
-        self._spi = spidev
+        super(MAX31865, self).__init__(spidev)
         self._config = config
         self._is_connected = False
 
@@ -83,19 +97,21 @@ class MAX31865(Sensor):
 
         logger.info("Connect to max31865")
         self._spi.open()
-        self.wire = self._config.wire
-        self.mode = self._config.mode
-
-        if self.wire != self._config.wire:
-            logger.error("max31865 set wire failed")
-            self._spi.close()
-            return False
-        if self.mode != self._config.mode:
-            logger.error("max31865 set mode failed")
+        # Only the registers differ from the config are written
+        self.load_config_regs()
+        self._set_fields(MAX31865.ADDR_CR,
+                         (MAX31865.CR_WIRE_MASK, 4, self._config.wire),
+                         (MAX31865.CR_MODE_MASK, 6, self._config.mode),
+                         (MAX31865.CR_BIAS_MASK, 7, 1))
+
+        mismatched = self.verify_config_regs()
+        if mismatched:
+            logger.error("max31865 set registers %s failed",
+                         ', '.join('%02x' % addr for addr in mismatched))
+            self.invalidate()
             self._spi.close()
             return False
 
-        self._enable()
         self._is_connected = True
         return True
 
@@ -104,6 +120,7 @@ class MAX31865(Sensor):
         if self.is_connected():
             self._disable()
             self._spi.close()
+        self.invalidate()
         self._is_connected = False
 
     def is_connected(self):
@@ -117,6 +134,8 @@ class MAX31865(Sensor):
         [rtd_msb, rtd_lsb] = self._read_reg(MAX31865.ADDR_RTDH, 2)
         if rtd_lsb & 0x1 != 0:
             logger.error("MAX31865 get fault")
+            # The chip may have been reset
+            self.invalidate()
             raise HardwareError('max31865', 'sensor return fault')
 
         rtd_adc_code = ((rtd_msb << 8) | rtd_lsb) >> 1
@@ -127,40 +146,24 @@ class MAX31865(Sensor):
 
         return (rtd_adc_code / 32) - 256
 
-    def _enable(self):
-        [cr_value] = self._read_reg(MAX31865.ADDR_CR, 1)
-        cr_value = (cr_value & 0x7f) | (1 << 7)
-        self._write_reg(MAX31865.ADDR_CR, [cr_value])
+    async def read_measure_temp_c_async(self):
+        return await self._run_sampling(self.read_measure_temp_c)
 
     def _disable(self):
-        [cr_value] = self._read_reg(MAX31865.ADDR_CR, 1)
-        cr_value = (cr_value & 0x7f)
-        self._write_reg(MAX31865.ADDR_CR, [cr_value])
+        self._set_field(MAX31865.ADDR_CR, MAX31865.CR_BIAS_MASK, 7, 0)
 
     @property
     def mode(self):
-        [cr_value] = self._read_reg(MAX31865.ADDR_CR, 1)
-        return (cr_value & 0x40) >> 6
+        return self._get_field(MAX31865.ADDR_CR, MAX31865.CR_MODE_MASK, 6)
 
     @mode.setter
     def mode(self, mode):
-        [cr_value] = self._read_reg(MAX31865.ADDR_CR, 1)
-        cr_value = (cr_value & 0xbf) | (mode << 6)
-        self._write_reg(MAX31865.ADDR_CR, [cr_value])
+        self._set_field(MAX31865.ADDR_CR, MAX31865.CR_MODE_MASK, 6, mode)
 
     @property
     def wire(self):
-        [cr_value] = self._read_reg(MAX31865.ADDR_CR, 1)
-        return (cr_value & 0x10) >> 4
+        return self._get_field(MAX31865.ADDR_CR, MAX31865.CR_WIRE_MASK, 4)
 
     @wire.setter
     def wire(self, wire):
-        [cr_value] = self._read_reg(MAX31865.ADDR_CR, 1)
-        cr_value = (cr_value & 0xef) | (wire << 4)
-        self._write_reg(MAX31865.ADDR_CR, [cr_value])
-
-    def _read_reg(self, addr, size):
-        return self._spi.transfer([addr], size)
-
-    def _write_reg(self, addr, data):
-        self._spi.transfer([addr | MAX31865.ADDR_WRITE_MASK] + data, 0)
+        self._set_field(MAX31865.ADDR_CR, MAX31865.CR_WIRE_MASK, 4, wire)
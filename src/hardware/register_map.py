@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+class RegisterMap(object):
+    """ Registers of a SPI chip with a write-through shadow cache
+
+    The configuration registers are read once, in one burst, and kept in the
+    cache. A field read is served from the cache and a field write is
+    skipped if the register already holds the value. The cache must be
+    invalidated when the chip may have been reset, e.g. on disconnect or a
+    fault.
+
+    Attributes:
+        CONFIG_ADDRS (tuple): addresses of the cached configuration registers
+        VOLATILE_BITS (dict): {addr: mask} of the bits the chip clears by
+            itself, e.g. one-shot or fault clear. They are never cached
+        ADDR_WRITE_MASK (int): set in the address of a write transaction
+    """
+
+    CONFIG_ADDRS = ()
+    VOLATILE_BITS = {}
+    ADDR_WRITE_MASK = 0x80
+
+    def __init__(self, spidev):
+        """
+        Args:
+            spidev (SPI): the communication interface
+        """
+        self._spi = spidev
+        self._shadow = {}
+        # The address of a read, reused by every read
+        self._read_command = bytearray(1)
+
+    async def _run_io(self, func, *args):
+        # Keep the blocking transfers of the driver off the event loop
+        return await self._spi.run_async(func, *args)
+
+    async def _run_sampling(self, func, *args):
+        # Sampled back-to-back with the other chips on the controller
+        return await self._spi.slot_async(func, *args)
+
+    def _read_reg(self, addr, size):
+        """
+        Returns:
+            memoryview or list: the register values, only valid until the
+                next transfer
+        """
+        self._read_command[0] = addr
+        return self._spi.transfer_into(self._read_command, size)
+
+    def _write_reg(self, addr, data):
+        self._spi.transfer([addr | self.ADDR_WRITE_MASK] + data, 0)
+
+    def _cacheable(self, addr, value):
+        return value & ~self.VOLATILE_BITS.get(addr, 0) & 0xff
+
+    def _get_config_reg(self, addr):
+        value = self._shadow.get(addr)
+        if value is None:
+            [value] = self._read_reg(addr, 1)
+            value = self._cacheable(addr, value)
+            self._shadow[addr] = value
+        return value
+
+    def _set_config_reg(self, addr, value):
+        if self._shadow.get(addr) == value:
+            return
+        self._write_reg(addr, [value])
+        self._shadow[addr] = self._cacheable(addr, value)
+
+    def _get_field(self, addr, mask, shift):
+        return (self._get_config_reg(addr) & mask) >> shift
+
+    def _set_field(self, addr, mask, shift, value):
+        self._set_fields(addr, (mask, shift, value))
+
+    def _set_fields(self, addr, *fields):
+        """ Set several fields of a register in one write
+
+        Args:
+            fields (tuple): (mask, shift, value) of each field
+        """
+        reg = self._get_config_reg(addr)
+        for mask, shift, value in fields:
+            reg = (reg & ~mask & 0xff) | ((value << shift) & mask)
+        self._set_config_reg(addr, reg)
+
+    def _burst_read_config(self):
+        first = min(self.CONFIG_ADDRS)
+        data = self._read_reg(first, max(self.CONFIG_ADDRS) - first + 1)
+        return {addr: self._cacheable(addr, data[addr - first])
+                for addr in self.CONFIG_ADDRS}
+
+    def load_config_regs(self):
+        """ Fill the cache with one burst read of the configuration registers
+        """
+        self._shadow = self._burst_read_config()
+
+    def verify_config_regs(self):
+        """ Read back the configuration registers in one burst
+
+        Returns:
+            list: addresses of the registers which differ from the cache, the
+                cache is refreshed with the values read back
+        """
+        values = self._burst_read_config()
+        mismatched = [addr for addr in self.CONFIG_ADDRS
+                      if addr in self._shadow and
+                      self._shadow[addr] != values[addr]]
+        self._shadow = values
+        return mismatched
+
+    def invalidate(self):
+        """ Drop the cache, the next access reads the chip again
+        """
+        self._shadow = {}
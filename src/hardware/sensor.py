@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 
+from collections import namedtuple
+
 
 class Sensor(object):
     def connect(self):
@@ -10,3 +12,18 @@ class Sensor(object):
 
     def is_connected(self):
         raise NotImplementedError()
+
+    async def connect_async(self):
+        return await self._run_io(self.connect)
+
+    async def disconnect_async(self):
+        return await self._run_io(self.disconnect)
+
+    async def _run_io(self, func, *args):
+        """ Run a blocking driver call from a coroutine, inline by default
+        """
+        return func(*args)
+
+
+# A measurement and the wall clock time its conversion completed
+Sample = namedtuple('Sample', ['timestamp', 'temperature'])
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+from lib import tracing
 from lib.proto.textproto import TextProto
 
 
@@ -40,7 +41,8 @@ class Smoothie(object):
         Args:
             data (str): Gcode to write
         """
-        self._textproto.writeline(data)
+        with tracing.span('smoothie.send', 'serial', {'data': data}):
+            self._textproto.writeline(data)
 
     def recv(self):
         return self._textproto.readline().strip()
@@ -1,10 +1,42 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import asyncio
+import collections
+import contextvars
+import ctypes
+import fcntl
+import functools
+import itertools
+import threading
+import time
+from concurrent import futures
+from lib import tracing
 from lib.tio import tio
 from spidev import SpiDev
 from logzero import logger
 
+class _SpiIocTransfer(ctypes.Structure):
+    """ struct spi_ioc_transfer of linux/spi/spidev.h """
+    _fields_ = [
+        ('tx_buf', ctypes.c_uint64),
+        ('rx_buf', ctypes.c_uint64),
+        ('len', ctypes.c_uint32),
+        ('speed_hz', ctypes.c_uint32),
+        ('delay_usecs', ctypes.c_uint16),
+        ('bits_per_word', ctypes.c_uint8),
+        ('cs_change', ctypes.c_uint8),
+        ('tx_nbits', ctypes.c_uint8),
+        ('rx_nbits', ctypes.c_uint8),
+        ('word_delay_usecs', ctypes.c_uint8),
+        ('pad', ctypes.c_uint8),
+    ]
+
+
+# SPI_IOC_MESSAGE(1), _IOW('k', 0, struct spi_ioc_transfer)
+SPI_IOC_MESSAGE_1 = (0x40000000 | (ctypes.sizeof(_SpiIocTransfer) << 16) |
+                     (ord('k') << 8))
+
 
 class SPIConfig(object):
     """
@@ -25,8 +57,14 @@ class SPIConfig(object):
 
 class SPI(tio.IO):
     """ SPI interface (abstract)
+
+    The blocking calls are made from the coroutines with run_async, they
+    run one by one in the I/O thread of the interface, so the event loop
+    keeps running while a transfer is on the wire.
     """
 
+    _executor = None
+
     def open(self):
         raise NotImplementedError
 
@@ -41,33 +79,373 @@ class SPI(tio.IO):
         """
         raise NotImplementedError
 
+    def transfer_into(self, writedata, readsize):
+        """ Full-duplex transfer through the buffers of the interface
+
+        Args:
+            writedata (bytes-like or list): data to write
+            readsize (int): size of read data after writing
+        Returns:
+            memoryview or list: the data read after writedata, only valid
+                until the next transfer
+        """
+        return self.transfer(list(writedata), readsize)
+
+    def executor(self):
+        """
+        Returns:
+            concurrent.futures.Executor: the I/O thread of this interface
+        """
+        if self._executor is None:
+            self._executor = futures.ThreadPoolExecutor(max_workers=1)
+        return self._executor
+
+    async def run_async(self, func, *args):
+        """ Run a blocking call in the I/O thread, e.g. a whole sensor read
+
+        The call sees the context of the caller, e.g. its trace span.
+        """
+        context = contextvars.copy_context()
+        return await asyncio.get_event_loop().run_in_executor(
+            self.executor(), functools.partial(context.run, func, *args))
+
+    async def slot_async(self, func, *args):
+        """ Run a blocking call in the slot shared with the other chips
+        sampled at the same time, the same as run_async by default
+        """
+        return await self.run_async(func, *args)
+
+    async def transfer_async(self, writedata, readsize):
+        return await self.run_async(self.transfer, writedata, readsize)
+
+
+class _ChipSelect(object):
+    def __init__(self, spidev):
+        self.spidev = spidev
+        self.fd = spidev.fileno()
+        self.ref_count = 0
+        self.mode = None
+
+
+class SPIController(object):
+    """ A SPI controller and the chip selects on it
+
+    The controller opens the device of a chip select once, however many
+    HWSPI use it, and only sets its mode when a transaction needs another
+    one. The speed goes with every transfer, it never reconfigures the
+    device.
+
+    The transactions run one by one in the I/O thread of the controller,
+    the lower priority first and in submission order within a priority. A
+    waiting transaction gains one priority level every aging seconds, so a
+    busy control loop delays the telemetry reads but never starves them.
+
+    A batch runs back-to-back in one transaction. slot_async batches the
+    calls made close together, e.g. every sensor sampled at the same scan
+    tick, so they take one slot of the I/O thread.
+
+    Attributes:
+        transactions (int): number of transactions run
+        reconfigurations (int): number of mode changes
+    """
+
+    def __init__(self, device, aging=0.1, slot_window=0.002):
+        """
+        Args:
+            device (int): the number of SPI device
+            aging (float): the wait in second which raises a transaction by
+                one priority level
+            slot_window (float): the calls of slot_async within this seconds
+                of the first one share its slot
+        """
+        self.device = device
+        self._aging = aging
+        self._slot_window = slot_window
+        self._slot = None
+        self._chip_selects = {}
+        self._lock = threading.Lock()
+        # priority: deque of (submit time, seq, func, args, future)
+        self._pending = {}
+        self._condition = threading.Condition()
+        self._stops = 0
+        self._seq = itertools.count()
+        self._thread = None
+        self.transactions = 0
+        self.reconfigurations = 0
+
+    def open(self, ce):
+        """
+        Returns:
+            int: the fd of the chip select
+        """
+        with self._lock:
+            chip_select = self._chip_selects.get(ce)
+            if chip_select is None:
+                logger.info("Open SPI(%d,%d)", self.device, ce)
+                spidev = SpiDev()
+                spidev.open(self.device, ce)
+                chip_select = _ChipSelect(spidev)
+                self._chip_selects[ce] = chip_select
+            chip_select.ref_count += 1
+            return chip_select.fd
+
+    def close(self, ce):
+        with self._lock:
+            chip_select = self._chip_selects.get(ce)
+            if chip_select is None:
+                return
+            chip_select.ref_count -= 1
+            if chip_select.ref_count > 0:
+                return
+            logger.info("Close SPI(%d,%d)", self.device, ce)
+            chip_select.spidev.close()
+            del self._chip_selects[ce]
+
+    def select(self, ce, mode):
+        """ Set the mode of the chip select if it is not set yet
+        """
+        chip_select = self._chip_selects[ce]
+        if chip_select.mode != mode:
+            chip_select.spidev.mode = mode
+            chip_select.mode = mode
+            self.reconfigurations += 1
+
+    def spidev(self, ce):
+        return self._chip_selects[ce].spidev
+
+    def submit(self, func, args=(), priority=1):
+        """
+        Args:
+            priority (int): lower runs first
+        Returns:
+            concurrent.futures.Future: the result of func(*args)
+        """
+        future = futures.Future()
+        with self._condition:
+            self._pending.setdefault(priority, collections.deque()).append(
+                (time.monotonic(), next(self._seq), func, args, future))
+            self._condition.notify()
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._work, name='spi%d' % self.device,
+                    daemon=True)
+                self._thread.start()
+        return future
+
+    async def run_async(self, func, *args, priority=1):
+        """ Run a blocking call in the I/O thread of the controller
+
+        The call sees the context of the caller, e.g. its trace span.
+        """
+        context = contextvars.copy_context()
+        return await asyncio.wrap_future(
+            self.submit(context.run, (func,) + args, priority))
+
+    async def batch_async(self, funcs, priority=1):
+        """ Run the calls back-to-back, no other transaction between them
+
+        Args:
+            funcs (list): functions without arguments
+        Returns:
+            list: the result of each call, or the exception it raised
+        """
+
+        def run_batch():
+            results = []
+            for func in funcs:
+                try:
+                    results.append(func())
+                except Exception as e:  # pylint: disable=broad-except
+                    results.append(e)
+            return results
+
+        return await self.run_async(run_batch, priority=priority)
+
+    async def slot_async(self, func, *args, priority=1):
+        """ Run a blocking call in the next shared slot
+
+        The calls made within slot_window seconds of the first one run as one
+        batch, at the lowest priority of them. Every call sees the context
+        of its caller.
+
+        Returns:
+            the result of func(*args)
+        """
+        loop = asyncio.get_event_loop()
+        if self._slot is None:
+            self._slot = []
+            loop.call_later(self._slot_window, self._run_slot)
+        future = loop.create_future()
+        context = contextvars.copy_context()
+        self._slot.append((functools.partial(context.run, func, *args),
+                           priority, future))
+        return await future
+
+    def _run_slot(self):
+        slot, self._slot = self._slot, None
+        batch = asyncio.ensure_future(self.batch_async(
+            [call for call, _, _ in slot],
+            priority=min(priority for _, priority, _ in slot)))
+        batch.add_done_callback(functools.partial(self._settle_slot, slot))
+
+    @staticmethod
+    def _settle_slot(slot, batch):
+        error = (asyncio.CancelledError() if batch.cancelled()
+                 else batch.exception())
+        if error is not None:
+            for _, _, future in slot:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        for (_, _, future), result in zip(slot, batch.result()):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def _next(self):
+        """
+        Returns:
+            tuple: the queued transaction of the lowest aged priority, None
+                to stop the I/O thread
+        """
+        with self._condition:
+            while not self._pending and self._stops == 0:
+                self._condition.wait()
+            if not self._pending:
+                self._stops -= 1
+                return None
+            now = time.monotonic()
+
+            def aged(priority):
+                submitted, seq = self._pending[priority][0][:2]
+                return (priority - (now - submitted) / self._aging, seq)
+
+            priority = min(self._pending, key=aged)
+            transactions = self._pending[priority]
+            transaction = transactions.popleft()
+            if not transactions:
+                del self._pending[priority]
+            return transaction
+
+    def _work(self):
+        while True:
+            transaction = self._next()
+            if transaction is None:
+                return
+            _, _, func, args, future = transaction
+            if not future.set_running_or_notify_cancel():
+                continue
+            self.transactions += 1
+            try:
+                future.set_result(func(*args))
+            except BaseException as e:  # pylint: disable=broad-except
+                future.set_exception(e)
+
+    def stop(self):
+        """ Stop the I/O thread after the queued transactions
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            with self._condition:
+                self._stops += 1
+                self._condition.notify()
+            thread.join()
+
 
 class HWSPI(SPI):
     """ Hardware SPI
+
+    A transfer is one SPI_IOC_MESSAGE ioctl on buffers allocated once per
+    device, so sampling does not create lists for the garbage collector.
     """
 
-    def __init__(self, device, ce, config):
+    BUFFER_SIZE = 64
+
+    def __init__(self, device, ce, config, controller=None, priority=1):
         """
         Args:
             device (int): the number of SPI device
             ce (int): the number of chip select of SPI device
             config (SPIConfig):
+            controller (SPIController): the controller shared by the chip
+                selects of device, a private one is created if it is None
+            priority (int): the controller runs the transactions of a lower
+                priority first
         """
         self._device = device
         self._ce = ce
         self._config = config
-        self._spi = SpiDev()
+        self._controller = (SPIController(device) if controller is None
+                            else controller)
+        self._priority = priority
+        self._fd = None
+        self._span_args = {'device': device, 'ce': ce}
+        self._allocate(HWSPI.BUFFER_SIZE)
+
+    def _allocate(self, size):
+        self._tx = bytearray(size)
+        self._rx = bytearray(size)
+        self._rx_view = memoryview(self._rx)
+        self._tx_dirty = 0
+        self._transfer_len = 0
+        # The kernel reads and writes the bytearrays in place
+        self._transfer = _SpiIocTransfer()
+        self._transfer.speed_hz = self._config.speed
+        self._transfer.tx_buf = ctypes.addressof(
+            (ctypes.c_char * size).from_buffer(self._tx))
+        self._transfer.rx_buf = ctypes.addressof(
+            (ctypes.c_char * size).from_buffer(self._rx))
+
+    @property
+    def controller(self):
+        return self._controller
+
+    async def run_async(self, func, *args):
+        return await self._controller.run_async(func, *args,
+                                                priority=self._priority)
+
+    async def slot_async(self, func, *args):
+        return await self._controller.slot_async(func, *args,
+                                                 priority=self._priority)
 
     def open(self):
-        logger.info("Open SPI(%d,%d)", self._device, self._ce)
-        self._spi.open(self._device, self._ce)
-        self._spi.mode = self._config.mode
-        self._spi.max_speed_hz = self._config.speed
+        if self._fd is None:
+            self._fd = self._controller.open(self._ce)
 
     def close(self):
-        logger.info("Close SPI(%d,%d)", self._device, self._ce)
-        self._spi.close()
+        if self._fd is not None:
+            self._controller.close(self._ce)
+            self._fd = None
 
     def transfer(self, writedata, readsize):
-        buf = self._spi.xfer(writedata + [0] * readsize)
-        return buf[len(writedata):]
+        return list(self.transfer_into(writedata, readsize))
+
+    def transfer_into(self, writedata, readsize):
+        write_size = len(writedata)
+        size = write_size + readsize
+        if size > len(self._tx):
+            self._allocate(size)
+        self._tx[:write_size] = writedata
+        # Clock out zeros while reading, clear what a longer write left
+        if self._tx_dirty > write_size:
+            self._tx[write_size:self._tx_dirty] = bytes(self._tx_dirty -
+                                                        write_size)
+        self._tx_dirty = write_size
+        if size != self._transfer_len:
+            self._transfer.len = size
+            self._transfer_len = size
+        self._controller.select(self._ce, self._config.mode)
+        if tracing.enabled:
+            with tracing.span('spi.transfer', 'spi', self._span_args):
+                self._message()
+        else:
+            self._message()
+        return self._rx_view[write_size:size]
+
+    def _message(self):
+        fcntl.ioctl(self._fd, SPI_IOC_MESSAGE_1, self._transfer)
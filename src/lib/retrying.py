@@ -12,6 +12,8 @@
 ## See the License for the specific language governing permissions and
 ## limitations under the License.
 
+import asyncio
+import inspect
 import random
 import six
 import sys
@@ -39,6 +41,13 @@ def retry(*dargs, **dkw):
     if len(dargs) == 1 and callable(dargs[0]):
         def wrap_simple(f):
 
+            if asyncio.iscoroutinefunction(f):
+                @six.wraps(f)
+                async def async_wrapped_f(*args, **kw):
+                    return await AsyncRetrying().call(f, *args, **kw)
+
+                return async_wrapped_f
+
             @six.wraps(f)
             def wrapped_f(*args, **kw):
                 return Retrying().call(f, *args, **kw)
@@ -50,6 +59,14 @@ def retry(*dargs, **dkw):
     else:
         def wrap(f):
 
+            # coroutine functions are retried with asyncio.sleep
+            if asyncio.iscoroutinefunction(f):
+                @six.wraps(f)
+                async def async_wrapped_f(*args, **kw):
+                    return await AsyncRetrying(*dargs, **dkw).call(f, *args, **kw)
+
+                return async_wrapped_f
+
             @six.wraps(f)
             def wrapped_f(*args, **kw):
                 return Retrying(*dargs, **dkw).call(f, *args, **kw)
@@ -250,6 +267,70 @@ class Retrying(object):
             attempt_number += 1
 
 
+class AsyncRetrying(Retrying):
+    """
+    Retrying for coroutine functions. It waits with asyncio.sleep so a retry
+    never blocks the event loop, and cancelling the caller cancels the
+    running attempt or the wait between attempts at once.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """
+        Accepts the arguments of Retrying, plus
+        @param attempt_timeout: max time of one attempt in millisecond, an
+            attempt running longer fails with asyncio.TimeoutError
+        """
+        attempt_timeout = kwargs.pop('attempt_timeout', None)
+        super(AsyncRetrying, self).__init__(*args, **kwargs)
+        self._attempt_timeout = attempt_timeout
+
+    @staticmethod
+    async def _run_hook(hook, attempt_number):
+        if hook:
+            result = hook(attempt_number)
+            if inspect.isawaitable(result):
+                await result
+
+    async def call(self, fn, *args, **kwargs):
+        start_time = int(round(time.time() * 1000))
+        attempt_number = 1
+        while True:
+            await self._run_hook(self._before_attempts, attempt_number)
+
+            try:
+                coro = fn(*args, **kwargs)
+                if self._attempt_timeout is not None:
+                    coro = asyncio.wait_for(coro, self._attempt_timeout / 1000.0)
+                attempt = Attempt(await coro, attempt_number, False)
+            except asyncio.CancelledError:
+                # never retry a cancelled call
+                raise
+            except:
+                tb = sys.exc_info()
+                attempt = Attempt(tb, attempt_number, True)
+
+            if not self.should_reject(attempt):
+                return attempt.get(self._wrap_exception)
+
+            await self._run_hook(self._after_attempts, attempt_number)
+
+            delay_since_first_attempt_ms = int(round(time.time() * 1000)) - start_time
+            if self.stop(attempt_number, delay_since_first_attempt_ms):
+                if not self._wrap_exception and attempt.has_exception:
+                    # get() on an attempt with an exception should cause it to be raised, but raise just in case
+                    raise attempt.get()
+                else:
+                    raise RetryError(attempt)
+            else:
+                sleep = self.wait(attempt_number, delay_since_first_attempt_ms)
+                if self._wait_jitter_max:
+                    jitter = random.random() * self._wait_jitter_max
+                    sleep = sleep + max(0, jitter)
+                await asyncio.sleep(sleep / 1000.0)
+
+            attempt_number += 1
+
+
 class Attempt(object):
     """
     An Attempt encapsulates a call to a target function that may end as a
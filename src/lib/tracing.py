@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+from logzero import logger
+
+# The span the running code is in, _UNSAMPLED inside a dropped trace
+_current = contextvars.ContextVar('trace_span', default=None)
+_UNSAMPLED = object()
+# Carried in the requests of a dropped trace, the handlers drop it too
+_UNSAMPLED_CONTEXT = {'sampled': False}
+
+_tracer = None
+# For the hot paths to skip even the no-op span
+enabled = False
+
+
+def _new_id():
+    return '%016x' % random.getrandbits(64)
+
+
+class ChromeTraceExporter(object):
+    """ Write the spans as Chrome trace events
+
+    The file is a JSON array of complete ('X') events which chrome://tracing
+    and Perfetto load even when the array is not closed, so the events are
+    appended as they end and a killed process still leaves a usable file.
+    Every trace is drawn on its own row.
+    """
+
+    def __init__(self, path, process_name=None, buffer_events=100):
+        """
+        Args:
+            path (str): the trace file, overwritten
+            process_name (str): the name of this process in the viewer
+            buffer_events (int): events kept before writing them
+        """
+        self._file = open(path, 'w')
+        self._file.write('[\n')
+        self._buffer_events = buffer_events
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        if process_name is not None:
+            self._buffer.append({'name': 'process_name', 'ph': 'M',
+                                 'pid': self._pid,
+                                 'args': {'name': process_name}})
+        self.exported = 0
+
+    def export(self, span):
+        event = {
+            'name': span.name,
+            'cat': span.category,
+            'ph': 'X',
+            'ts': span.start_us,
+            'dur': span.duration_us,
+            'pid': self._pid,
+            'tid': int(span.trace_id[:8], 16),
+            'args': dict(span.args or {}, trace_id=span.trace_id,
+                         span_id=span.span_id, parent_id=span.parent_id),
+        }
+        # The SPI spans may end in an I/O thread
+        with self._lock:
+            self._buffer.append(event)
+            self.exported += 1
+            if len(self._buffer) >= self._buffer_events:
+                self._write()
+
+    def _write(self):
+        if self._file is None:
+            return
+        for event in self._buffer:
+            self._file.write(json.dumps(event, separators=(',', ':')))
+            self._file.write(',\n')
+        self._buffer = []
+        self._file.flush()
+
+    def flush(self):
+        with self._lock:
+            self._write()
+
+    def close(self):
+        with self._lock:
+            self._write()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class Span(object):
+    """ A timed operation of a trace, ended when the with block exits
+    """
+
+    def __init__(self, tracer, name, category, trace_id, parent_id, args):
+        self._tracer = tracer
+        self._token = None
+        self._start = None
+        self.name = name
+        self.category = category
+        self.trace_id = trace_id
+        self.span_id = _new_id()
+        self.parent_id = parent_id
+        self.args = args
+        self.start_us = None
+        self.duration_us = None
+
+    def context(self):
+        """
+        Returns:
+            dict: the ids the child spans in other services need
+        """
+        return {'trace_id': self.trace_id, 'span_id': self.span_id}
+
+    def __enter__(self):
+        self.start_us = int(time.time() * 1e6)
+        self._start = time.perf_counter()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration_us = int((time.perf_counter() - self._start) * 1e6)
+        _current.reset(self._token)
+        if exc_type is not None:
+            self.args = dict(self.args or {}, error=repr(exc))
+        self._tracer.export(self)
+        return False
+
+
+class _NoopSpan(object):
+    def context(self):
+        return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+class _UnsampledSpan(_NoopSpan):
+    """ Keep the spans under a dropped root from sampling again """
+
+    def __init__(self):
+        self._token = None
+
+    def context(self):
+        return dict(_UNSAMPLED_CONTEXT)
+
+    def __enter__(self):
+        self._token = _current.set(_UNSAMPLED)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self._token)
+        return False
+
+
+class Tracer(object):
+    def __init__(self, exporter, sample_rate=1.0):
+        """
+        Args:
+            exporter (ChromeTraceExporter): receives the ended spans
+            sample_rate (float): the ratio of root spans which are traced,
+                the spans under them follow their root
+        """
+        self._exporter = exporter
+        self._sample_rate = sample_rate
+
+    def span(self, name, category, args=None, parent=None):
+        if parent is None:
+            current = _current.get()
+            if current is _UNSAMPLED:
+                return _UnsampledSpan()
+            if current is not None:
+                return Span(self, name, category, current.trace_id,
+                            current.span_id, args)
+            if random.random() >= self._sample_rate:
+                return _UnsampledSpan()
+            return Span(self, name, category, _new_id(), None, args)
+        if not parent.get('sampled', True):
+            return _UnsampledSpan()
+        return Span(self, name, category, parent['trace_id'],
+                    parent['span_id'], args)
+
+    def export(self, span):
+        try:
+            self._exporter.export(span)
+        except Exception as e:  # pylint: disable=broad-except
+            logger.error("Cannot export span '%s': %s", span.name, e)
+
+    def close(self):
+        self._exporter.close()
+
+
+def configure(config):
+    """
+    Args:
+        config (dict): e.g. {'enable': True, 'path': 'trace.json',
+            'sample_rate': 0.1, 'process_name': 'turing'}, None or disabled
+            to turn tracing off
+    """
+    if config is None or not config.get('enable', False):
+        set_tracer(None)
+        return
+    exporter = ChromeTraceExporter(config['path'],
+                                   config.get('process_name'),
+                                   config.get('buffer_events', 100))
+    set_tracer(Tracer(exporter, config.get('sample_rate', 1.0)))
+
+
+def set_tracer(tracer):
+    global _tracer, enabled  # pylint: disable=global-statement
+    if _tracer is not None:
+        _tracer.close()
+    _tracer = tracer
+    enabled = tracer is not None
+
+
+def span(name, category='', args=None, parent=None):
+    """ Trace the with block
+
+    Args:
+        name (str): e.g. the request subject
+        category (str): e.g. 'bus', 'serial' or 'spi'
+        args (dict): shown with the span in the viewer
+        parent (dict): the context of a span in another service, the current
+            span is the parent if it is None, {'sampled': False} drops the
+            span and its children
+    Returns:
+        a context manager, a shared no-op one when tracing is off
+    """
+    if _tracer is None:
+        return _NOOP
+    return _tracer.span(name, category, args, parent)
+
+
+def current_context():
+    """
+    Returns:
+        dict: the context of the current span to carry in a request,
+            {'sampled': False} in a dropped trace, None if it is not traced
+    """
+    current = _current.get()
+    if current is None:
+        return None
+    if current is _UNSAMPLED:
+        return dict(_UNSAMPLED_CONTEXT)
+    return current.context()
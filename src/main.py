@@ -7,8 +7,9 @@ from contextlib import suppress
 
 import yaml
 
-from bus.nats_bus import NatsBus
+from bus.bus_manager import BusManager
 from hardware.hw_manager import HWManager
+from lib import tracing
 from services.service_manager import ServiceManager
 
 
@@ -22,15 +23,16 @@ async def main():
     with open(args.configuration, 'r') as file:
         configuration = yaml.load(file.read())
 
+    tracing.configure(configuration.get('tracing'))
+
     hwm = HWManager()
     hwm.import_config(configuration['hardwares'])
 
-    bus_config = configuration['bus']
-    bus = NatsBus(bus_config['host'], bus_config['port'])
-    await bus.start()
+    bum = BusManager()
+    bum.import_config(configuration['bus'])
 
     svm = ServiceManager()
-    svm.import_config(configuration['services'], hwm, bus)
+    svm.import_config(configuration['services'], hwm, bum)
     svm.start_all_services()
 
     while True:
@@ -3,7 +3,11 @@
 import time
 import math
 import asyncio
+import itertools
+from concurrent import futures
 from logzero import logger
+from bus.bus import RpcError
+from services.barista.brew_stream import BrewStream, encode_chunk
 from services.barista.point import Point
 from services.barista.point_translator import point_to_gcode
 from services.barista.point_translator import point_to_hcode
@@ -104,7 +108,8 @@ class TimeTransformer(object):
 
 class Barista(object):
     def __init__(self, moving_dev, extruder_dev, mix_pid_dev,
-                 waste_water_position, default_moving_speed, bus):
+                 waste_water_position, default_moving_speed, bus,
+                 status_cache_ms=None, stream_config=None):
         self._commands = {
             "wait": self._create_wait,
             "calibration": self._create_calibration,
@@ -119,8 +124,8 @@ class Barista(object):
         self._default_moving_speed = 5000
         self._bus = bus
         self._refill = RefillClient(bus)
-        self._output_temp = OutputTempClient(bus)
-        self._tank_temp = TankTempClient(bus)
+        self._output_temp = OutputTempClient(bus, status_cache_ms)
+        self._tank_temp = TankTempClient(bus, status_cache_ms)
         self._water_transformer = WaterTransformer(mix_pid_dev,
                                                    self._output_temp)
         self._time_transformer = TimeTransformer()
@@ -133,6 +138,11 @@ class Barista(object):
         self._stop_event = asyncio.Event()
         self._queue = asyncio.Queue(maxsize=1)
 
+        # The brew uploaded in chunks, see BrewStream
+        self._stream_config = stream_config or {}
+        self._stream = None
+        self._sessions = itertools.count(1)
+
         self._position = Point.create_point(x=0, y=0, z=0)
 
     def _create_wait(self, param):
@@ -260,6 +270,8 @@ class Barista(object):
 
     async def start(self):
         await self._bus.reg_rep('barista', self.command_callback)
+        await self._output_temp.subscribe()
+        await self._tank_temp.subscribe()
         self._moving_dev.connect(3)
         self._extruder_dev.connect(3)
 
@@ -282,6 +294,20 @@ class Barista(object):
             self._water_transformer.high_temperature = await self._tank_temp.get_temperature(
             )
 
+        self._reset()
+        if isinstance(params, BrewStream):
+            # Execute every chunk once it arrives
+            while True:
+                chunk = await params.next_chunk()
+                if chunk is None:
+                    break
+                await self._run_params(chunk)
+        else:
+            await self._run_params(params)
+
+        await self._refill.start()
+
+    async def _run_params(self, params):
         commands = []
         for param in params:
             if param['type'] == 'command' and param['name'] in self._commands:
@@ -292,12 +318,9 @@ class Barista(object):
                 logger.error('Invalid input point %s', param)
                 continue
 
-        self._reset()
         for command in commands:
             await command()
 
-        await self._refill.start()
-
     async def command_callback(self, data):
         cmd = data['command']
         if cmd == 'get':
@@ -309,6 +332,31 @@ class Barista(object):
                 return {'status': 'ok'}
             except asyncio.QueueFull:
                 return {'status': 'error', 'message': 'barista is busy'}
+        elif cmd == 'brew_begin':
+            return self._begin_stream()
+        elif cmd in ('brew_chunk', 'brew_end', 'brew_abort'):
+            stream = self._stream
+            if stream is None or stream.session != data.get('session'):
+                return {'status': 'error', 'message': 'Unknown brew session'}
+            if cmd == 'brew_chunk':
+                return stream.add(data['seq'], data)
+            elif cmd == 'brew_end':
+                return stream.end(data['count'])
+            return stream.abort()
+
+        return {"status": "error", "message": "Unknown command '%s'" % cmd}
+
+    def _begin_stream(self):
+        if self._stream is not None and not (self._stream.ended or
+                                             self._stream.aborted):
+            return {'status': 'error', 'message': 'barista is busy'}
+        stream = BrewStream(next(self._sessions), **self._stream_config)
+        try:
+            self._queue.put_nowait(stream)
+        except asyncio.QueueFull:
+            return {'status': 'error', 'message': 'barista is busy'}
+        self._stream = stream
+        return {'status': 'ok', 'session': stream.session}
 
     def _reset(self):
         self._time_transformer.set_position(0, 0, 0)
@@ -326,3 +374,106 @@ class Barista(object):
                 f=self._default_moving_speed)
         ]
         await self._handle_point(points)
+
+
+class BaristaClient(object):
+    def __init__(self, bus):
+        self._bus = bus
+
+    async def brew(self, params, chunk_size=100, compression='zlib',
+                   retries=3, busy_interval=0.5, busy_timeout=60):
+        """ Upload the brew in chunks, the barista starts with the first one
+
+        Every chunk waits for its ack. A timeout chunk is sent again, the
+        barista acks a chunk it already has without queueing it twice.
+
+        Args:
+            params (list): brew parameters, the same as the 'brew' command
+            chunk_size (int): parameters of each chunk
+            compression (str): None or 'zlib'
+            retries (int): times to resend a chunk which is not acked
+            busy_interval (float): wait before resending a chunk the barista
+                has no room for
+            busy_timeout (float): max seconds a chunk waits for room
+        Returns:
+            bool: True if all chunks are acked
+        Raises:
+            futures.TimeoutError: the barista stayed busy for busy_timeout,
+                the brew is aborted
+        """
+        response = await self._req({'command': 'brew_begin'}, 'brew_begin')
+        if response is None:
+            return False
+        session = response['session']
+
+        count = 0
+        for start in range(0, len(params), chunk_size):
+            request = {'command': 'brew_chunk', 'session': session,
+                       'seq': count}
+            request.update(
+                encode_chunk(params[start:start + chunk_size], compression))
+            try:
+                sent = await self._send_chunk(request, retries, busy_interval,
+                                              busy_timeout)
+            except futures.TimeoutError:
+                await self._req({'command': 'brew_abort', 'session': session},
+                                'brew_abort')
+                raise
+            if not sent:
+                await self._req({'command': 'brew_abort', 'session': session},
+                                'brew_abort')
+                return False
+            count += 1
+
+        response = await self._req({'command': 'brew_end', 'session': session,
+                                    'count': count}, 'brew_end')
+        return response is not None
+
+    async def _send_chunk(self, request, retries, busy_interval,
+                          busy_timeout):
+        loop = asyncio.get_event_loop()
+        busy_deadline = loop.time() + busy_timeout
+        attempts = 0
+        while attempts <= retries:
+            try:
+                response = await self._bus.req('barista', request)
+            except futures.TimeoutError:
+                logger.warn("Request brew chunk %d timeout", request['seq'])
+                attempts += 1
+                continue
+            except RpcError as e:
+                if not e.busy:
+                    logger.warn("Cannot send brew chunk %d: %s",
+                                request['seq'], e)
+                    return False
+                # The request queue of the barista is full, wait as for a
+                # full chunk queue
+                response = {'status': 'error', 'message': 'busy'}
+            if response['status'] == 'ok':
+                return True
+            if response.get('message') == 'busy':
+                # The barista is still executing the previous chunks
+                if loop.time() + busy_interval > busy_deadline:
+                    raise futures.TimeoutError(
+                        "barista is busy for brew chunk %d" % request['seq'])
+                await asyncio.sleep(busy_interval)
+                continue
+            logger.warn("Cannot send brew chunk %d: %s", request['seq'],
+                        response['message'])
+            return False
+        return False
+
+    async def _req(self, request, name):
+        try:
+            response = await self._bus.req('barista', request)
+            if response['status'] != 'ok':
+                logger.warn("Cannot %s 'barista': %s", name,
+                            response['message'])
+                return None
+            return response
+        except (futures.TimeoutError, asyncio.TimeoutError):
+            logger.warn("Request %s 'barista' timeout", name)
+            return None
+        except (RpcError, ConnectionError) as e:
+            logger.warn("Cannot %s 'barista': %s", name, e)
+            return None
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import base64
+import json
+import zlib
+from logzero import logger
+
+COMPRESSIONS = (None, 'zlib')
+
+
+def encode_chunk(params, compression=None):
+    """
+    Args:
+        params (list): brew parameters of this chunk, e.g. [{'type': 'point',
+            'point': [...]}]
+        compression (str): None or 'zlib'
+    Returns:
+        dict: the fields of the chunk in the 'brew_chunk' request
+    """
+    if compression is None:
+        return {'points': params}
+    if compression == 'zlib':
+        data = zlib.compress(
+            json.dumps(params, separators=(',', ':')).encode('utf-8'))
+        # base64 keeps it a string for the JSON codec
+        return {'compression': 'zlib',
+                'data': base64.b64encode(data).decode('ascii')}
+    raise ValueError("Unknown compression '%s'" % compression)
+
+
+def decode_chunk(request):
+    """
+    Returns:
+        list: brew parameters of the chunk
+    Raises:
+        ValueError: the chunk cannot be decoded
+    """
+    compression = request.get('compression')
+    if compression is None:
+        return request['points']
+    if compression == 'zlib':
+        try:
+            data = zlib.decompress(base64.b64decode(request['data']))
+        except (zlib.error, TypeError) as e:
+            raise ValueError("Broken chunk: %s" % e)
+        return json.loads(data.decode('utf-8'))
+    raise ValueError("Unknown compression '%s'" % compression)
+
+
+class BrewStream(object):
+    """ The recipe of one brew uploaded in chunks
+
+    The chunks must come in sequence order, each one is acked with its
+    sequence number in the reply. A retransmitted chunk is acked again
+    without being queued twice. The barista takes the chunks with
+    next_chunk while the later ones are still uploading.
+    """
+
+    def __init__(self, session, max_pending=4, chunk_timeout=10):
+        """
+        Args:
+            session (int): the id of this upload
+            max_pending (int): chunks waiting to be executed, the chunks
+                over it get a busy error and must be sent again
+            chunk_timeout (float): abort the brew if the next chunk does not
+                come within this seconds
+        """
+        self.session = session
+        self._chunk_timeout = chunk_timeout
+        self._queue = asyncio.Queue(maxsize=max_pending)
+        self._next_seq = 0
+        self.ended = False
+        self.aborted = False
+
+    def _error(self, message):
+        return {'status': 'error', 'message': message,
+                'expected': self._next_seq}
+
+    def add(self, seq, request):
+        """
+        Args:
+            seq (int): sequence number of the chunk, starts from 0
+            request (dict): the 'brew_chunk' request, see encode_chunk
+        Returns:
+            dict: the reply of the request
+        """
+        if self.ended or self.aborted:
+            return self._error('brew upload is closed')
+        if seq < self._next_seq:
+            return {'status': 'ok', 'ack': seq}
+        if seq > self._next_seq:
+            return self._error('expect chunk %d' % self._next_seq)
+        if self._queue.full():
+            return self._error('busy')
+
+        try:
+            params = decode_chunk(request)
+        except (ValueError, KeyError) as e:
+            return self._error(str(e))
+        self._queue.put_nowait(params)
+        self._next_seq += 1
+        return {'status': 'ok', 'ack': seq}
+
+    def end(self, count):
+        """
+        Args:
+            count (int): number of chunks sent
+        """
+        if self.aborted:
+            return self._error('brew upload is aborted')
+        if count != self._next_seq:
+            return self._error('expect chunk %d' % self._next_seq)
+        if not self.ended:
+            self.ended = True
+            # A full queue keeps every chunk, next_chunk sees the end once
+            # it is drained
+            if not self._queue.full():
+                self._queue.put_nowait(None)
+        return {'status': 'ok', 'ack': count}
+
+    def abort(self):
+        if not self.ended and not self.aborted:
+            self.aborted = True
+            # The end marker never waits for room, drop a pending chunk
+            if self._queue.full():
+                self._queue.get_nowait()
+            self._queue.put_nowait(None)
+        return {'status': 'ok'}
+
+    async def next_chunk(self):
+        """
+        Returns:
+            list: brew parameters of the next chunk, None at the end of the
+                upload or when it is aborted
+        """
+        if self.aborted or (self.ended and self._queue.empty()):
+            return None
+        try:
+            params = await asyncio.wait_for(self._queue.get(),
+                                            self._chunk_timeout)
+        except asyncio.TimeoutError:
+            logger.error("Brew upload %d timeout at chunk %d", self.session,
+                         self._next_seq)
+            self.aborted = True
+            return None
+        if self.aborted:
+            return None
+        return params
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import math
+
+
+class Cadence(object):
+    """ Sleep until the next tick of a fixed period
+
+    Sleeping the scan interval after the work makes the period drift by the
+    time the work takes. The ticks here are counted from the first wait, and
+    the ticks missed by a slow scan are skipped instead of run back to back.
+    Aligned cadences of the same interval tick at the same time, e.g. the
+    services sampling the sensors of one SPI controller in one slot.
+
+    Attributes:
+        missed (int): number of ticks skipped
+    """
+
+    def __init__(self, interval_ms, align=False):
+        """
+        Args:
+            interval_ms (int): the period in millisecond
+            align (bool): tick on the multiples of the period of the event
+                loop clock instead of counting from the first wait
+        """
+        self._interval = float(interval_ms) / 1000
+        self._align = align
+        self._next = None
+        self.missed = 0
+
+    async def wait(self):
+        now = asyncio.get_event_loop().time()
+        if self._next is None:
+            self._next = now
+            if self._align:
+                self._next = (math.floor(now / self._interval) *
+                              self._interval)
+        self._next += self._interval
+
+        if self._next < now:
+            missed = int((now - self._next) // self._interval) + 1
+            self.missed += missed
+            self._next += missed * self._interval
+        await asyncio.sleep(self._next - now)
@@ -4,11 +4,12 @@
 from concurrent import futures
 import asyncio
 from logzero import logger
+from bus.bus import RpcError
 from services.tank_temp_service import TankTempClient
 
 
 class Heater(object):
-    def __init__(self, pwm, pid, scan_interval_ms, bus):
+    def __init__(self, pwm, pid, scan_interval_ms, bus, status_cache_ms=None):
         self._pwm = pwm
         self._pid = pid
         self._interval_ms = scan_interval_ms
@@ -17,7 +18,7 @@ class Heater(object):
         self._target_temp = 0
         self._stop = False
         self._stop_event = asyncio.Event()
-        self._tank_temp_client = TankTempClient(bus)
+        self._tank_temp_client = TankTempClient(bus, status_cache_ms)
 
     async def start(self):
         self._stop = False
@@ -25,17 +26,15 @@ class Heater(object):
         self._pwm_task = asyncio.get_event_loop().create_task(
             self._pwm.start())
         await self._bus.reg_rep('tank.heater', self.command_callback)
+        await self._tank_temp_client.subscribe()
 
         logger.info("start heating water")
         while not self._stop:
-            temperature = self._tank_temp_client.get_temperature()
-            if temperature is None:
-                logger.warn('Cannot get temperature, stop heat')
+            try:
+                await self._heat()
+            except Exception as e:  # pylint: disable=broad-except
+                logger.error("Heater loop got error, stop heat: %s", e)
                 self._pwm.dutycycle = 0
-            else:
-                dutycycle = self._pid.compute(temperature, self._target_temp,
-                                              float(self._interval_ms) / 1000)
-                self._pwm.dutycycle = dutycycle
             await asyncio.sleep(float(self._interval_ms) / 1000)
 
         self._pwm.stop()
@@ -43,6 +42,16 @@ class Heater(object):
         self._pwm_task = None
         self._stop_event.set()
 
+    async def _heat(self):
+        temperature = await self._tank_temp_client.get_temperature()
+        if temperature is None:
+            logger.warn('Cannot get temperature, stop heat')
+            self._pwm.dutycycle = 0
+        else:
+            dutycycle = self._pid.compute(temperature, self._target_temp,
+                                          float(self._interval_ms) / 1000)
+            self._pwm.dutycycle = dutycycle
+
     async def stop(self):
         self._stop = True
         await self._stop_event.wait()
@@ -70,6 +79,9 @@ class HeaterClient(object):
                 logger.warn("Cannot get 'tank.heater' status: %s",
                             response['message'])
                 return None
-        except futures.TimeoutError:
+        except (futures.TimeoutError, asyncio.TimeoutError):
             logger.warn("Cannot get 'tank.heater' status: request timeout")
             return None
+        except (RpcError, ConnectionError) as e:
+            logger.warn("Cannot get 'tank.heater' status: %s", e)
+            return None
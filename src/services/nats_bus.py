@@ -4,20 +4,39 @@
 from nats.aio.client import Client as NATS
 from nats.aio.errors import ErrConnectionClosed, ErrTimeout, ErrNoServers
 from logzero import logger
-import json
+from lib import tracing
+from bus import codec as bus_codec
+from bus import deadline as bus_deadline
+from bus.request_mux import RequestMultiplexer
+from bus.single_flight import SingleFlight
+from bus.outbox import create_outbox
+from bus.subscriber import Subscriber
 
 
 class NatsBus(object):
-    def __init__(self, host, port):
+    def __init__(self, host, port, codec=None, outbox=None):
         self._nats_client = NATS()
         self._url = "nats://%s:%d" % (host, port)
+        self._codec = bus_codec.get_codec() if codec is None else codec
+        self._request_mux = RequestMultiplexer(self._nats_client)
+        self._handler_flights = SingleFlight()
+        self._outbox = create_outbox() if outbox is None else outbox
 
     def cb_wrap(self, callback):
         async def wrap(msg):
-            response = await callback(json.loads(msg.data.decode()))
+            data = bus_codec.decode(msg.data)
+            deadline = data.pop('_deadline', None)
+            trace = data.pop('_trace', None)
+            if bus_deadline.expired(deadline):
+                # The requester has given up, skip the work
+                logger.debug("Drop expired request on '%s'", msg.subject)
+                return
+            with bus_deadline.scope(deadline), \
+                    tracing.span(msg.subject, 'rpc', parent=trace):
+                response = await callback(data)
             if response is not None:
                 await self._nats_client.publish(
-                    msg.reply, json.dumps(response).encode('utf-8'))
+                    msg.reply, self._codec.encode(response))
 
         return wrap
 
@@ -27,37 +46,70 @@ class NatsBus(object):
             try:
                 logger.info("Try to connect to nats server '%s', %d times",
                             self._url, retry_times)
-                await self._nats_client.connect(servers=[self._url])
+                await self._nats_client.connect(
+                    servers=[self._url], reconnected_cb=self._on_reconnected)
                 break
             except ErrNoServers:
                 retry_times += 1
                 logger.error("Cannot connect to nats server '%s'", self._url)
         logger.info("Connect to nats server '%s' successfully", self._url)
+        await self._on_reconnected()
+
+    async def _on_reconnected(self):
+        self._outbox.start_drain(self._nats_client.publish,
+                                 lambda: self._nats_client.is_connected)
 
     async def req(self, path, payload, timeout=1):
         if not self._nats_client.is_connected:
             return None
-        response = await self._nats_client.timed_request(
-            path + '.rep', json.dumps(payload).encode('utf-8'), timeout)
-        return json.loads(response.data.decode())
+        # Carry the deadline for the handler, nested requests inherit it
+        deadline, timeout = bus_deadline.derive(timeout)
+        payload = dict(payload, _deadline=deadline)
+        with tracing.span(path, 'bus') as span:
+            trace = span.context()
+            if trace is not None:
+                payload['_trace'] = trace
+            response = await self._request_mux.request(
+                path + '.rep', self._codec.encode(payload), timeout)
+        return bus_codec.decode(response.data)
 
-    async def reg_rep(self, path, callback):
+    async def reg_rep(self, path, callback, idempotent=False):
         if not self._nats_client.is_connected:
             return False
+        if idempotent:
+            callback = self._handler_flights.wrap(path, callback)
         await self._nats_client.subscribe(
             path + '.rep', cb=self.cb_wrap(callback))
         return True
 
     async def pub(self, path, payload):
-        if not self._nats_client.is_connected:
-            return False
-        await self._nats_client.publish(path + '.pub',
-                                        json.dumps(payload).encode('utf-8'))
-        return True
+        subject = path + '.pub'
+        data = self._codec.encode(payload)
+        if self._nats_client.is_connected and len(self._outbox) == 0:
+            try:
+                await self._nats_client.publish(subject, data)
+                return True
+            except ErrConnectionClosed:
+                pass
 
-    async def reg_sub(self, path, callback):
+        # Keep it until reconnected, the sensor loops must not stop
+        self._outbox.put(subject, data)
+        if self._nats_client.is_connected:
+            await self._on_reconnected()
+        return False
+
+    async def reg_sub(self, path, callback, max_pending=16,
+                      policy=Subscriber.DROP):
         if not self._nats_client.is_connected:
             return False
-        await self._nats_client.subscribe(
-            path + '.pub', cb=self.cb_wrap(callback))
+        # Await the callback in the own task of the subscription, a slow
+        # subscriber must not stall the others
+        subscriber = Subscriber(path + '.pub', callback,
+                                decode=bus_codec.decode,
+                                max_pending=max_pending, policy=policy)
+
+        async def wrap(msg):
+            subscriber.put(msg.data)
+
+        await self._nats_client.subscribe(path + '.pub', cb=wrap)
         return True
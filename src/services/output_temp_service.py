@@ -3,52 +3,106 @@
 
 from concurrent import futures
 import asyncio
+import time
 from logzero import logger
+from bus.bus import RpcError
+from services.cadence import Cadence
 from hardware.error import HardwareError
+from hardware.max31856 import MAX31856
+from hardware.sensor import Sample
+from services.status_cache import StatusCache
 
 
 class OutputTempService(object):
-    def __init__(self, sensor, scan_interval_ms, bus):
+    def __init__(self, sensor, scan_interval_ms, bus, publish_policy=None,
+                 sampling=None):
         """
         Args:
             sensor: temperature sensor, can be max31856 and max31865
             scan_interval_ms (int): scan interval in milisecond
+            publish_policy (PublishPolicy): skip the pubs it rejects, None to
+                publish every scan
+            sampling (str): 'one-shot' or 'automatic' to read a new
+                conversion of max31856 every scan, 'auto' for one-shot if
+                the scan interval is longer than a conversion. None to read
+                the sensor without waiting a conversion
+        Raises:
+            ValueError: unknown sampling, or sampling of another sensor
         """
         self._sensor = sensor
+        self._sampling_mode = self._get_sampling_mode(sensor, sampling,
+                                                      scan_interval_ms)
         self._bus = bus
+        self._publish_policy = publish_policy
         self._interval = scan_interval_ms
         self._error_count = 0
         self._tempc = None
+        self._timestamp = None
         self._stop = False
         self._stop_event = asyncio.Event()
         self._temp_available = False
         self._message = "Not ready"
 
     async def pub_output_water_temperature(self):
-        if not self._sensor.is_connected() and not self._sensor.connect():
+        if (not self._sensor.is_connected() and
+                not await self._sensor.connect_async()):
             self._temp_available = False
             self._message = "Cannot connect to sensor"
-            await self._bus.pub('output.temperature', self._status())
+            await self._publish()
 
         try:
-            tempc = self._sensor.read_measure_temp_c()
-            self._tempc = tempc
+            sample = await self._sample()
+            self._tempc = sample.temperature
+            self._timestamp = sample.timestamp
             self._message = None
             self._temp_available = True
-            await self._bus.pub('output.temperature', self._status())
+            await self._publish()
         except HardwareError as error:
             self._temp_available = False
             self._error_count += 1
             self._message = "output sensor '%s' got error: '%s'" % (
                 error.name, error.message)
-            self._sensor.disconnect()
-            await self._bus.pub('output.temperature', self._status())
+            await self._sensor.disconnect_async()
+            await self._publish()
+
+    @staticmethod
+    def _get_sampling_mode(sensor, sampling, scan_interval_ms):
+        if sampling is None:
+            return None
+        if not isinstance(sensor, MAX31856):
+            raise ValueError("Sampling '%s' needs a max31856, not %s" %
+                             (sampling, type(sensor).__name__))
+        if sampling == 'one-shot':
+            return MAX31856.MODE_MANUAL
+        if sampling == 'automatic':
+            return MAX31856.MODE_AUTOMATIC
+        if sampling == 'auto':
+            # Idle between the scans if a conversion fits in one
+            one_shot = sensor.conversion_time(MAX31856.MODE_MANUAL)
+            if scan_interval_ms / 1000 > one_shot:
+                return MAX31856.MODE_MANUAL
+            return MAX31856.MODE_AUTOMATIC
+        raise ValueError("Unknown sampling '%s'" % sampling)
+
+    async def _sample(self):
+        if self._sampling_mode is None:
+            tempc = await self._sensor.read_measure_temp_c_async()
+            return Sample(time.time(), tempc)
+        return await self._sensor.sample_async(self._sampling_mode)
+
+    async def _publish(self):
+        status = self._status()
+        if (self._publish_policy is None or
+                self._publish_policy.should_publish(status)):
+            await self._bus.pub('output.temperature', status)
 
     async def start(self):
         self._stop = False
+        # Tick with the other sensors to share their SPI slot
+        cadence = Cadence(self._interval, align=True)
         while not self._stop:
             await self.pub_output_water_temperature()
-            await asyncio.sleep(float(self._interval) / 1000)
+            await cadence.wait()
         self._stop_event.set()
 
     async def stop(self):
@@ -65,6 +119,7 @@ class OutputTempService(object):
             return {
                 "status": "ok",
                 "temperature": self._tempc,
+                "timestamp": self._timestamp,
                 "error_count": self._error_count
             }
         else:
@@ -72,18 +127,50 @@ class OutputTempService(object):
 
 
 class OutputTempClient(object):
-    def __init__(self, bus):
+    def __init__(self, bus, cache_max_age_ms=None):
+        """
+        Args:
+            bus: bus client
+            cache_max_age_ms (int): serve get_temperature from the published
+                status younger than this, None to always send a request
+        """
         self._bus = bus
+        self._cache = None
+        if cache_max_age_ms is not None:
+            self._cache = StatusCache(cache_max_age_ms)
+        self._subscribed = False
+
+    async def subscribe(self):
+        """ Subscribe 'output.temperature' status to fill the cache
+        """
+        if self._cache is None or self._subscribed:
+            return
+        self._subscribed = await self._bus.reg_sub('output.temperature',
+                                                   self._cache.update)
 
     async def get_temperature(self):
         try:
-            response = await self._bus.req('output.temperature',
-                                           {'command': 'get'})
+            response = None
+            if self._cache is not None:
+                response = self._cache.get()
+            if response is None:
+                response = await self._bus.req('output.temperature',
+                                               {'command': 'get'})
             if response['status'] != 'ok':
                 logger.warn("Cannot get output temperature: %s",
                             response['message'])
                 return None
             return response['temperature']
-        except futures.TimeoutError:
+        except (futures.TimeoutError, asyncio.TimeoutError):
             logger.warn("Cannot get output temperature: request timeout")
             return None
+        except RpcError as e:
+            if e.busy:
+                # Shed the load, the next scan asks again
+                logger.info("'output.temperature' is busy, skip")
+            else:
+                logger.warn("Cannot get output temperature: %s", e)
+            return None
+        except ConnectionError as e:
+            logger.warn("Cannot get output temperature: %s", e)
+            return None
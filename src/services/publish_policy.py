@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+
+
+class PublishPolicy(object):
+    """ Decide whether a sensor service publishes the status of this scan
+
+    A reading is published when it moved out of the deadband around the last
+    published value, when the service has been silent for max_silence_ms, or
+    when the status changes between ok and error. Readings are never
+    published closer than min_interval_ms, except for status changes.
+    """
+
+    def __init__(self, value_key, abs_deadband=0, rel_deadband=0,
+                 max_silence_ms=None, min_interval_ms=None):
+        """
+        Args:
+            value_key (str): the field of the status to compare, e.g.
+                'temperature'
+            abs_deadband (float): changes not larger than this are not
+                published
+            rel_deadband (float): changes not larger than this ratio of the
+                last published value are not published
+            max_silence_ms (int): heartbeat, publish even if nothing changed
+                after this, None to publish changes only
+            min_interval_ms (int): min time between two pubs, None for no
+                limit
+        """
+        self._value_key = value_key
+        self._abs_deadband = abs_deadband
+        self._rel_deadband = rel_deadband
+        self._max_silence = (None if max_silence_ms is None else
+                             float(max_silence_ms) / 1000)
+        self._min_interval = (None if min_interval_ms is None else
+                              float(min_interval_ms) / 1000)
+        self._last_status = None
+        self._last_time = None
+        self.published = 0
+        self.suppressed = 0
+
+    @classmethod
+    def from_config(cls, value_key, config):
+        """
+        Args:
+            config (dict): 'publish' field of the service configuration, e.g.
+                {'abs_deadband': 0.1, 'max_silence_ms': 10000}
+        Returns:
+            PublishPolicy: None if config is None, publish every scan
+        """
+        if config is None:
+            return None
+        return cls(value_key,
+                   abs_deadband=config.get('abs_deadband', 0),
+                   rel_deadband=config.get('rel_deadband', 0),
+                   max_silence_ms=config.get('max_silence_ms'),
+                   min_interval_ms=config.get('min_interval_ms'))
+
+    def should_publish(self, status):
+        """ Call once per scan, the status is remembered when it returns True
+
+        Returns:
+            bool: True if the status should be published
+        """
+        now = time.monotonic()
+        if self._decide(status, now):
+            self._last_status = status
+            self._last_time = now
+            self.published += 1
+            return True
+        self.suppressed += 1
+        return False
+
+    def _decide(self, status, now):
+        last = self._last_status
+        if last is None:
+            return True
+        if status.get('status') != last.get('status'):
+            return True
+
+        elapsed = now - self._last_time
+        if self._min_interval is not None and elapsed < self._min_interval:
+            return False
+        if self._max_silence is not None and elapsed >= self._max_silence:
+            return True
+
+        if status.get('status') != 'ok':
+            return status.get('message') != last.get('message')
+        return self._changed(status.get(self._value_key),
+                             last.get(self._value_key))
+
+    def _changed(self, value, last_value):
+        if value is None or last_value is None:
+            return value != last_value
+        deadband = max(self._abs_deadband,
+                       self._rel_deadband * abs(last_value))
+        return abs(value - last_value) > deadband
@@ -4,11 +4,12 @@
 from concurrent import futures
 import asyncio
 from logzero import logger
+from bus.bus import RpcError
 from services.tank_water_service import TankWaterClient
 
 
 class RefillService(object):
-    def __init__(self, pwm, scan_interval_ms, bus):
+    def __init__(self, pwm, scan_interval_ms, bus, status_cache_ms=None):
         super(RefillService, self).__init__()
         self._pwm = pwm
         self._pwm_task = None
@@ -17,26 +18,34 @@ class RefillService(object):
         self._interval_ms = scan_interval_ms
         self._stop = False
         self._stop_event = asyncio.Event()
-        self._tank_water_client = TankWaterClient(bus)
+        self._tank_water_client = TankWaterClient(bus, status_cache_ms)
 
     async def start(self):
         await self._bus.reg_rep('tank.refill', self.command_callback)
+        await self._tank_water_client.subscribe()
         self._stop = False
         while not self._stop:
             if self._pause is False:
-                water_level = await self._tank_water_client.get_water_level()
-                if water_level is None:
-                    logger.error("Cannot get water level, stop refill")
+                try:
+                    await self._refill()
+                except Exception as e:  # pylint: disable=broad-except
+                    logger.error("Refill loop got error, stop refill: %s", e)
                     await self._stop_pwm()
-                elif water_level is True:
-                    await self._stop_pwm()
-                else:
-                    await self._start_pwm()
             await asyncio.sleep(float(self._interval_ms) / 1000)
 
         await self._stop_pwm()
         self._stop_event.set()
 
+    async def _refill(self):
+        water_level = await self._tank_water_client.get_water_level()
+        if water_level is None:
+            logger.error("Cannot get water level, stop refill")
+            await self._stop_pwm()
+        elif water_level is True:
+            await self._stop_pwm()
+        else:
+            await self._start_pwm()
+
     async def stop(self):
         self._stop = True
         await self._stop_event.wait()
@@ -95,9 +104,12 @@ class RefillClient(object):
                             response['message'])
                 return False
             return True
-        except futures.TimeoutError:
+        except (futures.TimeoutError, asyncio.TimeoutError):
             logger.warn("Request stop 'tank.refill' timeout")
             return False
+        except (RpcError, ConnectionError) as e:
+            logger.warn("Cannot stop 'tank.refill': %s", e)
+            return False
 
     async def start(self):
         try:
@@ -106,6 +118,9 @@ class RefillClient(object):
                 logger.warn("Cannot start 'tank.refill': %s", response['message'])
                 return False
             return True
-        except futures.TimeoutError:
+        except (futures.TimeoutError, asyncio.TimeoutError):
             logger.warn("Request start 'tank.refill' timeout")
             return False
+        except (RpcError, ConnectionError) as e:
+            logger.warn("Cannot start 'tank.refill': %s", e)
+            return False
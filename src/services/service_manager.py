@@ -8,6 +8,7 @@ from services.tank_temp_service import TankTempService
 from services.tank_water_service import TankWaterService
 from services.refill_service import RefillService
 from services.heater import Heater
+from services.publish_policy import PublishPolicy
 from services.barista.barista import Barista, WasteWaterPosition
 
 
@@ -17,6 +18,7 @@ class ServiceManager(object):
 
     def __init__(self):
         self._services = {}
+        self._buses = {}
 
     def import_config(self, configs, hwmanager, busmanager):
         """
@@ -44,13 +46,13 @@ class ServiceManager(object):
             # Use the busmanager to create a bus client for this service
             bus_path = config[service_name]['path']
             bus = busmanager.create_bus_client(bus_path)
-            bus.start()
 
             service = SERVICE_MAPPING[service_name](config[service_name],
                                                     hwmanager, bus)
             if service is not None:
                 logger.info("Create service instance '%s'", service_name)
                 self._services[service_name] = service
+                self._buses[service_name] = bus
             else:
                 logger.error("Cannot create service instance '%s'",
                              service_name)
@@ -63,12 +65,19 @@ class ServiceManager(object):
 
     def start_all_services(self):
         loop = asyncio.get_event_loop()
-        for _, service in self._services.items():
-            loop.create_task(service.start())
+        for service_name, service in self._services.items():
+            loop.create_task(
+                self._start_service(self._buses[service_name], service))
 
     async def stop_all_services(self):
-        for _, service in self._services.items():
+        for service_name, service in self._services.items():
             await service.stop()
+            await self._buses[service_name].close()
+
+    @staticmethod
+    async def _start_service(bus, service):
+        await bus.start()
+        await service.start()
 
 
 def create_output_temp_service(service_config, hwmanager, bus):
@@ -82,7 +91,15 @@ def create_output_temp_service(service_config, hwmanager, bus):
     if hardware is None:
         logger.error("Cannot get dev '%s' for output temp service", dev)
         return None
-    return OutputTempService(hardware, scan_interval_ms, bus)
+    publish_policy = PublishPolicy.from_config(
+        'temperature', service_config.get('publish'))
+    try:
+        return OutputTempService(hardware, scan_interval_ms, bus,
+                                 publish_policy,
+                                 service_config.get('sampling'))
+    except ValueError as e:
+        logger.error("Cannot create output temp service: %s", e)
+        return None
 
 
 def create_tank_temp_service(service_config, hwmanager, bus):
@@ -96,7 +113,9 @@ def create_tank_temp_service(service_config, hwmanager, bus):
     if hardware is None:
         logger.error("Cannot get dev '%s' in tank temp service", dev)
         return None
-    return TankTempService(hardware, scan_interval_ms, bus)
+    publish_policy = PublishPolicy.from_config(
+        'temperature', service_config.get('publish'))
+    return TankTempService(hardware, scan_interval_ms, bus, publish_policy)
 
 
 def create_tank_water_service(service_config, hwmanager, bus):
@@ -110,7 +129,9 @@ def create_tank_water_service(service_config, hwmanager, bus):
     if hardware is None:
         logger.error("Cannot get dev '%s' in tank water service", dev)
         return None
-    return TankWaterService(hardware, scan_interval_ms, bus)
+    publish_policy = PublishPolicy.from_config(
+        'water', service_config.get('publish'))
+    return TankWaterService(hardware, scan_interval_ms, bus, publish_policy)
 
 
 def create_refill_service(service_config, hwmanager, bus):
@@ -120,11 +141,12 @@ def create_refill_service(service_config, hwmanager, bus):
     """
     dev = service_config['dev']
     scan_interval_ms = service_config['scan_interval_ms']
+    status_cache_ms = service_config.get('status_cache_ms')
     hardware = hwmanager.find_hardware(dev)
     if hardware is None:
         logger.error("Cannot get dev '%s' in refill service", dev)
         return None
-    return RefillService(hardware, scan_interval_ms, bus)
+    return RefillService(hardware, scan_interval_ms, bus, status_cache_ms)
 
 
 def create_heater_service(service_config, hwmanager, bus):
@@ -133,6 +155,7 @@ def create_heater_service(service_config, hwmanager, bus):
         service_config(dict): heater service configuration
     """
     scan_interval_ms = service_config['scan_interval_ms']
+    status_cache_ms = service_config.get('status_cache_ms')
     pwm = service_config['pwm_dev']
     pid = service_config['pid_dev']
     pwm_dev = hwmanager.find_hardware(pwm)
@@ -143,7 +166,7 @@ def create_heater_service(service_config, hwmanager, bus):
     if pid_dev is None:
         logger.error("Cannot get dev '%s' in heater service", pid)
         return None
-    return Heater(pwm_dev, pid_dev, scan_interval_ms, bus)
+    return Heater(pwm_dev, pid_dev, scan_interval_ms, bus, status_cache_ms)
 
 
 def create_barista_service(service_config, hwmanager, bus):
@@ -168,9 +191,10 @@ def create_barista_service(service_config, hwmanager, bus):
         return None
     pos = service_config['waste_water_position']
     speed = service_config['default_moving_speed']
+    status_cache_ms = service_config.get('status_cache_ms')
     return Barista(moving_dev, extruder_dev, pid_dev,
                    WasteWaterPosition(x=pos['x'], y=pos['y'], z=pos['z']),
-                   speed, bus)
+                   speed, bus, status_cache_ms, service_config.get('stream'))
 
 
 SERVICE_MAPPING = {
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+
+
+class StatusCache(object):
+    """ Keep the latest status a service publishes on the bus
+
+    The sensor services publish their status periodically, so a client
+    can subscribe once and read the status locally instead of sending a
+    request in every control loop.
+    """
+
+    def __init__(self, max_age_ms):
+        """
+        Args:
+            max_age_ms (int): the cached status older than this is stale
+        """
+        self._max_age = float(max_age_ms) / 1000
+        self._status = None
+        self._timestamp = None
+
+    async def update(self, status):
+        """ reg_sub callback
+        """
+        self._status = status
+        self._timestamp = time.monotonic()
+
+    def get(self):
+        """
+        Returns:
+            dict: the cached status, None if there is no status or it is stale
+        """
+        if self._timestamp is None:
+            return None
+        if time.monotonic() - self._timestamp > self._max_age:
+            return None
+        return self._status
+
+    def invalidate(self):
+        self._status = None
+        self._timestamp = None
@@ -4,20 +4,26 @@
 from concurrent import futures
 import asyncio
 from logzero import logger
+from bus.bus import RpcError
+from services.cadence import Cadence
 from hardware.error import HardwareError
+from services.status_cache import StatusCache
 
 
 class TankTempService(object):
-    def __init__(self, sensor, scan_interval_ms, bus):
+    def __init__(self, sensor, scan_interval_ms, bus, publish_policy=None):
         """
         Args:
             sensor: temperature sensor, can be max31856 and max31865
             scan_interval_ms (int): scan interval in milisecond
+            publish_policy (PublishPolicy): skip the pubs it rejects, None to
+                publish every scan
         """
         self._sensor = sensor
         self._interval = scan_interval_ms
         self._error_count = 0
         self._bus = bus
+        self._publish_policy = publish_policy
 
         self._tempc = None
         self._tempc_available = False
@@ -26,30 +32,40 @@ class TankTempService(object):
         self._stop_event = asyncio.Event()
 
     async def pub_tank_temperature(self):
-        if not self._sensor.is_connected() and not self._sensor.connect():
+        if (not self._sensor.is_connected() and
+                not await self._sensor.connect_async()):
             self._message = 'Cannot connect to sensor'
-            await self._bus.pub('tank.temperature', self._get_status())
+            await self._publish()
             return
 
         try:
-            tempc = self._sensor.read_measure_temp_c()
+            tempc = await self._sensor.read_measure_temp_c_async()
             self._tempc = tempc
             self._tempc_available = True
-            await self._bus.pub('tank.temperature', self._get_status())
+            await self._publish()
         except HardwareError as error:
             self._tempc_available = False
             self._error_count += 1
-            self._sensor.disconnect()
+            await self._sensor.disconnect_async()
             self._message = "output sensor '%s' got error: '%s'" % (
                 error.name, error.message)
-            await self._bus.pub('tank.temperature', self._get_status())
+            await self._publish()
+
+    async def _publish(self):
+        status = self._get_status()
+        if (self._publish_policy is None or
+                self._publish_policy.should_publish(status)):
+            await self._bus.pub('tank.temperature', status)
 
     async def start(self):
-        await self._bus.reg_rep('tank.temperature', self.command_callback)
+        await self._bus.reg_rep('tank.temperature', self.command_callback,
+                                idempotent=True)
         self._stop = False
+        # Tick with the other sensors to share their SPI slot
+        cadence = Cadence(self._interval, align=True)
         while not self._stop:
             await self.pub_tank_temperature()
-            await asyncio.sleep(float(self._interval) / 1000)
+            await cadence.wait()
         self._stop_event.set()
 
     async def stop(self):
@@ -67,17 +83,49 @@ class TankTempService(object):
 
 
 class TankTempClient(object):
-    def __init__(self, bus):
+    def __init__(self, bus, cache_max_age_ms=None):
+        """
+        Args:
+            bus: bus client
+            cache_max_age_ms (int): serve get_temperature from the published
+                status younger than this, None to always send a request
+        """
         self._bus = bus
+        self._cache = None
+        if cache_max_age_ms is not None:
+            self._cache = StatusCache(cache_max_age_ms)
+        self._subscribed = False
+
+    async def subscribe(self):
+        """ Subscribe 'tank.temperature' status to fill the cache
+        """
+        if self._cache is None or self._subscribed:
+            return
+        self._subscribed = await self._bus.reg_sub('tank.temperature',
+                                                   self._cache.update)
 
     async def get_temperature(self):
         try:
-            response = await self._bus.req('tank.temperature',
-                                           {'command': 'get'})
+            response = None
+            if self._cache is not None:
+                response = self._cache.get()
+            if response is None:
+                response = await self._bus.req('tank.temperature',
+                                               {'command': 'get'})
             if response['status'] != 'ok':
                 logger.error("Cannot get tank temperature")
                 return None
             return response['temperature']
-        except futures.TimeoutError:
+        except (futures.TimeoutError, asyncio.TimeoutError):
             logger.error("Request get 'tank.temperature' timeout")
             return None
+        except RpcError as e:
+            if e.busy:
+                # Shed the load, the next scan asks again
+                logger.info("'tank.temperature' is busy, skip")
+            else:
+                logger.error("Cannot get tank temperature: %s", e)
+            return None
+        except ConnectionError as e:
+            logger.error("Cannot get tank temperature: %s", e)
+            return None
@@ -4,18 +4,25 @@
 from concurrent import futures
 import asyncio
 from logzero import logger
+from bus.bus import RpcError
+from services.cadence import Cadence
+from services.status_cache import StatusCache
 
 
 class TankWaterService(object):
-    def __init__(self, sensor, scan_interval_ms, bus):
+    def __init__(self, sensor, scan_interval_ms, bus, publish_policy=None):
         """
         Args:
             sensor (water detector):
             scan_interval_ms (int): scan interval in milisecond
+            publish_policy (PublishPolicy): decides the pubs of every scan,
+                e.g. with a max_silence_ms heartbeat for the status caches of
+                the clients. None to publish the changes only
         """
         self._sensor = sensor
         self._interval = scan_interval_ms
         self._bus = bus
+        self._publish_policy = publish_policy
 
         self._available = False
         self._message = 'Not ready'
@@ -24,11 +31,13 @@ class TankWaterService(object):
         self._stop_event = asyncio.Event()
 
     async def start(self):
-        await self._bus.reg_rep('tank.water', self.rep_water_command)
+        await self._bus.reg_rep('tank.water', self.rep_water_command,
+                                idempotent=True)
         self._stop = False
+        cadence = Cadence(self._interval)
         while not self._stop:
             await self.pub_water_status()
-            await asyncio.sleep(float(self._interval) / 1000)
+            await cadence.wait()
         self._stop_event.set()
 
     async def stop(self):
@@ -44,9 +53,14 @@ class TankWaterService(object):
 
         is_water_full = self._sensor.is_water_full()
         self._available = True
-        if self._is_water_full != is_water_full:
-            self._is_water_full = is_water_full
-            await self._bus.pub('tank.water', self._get_status())
+        changed = self._is_water_full != is_water_full
+        self._is_water_full = is_water_full
+        status = self._get_status()
+        if self._publish_policy is None:
+            if changed:
+                await self._bus.pub('tank.water', status)
+        elif self._publish_policy.should_publish(status):
+            await self._bus.pub('tank.water', status)
 
     async def rep_water_command(self, data):
         cmd = data['command']
@@ -61,17 +75,50 @@ class TankWaterService(object):
 
 
 class TankWaterClient(object):
-    def __init__(self, bus):
+    def __init__(self, bus, cache_max_age_ms=None):
+        """
+        Args:
+            bus: bus client
+            cache_max_age_ms (int): serve get_water_level from the published
+                status younger than this, None to always send a request
+        """
         self._bus = bus
+        self._cache = None
+        if cache_max_age_ms is not None:
+            self._cache = StatusCache(cache_max_age_ms)
+        self._subscribed = False
+
+    async def subscribe(self):
+        """ Subscribe 'tank.water' status to fill the cache
+        """
+        if self._cache is None or self._subscribed:
+            return
+        self._subscribed = await self._bus.reg_sub('tank.water',
+                                                   self._cache.update)
 
     async def get_water_level(self):
         try:
-            response = await self._bus.req('tank.water', {'command': 'get'})
+            response = None
+            if self._cache is not None:
+                response = self._cache.get()
+            if response is None:
+                response = await self._bus.req('tank.water',
+                                               {'command': 'get'})
             if response['status'] != 'ok':
                 logger.warn("Cannot get 'tank.water' status: %s",
                             response['message'])
                 return None
             return response['water']
-        except futures.TimeoutError:
+        except (futures.TimeoutError, asyncio.TimeoutError):
             logger.warn("Cannot get 'tank.water' status: request timeout")
             return None
+        except RpcError as e:
+            if e.busy:
+                # Shed the load, the next scan asks again
+                logger.info("'tank.water' is busy, skip")
+            else:
+                logger.warn("Cannot get 'tank.water' status: %s", e)
+            return None
+        except ConnectionError as e:
+            logger.warn("Cannot get 'tank.water' status: %s", e)
+            return None
@@ -14,7 +14,7 @@ class MockBus(object):
     async def req(self, path, data, timeout=1):
         return await self.req_cb(path, data, timeout)
 
-    async def reg_rep(self, path, callback):
+    async def reg_rep(self, path, callback, idempotent=False):
         await self.reg_rep_cb(path, callback)
 
     async def pub(self, path, payload):
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+
+class MockNatsMsg(object):
+    def __init__(self, subject, reply, data):
+        self.subject = subject
+        self.reply = reply
+        self.data = data
+
+
+class MockNatsClient(object):
+    """ In-memory stand-in of nats.aio.client.Client
+    """
+
+    def __init__(self):
+        self.is_connected = False
+        self.connect_count = 0
+        self.published = []
+        self._subs = {}
+        self._next_sid = 1
+
+    async def connect(self, servers=None, **_):
+        self.connect_count += 1
+        self.is_connected = True
+
+    async def close(self):
+        self.is_connected = False
+
+    async def subscribe(self, subject, cb=None, **_):
+        sid = self._next_sid
+        self._next_sid += 1
+        self._subs[sid] = (subject, cb)
+        return sid
+
+    async def unsubscribe(self, sid, **_):
+        self._subs.pop(sid, None)
+
+    @property
+    def subscriptions(self):
+        return [subject for subject, _ in self._subs.values()]
+
+    async def timed_request(self, subject, payload, timeout=1):
+        inbox = '_INBOX.%d' % self._next_sid
+        future = asyncio.get_event_loop().create_future()
+
+        async def _on_reply(msg):
+            if not future.done():
+                future.set_result(msg)
+
+        sid = await self.subscribe(inbox, cb=_on_reply)
+        try:
+            await self.publish_request(subject, inbox, payload)
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            await self.unsubscribe(sid)
+
+    async def publish(self, subject, payload):
+        await self.publish_request(subject, '', payload)
+
+    async def publish_request(self, subject, reply, payload):
+        self.published.append((subject, payload))
+        msg = MockNatsMsg(subject, reply, payload)
+        for sub, cb in list(self._subs.values()):
+            if _match(sub, subject):
+                await cb(msg)
+
+
+def _match(pattern, subject):
+    pattern_tokens = pattern.split('.')
+    subject_tokens = subject.split('.')
+    for i, token in enumerate(pattern_tokens):
+        if token == '>':
+            return len(subject_tokens) > i
+        if i >= len(subject_tokens):
+            return False
+        if token != '*' and token != subject_tokens[i]:
+            return False
+    return len(pattern_tokens) == len(subject_tokens)
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+
+from hardware.spi import SPI
+
+
+class MockSPI(SPI):
+    """ A chip of 16 registers behind a SPI interface
+
+    A transfer with the write bit in the address writes the registers from
+    that address, otherwise it reads readsize registers from it.
+    """
+
+    def __init__(self, registers=None):
+        self.registers = [0] * 16
+        for addr, value in (registers or {}).items():
+            self.registers[addr] = value
+        self.transactions = []
+        self.is_open = False
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+    def transfer(self, writedata, readsize):
+        self.transactions.append((list(writedata), readsize))
+        addr = writedata[0] & 0x7f
+        if writedata[0] & 0x80:
+            data = writedata[1:]
+            self.registers[addr:addr + len(data)] = data
+            return []
+        return self.registers[addr:addr + readsize]
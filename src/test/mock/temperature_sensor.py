@@ -19,3 +19,12 @@ class MockTemperatureSensor(object):
 
     def read_measure_temp_c(self):
         return self.temp
+
+    async def connect_async(self):
+        return self.connect()
+
+    async def disconnect_async(self):
+        return self.disconnect()
+
+    async def read_measure_temp_c_async(self):
+        return self.read_measure_temp_c()
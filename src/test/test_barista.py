@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
 
 import asyncio
+from concurrent import futures
+from bus.bus import RpcError
 from services.barista import barista
+from services.barista import brew_stream
 from test.mock.bus import MockBus
 from test.mock.pid import MockPID
 import pytest
@@ -103,3 +106,131 @@ async def test_barista_brew():
     await b.brew([{'type': 'command', 'name': 'calibration'}])
     assert moving.sent_commands[0] == 'G28'
     assert moving.sent_commands[1] == 'G1 X70.00000 Y50.00000 Z180.00000 F5000.00000'
+
+
+def test_brew_stream_chunks():
+    stream = brew_stream.BrewStream(1, max_pending=1)
+    points = [{'type': 'command', 'name': 'home'}]
+    chunk = brew_stream.encode_chunk(points, 'zlib')
+    assert brew_stream.decode_chunk(chunk) == points
+
+    assert stream.add(1, chunk)['expected'] == 0
+    assert stream.add(0, chunk) == {'status': 'ok', 'ack': 0}
+    # A retransmitted chunk is acked again but not queued
+    assert stream.add(0, chunk) == {'status': 'ok', 'ack': 0}
+    assert stream.add(1, chunk)['message'] == 'busy'
+    assert stream.end(2)['expected'] == 1
+    assert stream.end(1)['status'] == 'ok'
+    assert stream.add(1, chunk)['status'] == 'error'
+
+
+@pytest.mark.asyncio
+async def test_brew_stream_end_on_full_queue():
+    stream = brew_stream.BrewStream(1, max_pending=2)
+    assert stream.add(0, {'points': {'n': 0}})['status'] == 'ok'
+    assert stream.add(1, {'points': {'n': 1}})['status'] == 'ok'
+    # Every chunk queued before the end still runs
+    assert stream.end(2) == {'status': 'ok', 'ack': 2}
+    assert await stream.next_chunk() == {'n': 0}
+    assert await stream.next_chunk() == {'n': 1}
+    assert await stream.next_chunk() is None
+
+    stream = brew_stream.BrewStream(2, max_pending=2)
+    stream.add(0, {'points': {'n': 0}})
+    stream.add(1, {'points': {'n': 1}})
+    assert stream.abort() == {'status': 'ok'}
+    assert await stream.next_chunk() is None
+
+
+@pytest.mark.asyncio
+async def test_barista_brew_stream():
+    requests = []
+
+    async def _req_cb(path, data, timeout):
+        if path == 'barista':
+            requests.append(data['command'])
+            return await b.command_callback(data)
+        if path == 'tank.refill':
+            return {'status': 'ok'}
+        if path == 'tank.temperature':
+            return {'status': 'ok', 'temperature': 90}
+
+    async def _reg_rep_cb(path, callback):
+        assert path == 'barista'
+
+    bus = MockBus()
+    bus.req_cb = _req_cb
+    bus.reg_rep_cb = _reg_rep_cb
+
+    moving = MovingDev()
+    pos = barista.WasteWaterPosition(x=0, y=0, z=0)
+    b = barista.Barista(moving, ExtruderDev(), MockPID(), pos, 5000, bus)
+    task = asyncio.get_event_loop().create_task(b.start())
+
+    response = await b.command_callback({'command': 'brew_begin'})
+    session = response['session']
+    assert (await b.command_callback({'command': 'brew_begin'}))['status'] \
+        == 'error'
+    chunk = {'command': 'brew_chunk', 'session': session, 'seq': 0}
+    chunk.update(brew_stream.encode_chunk(
+        [{'type': 'command', 'name': 'home'}], 'zlib'))
+    assert (await b.command_callback(chunk))['ack'] == 0
+    await asyncio.sleep(0.01)
+    # The first chunk is executed before the upload ends
+    assert moving.sent_commands[-1] == 'G28'
+    response = await b.command_callback({'command': 'brew_end',
+                                         'session': session, 'count': 1})
+    assert response['status'] == 'ok'
+
+    client = barista.BaristaClient(bus)
+    params = [{'type': 'command', 'name': 'home'}] * 5
+    assert await client.brew(params, chunk_size=2, busy_interval=0.01)
+    await asyncio.sleep(0.01)
+    assert requests == ['brew_begin'] + ['brew_chunk'] * 3 + ['brew_end']
+    assert moving.sent_commands.count('G28') == 7
+
+    task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_barista_client_gives_up_on_busy():
+    requests = []
+
+    async def _req_cb(path, data, timeout):
+        requests.append(data['command'])
+        if data['command'] == 'brew_begin':
+            return {'status': 'ok', 'session': 1}
+        if data['command'] == 'brew_chunk':
+            return {'status': 'error', 'message': 'busy'}
+        return {'status': 'ok'}
+
+    bus = MockBus()
+    bus.req_cb = _req_cb
+    client = barista.BaristaClient(bus)
+    params = [{'type': 'command', 'name': 'home'}]
+    with pytest.raises(futures.TimeoutError):
+        await client.brew(params, busy_interval=0.01, busy_timeout=0.05)
+    assert 2 <= requests.count('brew_chunk') <= 6
+    assert requests[-1] == 'brew_abort'
+
+
+@pytest.mark.asyncio
+async def test_barista_client_waits_for_busy_dispatcher():
+    requests = []
+
+    async def _req_cb(path, data, timeout):
+        requests.append(data['command'])
+        if data['command'] == 'brew_begin':
+            return {'status': 'ok', 'session': 1}
+        if data['command'] == 'brew_chunk' and requests.count('brew_chunk') < 3:
+            raise RpcError('barista', 'barista', "'barista' is busy",
+                           busy=True)
+        return {'status': 'ok', 'ack': data.get('seq')}
+
+    bus = MockBus()
+    bus.req_cb = _req_cb
+    client = barista.BaristaClient(bus)
+    params = [{'type': 'command', 'name': 'home'}]
+    assert await client.brew(params, busy_interval=0.01) is True
+    assert requests == ['brew_begin', 'brew_chunk', 'brew_chunk',
+                        'brew_chunk', 'brew_end']
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import pytest
+from benchmark.broker import LocalBroker, subject_match
+
+
+def test_subject_match():
+    assert subject_match('tank.temperature.pub', 'tank.temperature.pub')
+    assert subject_match('tank.*.pub', 'tank.temperature.pub')
+    assert subject_match('_INBOX.>', '_INBOX.abc.1')
+    assert not subject_match('_INBOX.>', '_INBOX')
+    assert not subject_match('tank.*', 'tank.temperature.pub')
+
+
+async def _connect(broker):
+    reader, writer = await asyncio.open_connection(broker.host, broker.port)
+    info = await reader.readline()
+    assert info.startswith(b'INFO ')
+    writer.write(b'CONNECT {"verbose":false}\r\nPING\r\n')
+    assert await reader.readline() == b'PONG\r\n'
+    return reader, writer
+
+
+@pytest.mark.asyncio
+async def test_broker_routes_messages():
+    broker = LocalBroker()
+    await broker.start()
+    try:
+        sub_reader, sub_writer = await _connect(broker)
+        pub_reader, pub_writer = await _connect(broker)
+
+        sub_writer.write(b'SUB tank.* 1\r\nUNSUB 1 2\r\nPING\r\n')
+        assert await sub_reader.readline() == b'PONG\r\n'
+
+        pub_writer.write(b'PUB tank.temp _INBOX.a 2\r\nhi\r\n')
+        pub_writer.write(b'PUB tank.temp 3\r\nbye\r\n')
+        pub_writer.write(b'PUB tank.temp 4\r\nlost\r\n')
+        await pub_writer.drain()
+
+        assert await sub_reader.readline() == b'MSG tank.temp 1 _INBOX.a 2\r\n'
+        assert await sub_reader.readline() == b'hi\r\n'
+        assert await sub_reader.readline() == b'MSG tank.temp 1 3\r\n'
+        assert await sub_reader.readline() == b'bye\r\n'
+
+        # The subscription is removed after two messages
+        sub_writer.write(b'PING\r\n')
+        assert await sub_reader.readline() == b'PONG\r\n'
+
+        sub_writer.close()
+        pub_writer.close()
+    finally:
+        await broker.stop()
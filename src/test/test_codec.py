@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import enum
+import pytest
+from bus import codec as bus_codec
+
+PAYLOAD = {
+    'id': 1,
+    'status': 'ok',
+    'temperature': 92.5078125,
+    'ratio': 0.1,
+    'error_count': 70000,
+    'big': 2**70,
+    'negative': -2**40,
+    'water': True,
+    'stop': False,
+    'message': None,
+    'unicode': u'溫度' * 200,
+    'raw': b'\x00\x01',
+    'points': [[1, 2.5, None]] * 300,
+}
+
+
+def test_binary_codec_round_trip():
+    codec = bus_codec.get_codec('binary')
+    data = codec.encode(PAYLOAD)
+    assert data[:2] == bus_codec.BINARY_HEADER
+    assert bus_codec.content_type_of(data) == codec.content_type
+    result = codec.decode(data)
+    assert result == dict(PAYLOAD, points=[[1, 2.5, None]] * 300)
+
+
+def test_binary_codec_round_trip_long_int():
+    codec = bus_codec.get_codec('binary')
+    for value in (10 ** 300, -10 ** 300):
+        assert codec.decode(codec.encode({'big': value})) == {'big': value}
+
+
+class _Level(enum.IntEnum):
+    LOW = 1
+    HIGH = 2
+
+
+def test_binary_codec_accepts_subclasses():
+    payload = collections.OrderedDict([('level', _Level.HIGH),
+                                       ('full', True), ('count', 3)])
+    # The same inputs as the JSON codec, decoded to the plain types
+    expected = bus_codec.get_codec('json').decode(
+        bus_codec.get_codec('json').encode(payload))
+    codec = bus_codec.get_codec('binary')
+    result = codec.decode(codec.encode(payload))
+    assert result == expected == {'level': 2, 'full': True, 'count': 3}
+    assert type(result['level']) is int
+    assert result['full'] is True
+
+
+def test_binary_codec_is_compact_for_telemetry():
+    telemetry = {'status': 'ok', 'temperature': 92.5078125, 'error_count': 0}
+    binary = bus_codec.get_codec('binary').encode(telemetry)
+    json = bus_codec.get_codec('json').encode(telemetry)
+    assert len(binary) < len(json)
+
+
+def test_decode_mixed_content_types():
+    telemetry = {'status': 'ok', 'temperature': 50.25}
+    for name in ['json', 'binary']:
+        data = bus_codec.get_codec(name).encode(telemetry)
+        assert bus_codec.decode(data) == telemetry
+
+    assert bus_codec.decode(b'{"status": "ok"}') == {'status': 'ok'}
+
+
+def test_binary_codec_rejects_invalid_payload():
+    codec = bus_codec.get_codec('binary')
+    with pytest.raises(ValueError):
+        codec.decode(b'{}')
+    with pytest.raises(ValueError):
+        codec.decode(bus_codec.BINARY_HEADER + b'\xff')
+    with pytest.raises(TypeError):
+        codec.encode({1: 'a'})
+    with pytest.raises(ValueError):
+        bus_codec.get_codec('xml')
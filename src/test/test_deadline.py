@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import time
+import pytest
+from nats.aio.errors import ErrTimeout
+from bus import deadline as bus_deadline
+from bus.bus_manager import BusManager
+from test.mock.nats import MockNatsClient, MockNatsMsg
+
+
+def test_nested_deadline_is_the_shorter():
+    assert bus_deadline.current() is None
+    deadline, timeout = bus_deadline.derive(1)
+    assert timeout == pytest.approx(1, abs=0.01)
+
+    with bus_deadline.scope(time.time() + 0.2):
+        assert bus_deadline.remaining() == pytest.approx(0.2, abs=0.01)
+        deadline, timeout = bus_deadline.derive(1)
+        assert deadline == bus_deadline.current()
+        assert timeout == pytest.approx(0.2, abs=0.01)
+
+    with bus_deadline.scope(time.time() - 0.1):
+        with pytest.raises(asyncio.TimeoutError):
+            bus_deadline.derive(1)
+    assert bus_deadline.remaining(10) == 10
+
+
+@pytest.mark.asyncio
+async def test_nats_bus_drop_expired_requests():
+    manager = BusManager()
+    manager.import_config({'host': 'localhost', 'port': 4222, 'type': 'nats'})
+    server = manager.create_bus_client('tank')
+    client = manager.create_bus_client('dashboard')
+    nats_client = MockNatsClient()
+    server._connection._nats_client = nats_client
+
+    calls = []
+
+    async def slow(parameters):
+        calls.append(parameters)
+        await asyncio.sleep(0.1)
+
+    async def budget(_):
+        return bus_deadline.remaining()
+
+    await server.start()
+    await client.start()
+    await server.reg_rpc_api('slow', slow, workers=1)
+    await server.reg_rpc_api('budget', budget)
+
+    # The handler sees the budget the caller waits for
+    remaining = await client.call('tank', 'budget', None, timeout=0.5)
+    assert 0 < remaining <= 0.5
+
+    # The second call expires while waiting for the worker
+    results = await asyncio.gather(
+        client.call('tank', 'slow', 1, timeout=0.05),
+        client.call('tank', 'slow', 2, timeout=0.05),
+        return_exceptions=True)
+    assert all(isinstance(result, ErrTimeout) for result in results)
+    await asyncio.sleep(0.1)
+    assert calls == [1]
+    assert server.rpc_stats()['slow']['expired'] == 1
+
+    # An expired request is not even queued
+    data = server._encode('tank', 'slow', dict(
+        id=1, method='slow', parameters=3, deadline=time.time() - 1))
+    published = len(nats_client.published)
+    await server.on_request(MockNatsMsg('tank', 'reply', data))
+    assert server.expired_requests == 1
+    assert len(nats_client.published) == published
+    assert calls == [1]
+
+    await server.close()
+    await client.close()
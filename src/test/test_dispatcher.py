@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import pytest
+from bus import codec as bus_codec
+from bus.dispatcher import RpcDispatcher, BusyError
+from bus.nats_bus import NatsBus
+from nats.aio.errors import ErrConnectionClosed
+from test.mock.nats import MockNatsClient
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_slow_method_not_block_others():
+    release = asyncio.Event()
+
+    async def brew(_):
+        await release.wait()
+        return 'brewed'
+
+    async def stop(_):
+        return 'stopped'
+
+    dispatcher = RpcDispatcher()
+    dispatcher.register('brew', brew)
+    dispatcher.register('stop', stop)
+
+    brew_future = dispatcher.submit('brew', None)
+    assert await asyncio.wait_for(dispatcher.submit('stop', None), 1) == 'stopped'
+    assert brew_future.done() is False
+
+    release.set()
+    assert await brew_future == 'brewed'
+    await dispatcher.close()
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_busy_and_stats():
+    release = asyncio.Event()
+
+    async def brew(_):
+        await release.wait()
+
+    dispatcher = RpcDispatcher({'methods': {'brew': {'max_pending': 1}}})
+    dispatcher.register('brew', brew)
+
+    running = dispatcher.submit('brew', None)
+    await asyncio.sleep(0)
+    pending = dispatcher.submit('brew', None)
+    with pytest.raises(BusyError):
+        dispatcher.submit('brew', None)
+
+    stats = dispatcher.stats()['brew']
+    assert stats['depth'] == 1
+    assert stats['rejected'] == 1
+
+    release.set()
+    await running
+    await pending
+    stats = dispatcher.stats()['brew']
+    assert stats['handled'] == 2
+    assert stats['depth'] == 0
+    await dispatcher.close()
+
+
+@pytest.mark.asyncio
+async def test_nats_bus_reply_busy_error():
+    release = asyncio.Event()
+
+    async def brew(_):
+        await release.wait()
+        return {'status': 'ok'}
+
+    client = MockNatsClient()
+    bus = NatsBus('localhost', 4222, 'barista',
+                  dispatch_config={'max_pending': 0})
+    bus._connection._nats_client = client
+    await bus.start()
+    await bus.reg_rpc_api('brew', brew)
+
+    request = bus_codec.get_codec().encode(
+        {'id': 1, 'method': 'brew', 'parameters': {}})
+    await client.publish_request('barista', 'reply.1', request)
+    await client.publish_request('barista', 'reply.2', request)
+    await client.publish_request('barista', 'reply.3', b'{"id": 3, "method": "x"}')
+
+    replies = {subject: bus_codec.decode(data)
+               for subject, data in client.published if subject != 'barista'}
+    assert 'busy' in replies['reply.2']['error']
+    assert 'not existing' in replies['reply.3']['error']
+    assert 'reply.1' not in replies
+
+    release.set()
+    await asyncio.sleep(0.01)
+    assert bus_codec.decode(client.published[-1][1])['result'] == {'status': 'ok'}
+    await bus.close()
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_close_fails_pending_calls():
+    release = asyncio.Event()
+
+    async def brew(_):
+        await release.wait()
+        return 'brewed'
+
+    dispatcher = RpcDispatcher()
+    dispatcher.register('brew', brew)
+    running = dispatcher.submit('brew', None)
+    await asyncio.sleep(0)
+    pending = dispatcher.submit('brew', None)
+
+    await dispatcher.close()
+    with pytest.raises(ErrConnectionClosed):
+        await running
+    with pytest.raises(ErrConnectionClosed):
+        await pending
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_register_replaces_method():
+    release = asyncio.Event()
+
+    async def brew(_):
+        await release.wait()
+        return 'brewed'
+
+    async def brew_again(_):
+        return 'brewed again'
+
+    dispatcher = RpcDispatcher()
+    dispatcher.register('brew', brew)
+    running = dispatcher.submit('brew', None)
+    await asyncio.sleep(0)
+    replaced = dispatcher._methods['brew']
+
+    dispatcher.register('brew', brew_again)
+    with pytest.raises(ErrConnectionClosed):
+        await asyncio.wait_for(running, 1)
+    assert replaced.started is False
+    assert await dispatcher.submit('brew', None) == 'brewed again'
+    await dispatcher.close()
@@ -8,6 +8,7 @@ from test.mock.pwm import MockPWM
 from test.mock.bus import MockBus
 from test.mock.pid import MockPID
 import pytest
+from bus.bus import RpcError
 from services.heater import Heater
 
 
@@ -78,3 +79,49 @@ async def test_heater_command():
 
     response = await heater.command_callback({'command': 'put'})
     assert response['status'] == 'error'
+
+
+@pytest.mark.asyncio
+async def test_heater_turns_off_on_request_errors():
+    errors = [RpcError('tank.temperature', 'tank.temperature', 'broken'),
+              ConnectionError('The connection has not been established'),
+              {'status': 'ok', 'temperature': 20}]
+
+    async def _req_cb(path, data, timeout):
+        assert path == 'tank.temperature'
+        if not errors:
+            return {'status': 'ok', 'temperature': 20}
+        error = errors.pop(0)
+        if isinstance(error, Exception):
+            raise error
+        return error
+
+    async def _reg_rep_cb(path, callback):
+        pass
+
+    bus = MockBus()
+    bus.req_cb = _req_cb
+    bus.reg_rep_cb = _reg_rep_cb
+
+    pwm = MockPWM()
+    pwm.dutycycle = 80
+    pid = MockPID()
+    pid.compute_result = 60
+    heater = Heater(pwm, pid, 10, bus)
+    task = asyncio.ensure_future(heater.start())
+
+    # The failed requests turn the heater off, the loop keeps running
+    await asyncio.sleep(0.015)
+    assert pwm.dutycycle == 0
+    await asyncio.sleep(0.03)
+    assert errors == []
+    assert pwm.dutycycle == 60
+
+    # So does any other error of a scan
+    pid.compute = None
+    await asyncio.sleep(0.03)
+    assert pwm.dutycycle == 0
+    assert not task.done()
+    task.cancel()
+    with suppress(asyncio.CancelledError):
+        await task
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import pytest
+from bus.bus import RpcError
+from bus.bus_manager import BusManager
+from test.mock.nats import MockNatsClient
+
+
+def _create_bus_manager(forward):
+    manager = BusManager()
+    manager.import_config({'host': 'localhost', 'port': 4222,
+                           'type': 'loopback', 'forward': forward})
+    return manager
+
+
+@pytest.mark.asyncio
+async def test_loopback_req_and_pub():
+    manager = _create_bus_manager(False)
+    server = manager.create_bus_client('tank.temperature')
+    client = manager.create_bus_client('tank.heater')
+    await server.start()
+    await client.start()
+
+    status = {'status': 'ok', 'temperature': 90}
+
+    async def get(_):
+        return status
+
+    await server.reg_rpc_api('get', get)
+    assert await client.call('tank.temperature', 'get', None) is status
+
+    received = []
+    await client.reg_sub('tank.temperature', received.append)
+    await server.pub('tank.temperature', status)
+    assert received == [status]
+
+    results = await client.req_batch('tank.temperature',
+                                     [{'method': 'get'}, {'method': 'x'}])
+    assert results['0'] is status
+    assert isinstance(results['1'], RpcError)
+
+    await server.close()
+    with pytest.raises(RpcError):
+        await client.call('tank.temperature', 'get', None)
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_loopback_forward_remote_path():
+    manager = _create_bus_manager(True)
+    local = manager.create_bus_client('tank.heater')
+    nats_client = MockNatsClient()
+    local._forward._connection._nats_client = nats_client
+    await local.start()
+
+    # A remote service only reachable through nats
+    remote = manager._create_nats_bus_client('barista')
+
+    async def get(_):
+        return {'status': 'ok'}
+
+    await remote.start()
+    await remote.reg_rpc_api('get', get)
+
+    assert await local.call('barista', 'get', None) == {'status': 'ok'}
+
+    await local.pub('tank.heater', {'duty_cycle': 0})
+    assert nats_client.published[-1][0] == 'tank.heater.pub'
+
+    await remote.close()
+    await local.close()
+
+
+@pytest.mark.asyncio
+async def test_loopback_coalesce_idempotent_handler():
+    manager = _create_bus_manager(False)
+    server = manager.create_bus_client('tank.temperature')
+    client = manager.create_bus_client('tank.heater')
+    await server.start()
+    await client.start()
+
+    calls = []
+
+    async def get(parameters):
+        calls.append(parameters)
+        await asyncio.sleep(0.01)
+        return {'status': 'ok', 'temperature': 90}
+
+    await server.reg_rpc_api('get', get, idempotent=True)
+    results = await asyncio.gather(*[
+        client.call('tank.temperature', 'get', None) for _ in range(5)])
+    assert all(result is results[0] for result in results)
+    assert calls == [None]
+
+    await client.close()
+    await server.close()
+
+
+@pytest.mark.asyncio
+async def test_loopback_services_req_rep():
+    manager = _create_bus_manager(False)
+    server = manager.create_bus_client('tank.temp')
+    client = manager.create_bus_client('barista')
+    await server.start()
+    await client.start()
+
+    async def command(data):
+        return {'status': 'ok', 'command': data['command']}
+
+    await server.reg_rep('tank.temperature', command)
+    assert await client.req('tank.temperature', {'command': 'get'}) == {
+        'status': 'ok', 'command': 'get'}
+
+    await server.close()
+    with pytest.raises(RpcError):
+        await client.req('tank.temperature', {'command': 'get'})
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_loopback_handler_runs_past_timeout():
+    manager = _create_bus_manager(False)
+    server = manager.create_bus_client('tank.refill')
+    client = manager.create_bus_client('barista')
+    await server.start()
+    await client.start()
+
+    finished = asyncio.Event()
+
+    async def slow(_):
+        await asyncio.sleep(0.05)
+        finished.set()
+        return {'status': 'ok'}
+
+    async def broken(_):
+        raise ValueError("no pwm")
+
+    await server.reg_rpc_api('slow', slow)
+    await server.reg_rpc_api('broken', broken)
+
+    with pytest.raises(asyncio.TimeoutError):
+        await client.call('tank.refill', 'slow', None, timeout=0.01)
+    # Not cancelled by the timeout of the caller
+    await asyncio.wait_for(finished.wait(), 1)
+
+    with pytest.raises(RpcError) as error:
+        await client.call('tank.refill', 'broken', None)
+    assert error.value.message == 'no pwm'
+
+    await client.close()
+    await server.close()
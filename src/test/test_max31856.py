@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import threading
+import time
+import pytest
+from hardware import max31856 as max31856_module
+from hardware.error import HardwareError
+from hardware.max31856 import MAX31856, MAX31856Config
+from test.mock.spi import MockSPI
+
+
+def _create_max31856(spi):
+    config = MAX31856Config()
+    config.tc_type = MAX31856.T_TYPE
+    config.sample_avg = MAX31856.SAMPLE_AVG_16
+    return MAX31856(spi, config)
+
+
+def test_max31856_connect_with_shadow_registers():
+    # The power on default, K type and no averaging
+    spi = MockSPI({MAX31856.ADDR_CR1: 0x03})
+    max31856 = _create_max31856(spi)
+    assert max31856.connect() is True
+    # Burst read, CR1 write, CR0 write and the burst read back
+    assert len(spi.transactions) == 4
+    assert spi.registers[MAX31856.ADDR_CR0] == 0x80
+    assert spi.registers[MAX31856.ADDR_CR1] == 0x47
+
+    del spi.transactions[:]
+    assert max31856.tc_type == MAX31856.T_TYPE
+    assert max31856.sample_avg == MAX31856.SAMPLE_AVG_16
+    assert max31856.mode == MAX31856.MODE_AUTOMATIC
+    max31856.sample_avg = MAX31856.SAMPLE_AVG_16
+    assert spi.transactions == []
+
+    # Reconnect a configured chip, nothing to write
+    max31856.disconnect()
+    assert max31856.connect() is True
+    assert len(spi.transactions) == 2
+
+
+def test_max31856_invalidate_on_fault():
+    spi = MockSPI({MAX31856.ADDR_SR: 0x01})
+    max31856 = _create_max31856(spi)
+    assert max31856.connect() is True
+    with pytest.raises(HardwareError):
+        max31856.read_measure_temp_c()
+
+    # Reset by a power glitch, the next access reads the chip
+    spi.registers[MAX31856.ADDR_CR1] = 0x03
+    assert max31856.tc_type == MAX31856.K_TYPE
+
+
+def test_max31856_connect_verify_failed():
+    class ReadOnlySPI(MockSPI):
+        def transfer(self, writedata, readsize):
+            if writedata[0] & 0x80:
+                return []
+            return super(ReadOnlySPI, self).transfer(writedata, readsize)
+
+    spi = ReadOnlySPI()
+    max31856 = _create_max31856(spi)
+    assert max31856.connect() is False
+    assert spi.is_open is False
+
+
+@pytest.mark.asyncio
+async def test_max31856_read_off_the_event_loop():
+    class SlowSPI(MockSPI):
+        def transfer(self, writedata, readsize):
+            self.threads.add(threading.get_ident())
+            time.sleep(0.01)
+            return super(SlowSPI, self).transfer(writedata, readsize)
+
+    spi = SlowSPI({MAX31856.ADDR_LTCBH: 0x19, MAX31856.ADDR_LTCBM: 0x00})
+    spi.threads = set()
+    max31856 = _create_max31856(spi)
+
+    ticks = []
+
+    async def tick():
+        while True:
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.002)
+
+    task = asyncio.ensure_future(tick())
+    assert await max31856.connect_async() is True
+    assert await max31856.read_measure_temp_c_async() == 0x1900 * 8 * \
+        MAX31856.RESOLUTION_TC
+    task.cancel()
+
+    assert spi.threads and threading.get_ident() not in spi.threads
+    # The loop kept running during the 50ms of transfers
+    assert len(ticks) >= 10
+
+
+@pytest.fixture
+def fast_conversions(monkeypatch):
+    monkeypatch.setattr(MAX31856, 'CONVERSION_MS', {
+        (MAX31856.MODE_MANUAL, MAX31856.FILTER_60HZ): (20, 1),
+        (MAX31856.MODE_AUTOMATIC, MAX31856.FILTER_60HZ): (10, 1),
+    })
+
+
+def test_max31856_conversion_time():
+    max31856 = _create_max31856(MockSPI())
+    # 16 samples with the 60Hz filter
+    assert max31856.conversion_time(MAX31856.MODE_MANUAL) == pytest.approx(
+        (143 + 15 * 33.33) * 1.1 / 1000)
+    assert max31856.conversion_time(
+        MAX31856.MODE_AUTOMATIC) == pytest.approx((83 + 15 * 33.33) * 1.1 /
+                                                  1000)
+
+
+@pytest.mark.asyncio
+async def test_max31856_one_shot_sample(fast_conversions):
+    spi = MockSPI({MAX31856.ADDR_LTCBH: 0x19})
+    max31856 = _create_max31856(spi)
+    assert max31856.connect() is True
+    del spi.transactions[:]
+
+    before = time.time()
+    sample = await max31856.sample_async(MAX31856.MODE_MANUAL)
+    assert sample.temperature == (0x190000 >> 5) * MAX31856.RESOLUTION_TC
+    assert before < sample.timestamp <= time.time()
+    # Leave the automatic mode, start a conversion and read it
+    assert spi.transactions[0] == ([0x80, 0x00], 0)
+    assert spi.transactions[1] == ([0x80, 0x40], 0)
+    assert spi.transactions[2] == ([MAX31856.ADDR_LTCBH], 4)
+
+    # The one-shot bit is not cached, the next conversion sets it again
+    del spi.transactions[:]
+    assert max31856.mode == MAX31856.MODE_MANUAL
+    await max31856.sample_async(MAX31856.MODE_MANUAL)
+    assert spi.transactions[0] == ([0x80, 0x40], 0)
+    assert len(spi.transactions) == 2
+
+
+@pytest.mark.asyncio
+async def test_max31856_automatic_samples_are_not_repeated(fast_conversions):
+    spi = MockSPI({MAX31856.ADDR_LTCBH: 0x19})
+    max31856 = _create_max31856(spi)
+    assert max31856.connect() is True
+    period = max31856.conversion_time(MAX31856.MODE_AUTOMATIC)
+
+    samples = [await max31856.sample_async() for _ in range(3)]
+    for earlier, later in zip(samples, samples[1:]):
+        assert later.timestamp - earlier.timestamp == pytest.approx(
+            period, abs=0.005)
+    # A slow reader gets the last conversion at once
+    await asyncio.sleep(3 * period)
+    start = time.monotonic()
+    await max31856.sample_async()
+    assert time.monotonic() - start < period
+
+
+@pytest.mark.asyncio
+async def test_max31856_sample_on_drdy(monkeypatch):
+    class FakeGPIO(object):
+        def __init__(self, pin, direction):
+            self.levels = [True, False]
+            self.polls = []
+            gpios.append(self)
+
+        def read(self):
+            return self.levels.pop(0)
+
+        def poll(self, timeout):
+            self.polls.append(timeout)
+            return True
+
+        def close(self):
+            pass
+
+    gpios = []
+    monkeypatch.setattr(max31856_module, 'GPIO', FakeGPIO)
+    spi = MockSPI({MAX31856.ADDR_LTCBH: 0x19})
+    config = MAX31856Config()
+    config.drdy_gpio = 24
+    max31856 = MAX31856(spi, config)
+    assert max31856.connect() is True
+
+    start = time.monotonic()
+    sample = await max31856.sample_async(MAX31856.MODE_MANUAL)
+    assert sample.temperature == (0x190000 >> 5) * MAX31856.RESOLUTION_TC
+    # DRDY went low, the conversion time is not waited
+    assert time.monotonic() - start < 0.1
+    assert gpios[0].edge == 'falling' and len(gpios[0].polls) == 1
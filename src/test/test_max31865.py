@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+
+from hardware.max31865 import MAX31865, MAX31865Config
+from test.mock.spi import MockSPI
+
+
+def test_max31865_connect_with_shadow_registers():
+    spi = MockSPI({MAX31865.ADDR_HFTH: 0xff, MAX31865.ADDR_HFTL: 0xff})
+    config = MAX31865Config()
+    config.wire = MAX31865.WIRE_3
+    max31865 = MAX31865(spi, config)
+    assert max31865.connect() is True
+    # Burst read, one CR write and the burst read back
+    assert len(spi.transactions) == 3
+    assert spi.registers[MAX31865.ADDR_CR] == 0xd0
+
+    del spi.transactions[:]
+    assert max31865.wire == MAX31865.WIRE_3
+    assert max31865.mode == MAX31865.MODE_AUTOMATIC
+    assert spi.transactions == []
+
+    max31865.disconnect()
+    assert spi.registers[MAX31865.ADDR_CR] == 0x50
+    # Only the bias is written again
+    del spi.transactions[:]
+    assert max31865.connect() is True
+    assert len(spi.transactions) == 3
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from bus.metrics import BusMetrics, LogHistogram
+from bus.nats_bus import NatsBus, NatsConnection
+from test.mock.nats import MockNatsClient
+
+
+def test_log_histogram():
+    histogram = LogHistogram(1e-6)
+    for _ in range(98):
+        histogram.record(10e-6)
+    histogram.record(1e-3)
+    histogram.record(100.0)
+
+    assert histogram.count == 100
+    assert histogram.percentile(50) == pytest.approx(16e-6)
+    assert histogram.percentile(99) == pytest.approx(1024e-6)
+    assert histogram.percentile(100) == 100.0
+    assert histogram.to_dict()['max'] == 100.0
+
+
+@pytest.mark.asyncio
+async def test_nats_bus_metrics():
+    metrics = BusMetrics()
+    connection = NatsConnection('localhost', 4222)
+    connection._nats_client = MockNatsClient()
+    server = NatsBus(None, None, 'tank', connection=connection,
+                     metrics=metrics)
+    client = NatsBus(None, None, 'dashboard', connection=connection,
+                     metrics=metrics)
+
+    async def get(_):
+        return {'status': 'ok'}
+
+    await server.start()
+    await client.start()
+    await server.reg_rpc_api('get', get)
+
+    for _ in range(3):
+        await client.call('tank', 'get', None)
+    await server.pub('tank', {'temperature': 90})
+
+    snapshot = await client.call('tank', 'metrics', None)
+    assert snapshot['tank']['get']['messages_in'] == 6
+    assert snapshot['tank']['get']['handler_time']['count'] == 3
+    assert snapshot['tank']['get']['round_trip_time']['count'] == 3
+    assert snapshot['tank.pub']['pub']['messages_out'] == 1
+
+    await server.close()
+    await client.close()
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import pytest
+from nats.aio.errors import ErrConnectionClosed, ErrTimeout
+from bus.bus import RpcError
+from bus.bus_manager import BusManager
+from bus.nats_bus import NatsConnection
+from bus.request_mux import RequestMultiplexer
+from services.tank_temp_service import TankTempClient, TankTempService
+from test.mock.nats import MockNatsClient
+from test.mock.temperature_sensor import MockTemperatureSensor
+
+
+def _create_bus_manager():
+    manager = BusManager()
+    manager.import_config({'host': 'localhost', 'port': 4222, 'type': 'nats'})
+    return manager
+
+
+@pytest.mark.asyncio
+async def test_bus_manager_share_connection():
+    manager = _create_bus_manager()
+    bus1 = manager.create_bus_client('tank.temperature')
+    bus2 = manager.create_bus_client('tank.refill')
+
+    client = MockNatsClient()
+    bus1._connection._nats_client = client
+
+    assert bus1._connection is bus2._connection
+    assert bus1._connection.ref_count == 2
+
+    await bus1.start()
+    await bus2.start()
+    assert client.connect_count == 1
+    assert sorted(client.subscriptions) == ['tank.refill', 'tank.temperature']
+
+    await bus1.close()
+    assert client.is_connected is True
+    assert client.subscriptions == ['tank.refill']
+
+    await bus2.close()
+    assert client.is_connected is False
+
+
+@pytest.mark.asyncio
+async def test_bus_manager_reconnect_after_release():
+    manager = _create_bus_manager()
+    bus1 = manager.create_bus_client('tank.temperature')
+    await bus1.close()
+
+    bus2 = manager.create_bus_client('tank.refill')
+    assert bus2._connection is not bus1._connection
+    assert bus2._connection.ref_count == 1
+
+
+@pytest.mark.asyncio
+async def test_nats_bus_req_batch():
+    manager = _create_bus_manager()
+    server = manager.create_bus_client('tank')
+    client = manager.create_bus_client('dashboard')
+    server._connection._nats_client = MockNatsClient()
+
+    async def get_temperature(parameters):
+        return {'status': 'ok', 'temperature': parameters['offset'] + 90}
+
+    async def stop(_):
+        return {'status': 'ok'}
+
+    await server.start()
+    await client.start()
+    await server.reg_rpc_api('get_temperature', get_temperature)
+    await server.reg_rpc_api('stop', stop)
+
+    for concurrent in [True, False]:
+        results = await client.req_batch('tank', [
+            {'method': 'stop'},
+            {'id': 'temp', 'method': 'get_temperature',
+             'parameters': {'offset': 2}},
+            {'method': 'unknown'},
+        ], concurrent=concurrent)
+
+        assert results['0'] == {'status': 'ok'}
+        assert results['temp'] == {'status': 'ok', 'temperature': 92}
+        assert isinstance(results['2'], RpcError)
+
+    assert await client.call('tank', 'stop', None) == {'status': 'ok'}
+    with pytest.raises(RpcError):
+        await client.call('tank', 'unknown', None)
+
+    await server.close()
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_nats_bus_req_shares_reply_inbox():
+    manager = _create_bus_manager()
+    server = manager.create_bus_client('tank')
+    client = manager.create_bus_client('dashboard')
+    nats_client = MockNatsClient()
+    server._connection._nats_client = nats_client
+
+    release = asyncio.Event()
+
+    async def get(parameters):
+        if parameters == 'slow':
+            await release.wait()
+        return parameters
+
+    await server.start()
+    await client.start()
+    await server.reg_rpc_api('get', get, workers=4)
+
+    results = await asyncio.gather(*[
+        client.call('tank', 'get', index) for index in range(10)])
+    assert results == list(range(10))
+    inboxes = [subject for subject in nats_client.subscriptions
+               if subject.startswith('_INBOX.')]
+    assert len(inboxes) == 1
+
+    # The reply after the timeout is dropped, nothing is left pending
+    mux = server._connection._request_mux
+    with pytest.raises(ErrTimeout):
+        await client.call('tank', 'get', 'slow', timeout=0.05)
+    assert mux.pending == 0
+    release.set()
+    await asyncio.sleep(0.01)
+    assert mux.late_replies == 1
+    assert mux.pending == 0
+
+    await server.close()
+    await client.close()
+    assert nats_client.subscriptions == []
+
+
+@pytest.mark.asyncio
+async def test_request_mux_close_fails_pending_requests():
+    nats_client = MockNatsClient()
+    mux = RequestMultiplexer(nats_client)
+
+    request = asyncio.ensure_future(mux.request('tank', b'{}', timeout=1))
+    await asyncio.sleep(0.01)
+    assert mux.pending == 1
+    await mux.close()
+    with pytest.raises(ErrConnectionClosed):
+        await asyncio.wait_for(request, 0.5)
+    assert mux.pending == 0
+
+
+@pytest.mark.asyncio
+async def test_nats_bus_coalesce_idempotent_requests():
+    manager = _create_bus_manager()
+    server = manager.create_bus_client('tank')
+    client = manager.create_bus_client('dashboard')
+    server._connection._nats_client = MockNatsClient()
+
+    calls = []
+    release = asyncio.Event()
+
+    async def get(parameters):
+        calls.append(parameters)
+        await release.wait()
+        return {'status': 'ok', 'temperature': 90}
+
+    await server.start()
+    await client.start()
+    await server.reg_rpc_api('get', get, workers=4, idempotent=True)
+    await server.reg_rpc_api('set', get, workers=4)
+
+    async def release_later():
+        await asyncio.sleep(0.01)
+        release.set()
+
+    # Coalesced by the handler side
+    results = await asyncio.gather(
+        client.call('tank', 'get', {'command': 'get'}),
+        client.call('tank', 'get', {'command': 'get'}),
+        client.call('tank', 'get', {'command': 'other'}),
+        release_later())
+    assert results[0] == results[1] == results[2]
+    assert calls == [{'command': 'get'}, {'command': 'other'}]
+
+    # Coalesced by the request side, only one request goes out
+    calls.clear()
+    release.clear()
+    results = await asyncio.gather(
+        client.call('tank', 'set', 1, idempotent=True),
+        client.call('tank', 'set', 1, idempotent=True),
+        client.call('tank', 'set', 1),
+        release_later())
+    assert results[0] is results[1]
+    assert calls == [1, 1]
+
+    await server.close()
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_bus_manager_services_req_rep():
+    manager = _create_bus_manager()
+    server = manager.create_bus_client('tank.temp')
+    client = manager.create_bus_client('barista')
+    nats_client = MockNatsClient()
+    server._connection._nats_client = nats_client
+    await server.start()
+    await client.start()
+
+    sensor = MockTemperatureSensor()
+    sensor.temp = 92
+    service = TankTempService(sensor, 10, server)
+    task = asyncio.ensure_future(service.start())
+    await asyncio.sleep(0.01)
+    assert 'tank.temperature.rep' in nats_client.subscriptions
+
+    assert await TankTempClient(client).get_temperature() == 92
+    assert await server.req('tank.temperature', {'command': 'get'}) == {
+        'status': 'ok', 'temperature': 92}
+
+    await service.stop()
+    await task
+    await server.close()
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_services_client_sheds_busy_requests():
+    manager = BusManager()
+    manager.import_config({'host': 'localhost', 'port': 4222, 'type': 'nats',
+                           'dispatch': {'workers': 1, 'max_pending': 0}})
+    server = manager.create_bus_client('tank.temp')
+    client = manager.create_bus_client('barista')
+    server._connection._nats_client = MockNatsClient()
+    await server.start()
+    await client.start()
+
+    release = asyncio.Event()
+
+    async def get(_):
+        await release.wait()
+        return {'status': 'ok', 'temperature': 92}
+
+    await server.reg_rep('tank.temperature', get)
+    tank_temp_client = TankTempClient(client)
+    first = asyncio.ensure_future(tank_temp_client.get_temperature())
+    await asyncio.sleep(0.01)
+
+    # The busy reply is a soft failure, the caller skips this scan
+    with pytest.raises(RpcError) as error:
+        await client.req('tank.temperature', {'command': 'get'})
+    assert error.value.busy is True
+    assert await tank_temp_client.get_temperature() is None
+
+    release.set()
+    assert await first == 92
+    await server.close()
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_nats_connection_retries_only_connect_errors():
+    class FlakyNatsClient(MockNatsClient):
+        def __init__(self, errors):
+            super(FlakyNatsClient, self).__init__()
+            self.errors = errors
+
+        async def connect(self, servers=None, **kwargs):
+            if self.errors:
+                self.connect_count += 1
+                raise self.errors.pop(0)
+            await super(FlakyNatsClient, self).connect(servers, **kwargs)
+
+    connection = NatsConnection('localhost', 4222)
+    connection._nats_client = FlakyNatsClient([ConnectionRefusedError()])
+    await connection.connect()
+    assert connection.client.connect_count == 2
+    assert connection.is_connected
+
+    connection = NatsConnection('localhost', 4222)
+    connection._nats_client = FlakyNatsClient([TypeError('loop')])
+    with pytest.raises(TypeError):
+        await connection.connect()
+    assert connection.client.connect_count == 1
+
+
+def test_bus_manager_rejects_chatroom():
+    manager = BusManager()
+    with pytest.raises(ValueError) as error:
+        manager.import_config({'host': 'localhost', 'port': 4222,
+                               'type': 'chatroom'})
+    assert 'chatroom' in str(error.value)
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import pytest
+from bus.bus_manager import BusManager
+from bus.outbox import (DropOldestOutbox, KeepLatestOutbox, SpillFileOutbox,
+                        create_outbox)
+from test.mock.nats import MockNatsClient
+
+
+def _pop_all(outbox):
+    messages = []
+    while True:
+        message = outbox.pop()
+        if message is None:
+            return messages
+        messages.append(message)
+
+
+def test_drop_oldest_outbox():
+    outbox = DropOldestOutbox(max_messages=2)
+    for index in range(3):
+        outbox.put('tank.pub', b'%d' % index)
+    outbox.put('output.pub', b'x')
+    assert len(outbox) == 3
+    assert outbox.dropped == 1
+    assert _pop_all(outbox) == [('tank.pub', b'1'), ('output.pub', b'x'),
+                                ('tank.pub', b'2')]
+
+    outbox.put('tank.pub', b'3')
+    subject, data = outbox.pop()
+    outbox.push_front(subject, data)
+    assert _pop_all(outbox) == [('tank.pub', b'3')]
+
+
+def test_keep_latest_outbox():
+    outbox = KeepLatestOutbox()
+    outbox.put('tank.pub', b'1')
+    outbox.put('output.pub', b'x')
+    outbox.put('tank.pub', b'2')
+    assert len(outbox) == 2
+    assert outbox.dropped == 1
+
+    subject, data = outbox.pop()
+    assert (subject, data) == ('tank.pub', b'2')
+    outbox.put('tank.pub', b'3')
+    # The newer message wins over the one given back
+    outbox.push_front(subject, data)
+    assert _pop_all(outbox) == [('output.pub', b'x'), ('tank.pub', b'3')]
+
+
+def test_spill_file_outbox(tmp_path):
+    path = str(tmp_path / 'outbox.bin')
+    outbox = SpillFileOutbox(path, max_bytes=64)
+    outbox.put('tank.pub', b'1' * 10)
+    outbox.put('tank.pub', b'2' * 10)
+    outbox.put('tank.pub', b'3' * 10)
+    assert len(outbox) == 2
+    assert outbox.dropped == 1
+
+    # Reopen after a restart with a torn record at the end
+    with open(path, 'ab') as spill:
+        spill.write(b'\x00\x08\x00')
+    outbox = SpillFileOutbox(path, max_bytes=64)
+    assert len(outbox) == 2
+
+    subject, data = outbox.pop()
+    outbox.push_front(subject, data)
+    assert _pop_all(outbox) == [('tank.pub', b'1' * 10),
+                                ('tank.pub', b'2' * 10)]
+    assert SpillFileOutbox(path).pop() is None
+
+
+def test_create_outbox():
+    assert isinstance(create_outbox(), DropOldestOutbox)
+    assert isinstance(create_outbox({'policy': 'keep_latest'}),
+                      KeepLatestOutbox)
+    with pytest.raises(ValueError):
+        create_outbox({'policy': 'unknown'})
+
+    # The shipped config keeps the options of every policy
+    outbox = create_outbox({'policy': 'keep_latest', 'max_messages': 100,
+                            'drain_batch': 5})
+    assert isinstance(outbox, KeepLatestOutbox)
+    assert outbox._drain_batch == 5
+    with pytest.raises(ValueError):
+        create_outbox({'policy': 'keep_latest', 'max_message': 100})
+    with pytest.raises(ValueError):
+        create_outbox({'policy': 'spill_file'})
+
+
+@pytest.mark.asyncio
+async def test_outbox_drain_in_batches():
+    outbox = DropOldestOutbox(drain_batch=2, drain_interval_ms=10)
+    for index in range(5):
+        outbox.put('tank.pub', b'%d' % index)
+
+    published = []
+
+    async def publish(subject, data):
+        published.append(data)
+
+    outbox.start_drain(publish, lambda: True)
+    await asyncio.sleep(0)
+    assert published == [b'0', b'1']
+    await asyncio.sleep(0.05)
+    assert published == [b'0', b'1', b'2', b'3', b'4']
+    assert len(outbox) == 0
+
+
+@pytest.mark.asyncio
+async def test_nats_bus_pub_while_disconnected():
+    manager = BusManager()
+    manager.import_config({'host': 'localhost', 'port': 4222,
+                           'outbox': {'policy': 'keep_latest'}})
+    bus = manager.create_bus_client('tank.temperature')
+    client = MockNatsClient()
+    bus._connection._nats_client = client
+    await bus.start()
+
+    assert await bus.pub('tank.temperature', {'temperature': 90}) is True
+    client.is_connected = False
+    for temperature in [91, 92, 93]:
+        assert await bus.pub('tank.temperature',
+                             {'temperature': temperature}) is False
+    assert len(client.published) == 1
+
+    client.is_connected = True
+    await bus._connection._on_reconnected()
+    await asyncio.sleep(0.01)
+    assert len(client.published) == 2
+    assert b'93' in client.published[-1][1]
+
+    await bus.close()
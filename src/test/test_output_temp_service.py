@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import pytest
+from hardware.max31856 import MAX31856, MAX31856Config
+from hardware.max31865 import MAX31865, MAX31865Config
+from services.output_temp_service import OutputTempService
+from services.service_manager import create_output_temp_service
+from test.mock.spi import MockSPI
+
+
+class MockHWManager(object):
+    def __init__(self, hardware):
+        self._hardware = hardware
+
+    def find_hardware(self, name):
+        return self._hardware
+
+
+def test_output_temp_service_sampling_mode():
+    config = MAX31856Config()
+    config.sample_avg = MAX31856.SAMPLE_AVG_16
+    sensor = MAX31856(MockSPI(), config)
+
+    # A 16 samples one-shot conversion takes about 0.7s
+    service = OutputTempService(sensor, 1000, None, sampling='auto')
+    assert service._sampling_mode == MAX31856.MODE_MANUAL
+    service = OutputTempService(sensor, 500, None, sampling='auto')
+    assert service._sampling_mode == MAX31856.MODE_AUTOMATIC
+    with pytest.raises(ValueError):
+        OutputTempService(sensor, 1000, None, sampling='fast')
+
+
+def test_output_temp_service_sampling_needs_max31856():
+    sensor = MAX31865(MockSPI(), MAX31865Config())
+    with pytest.raises(ValueError):
+        OutputTempService(sensor, 1000, None, sampling='auto')
+    assert OutputTempService(sensor, 1000, None)._sampling_mode is None
+
+    service_config = {'scan_interval_ms': 1000, 'dev': 'max31865-0',
+                      'sampling': 'one-shot'}
+    assert create_output_temp_service(service_config, MockHWManager(sensor),
+                                      None) is None
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from services import publish_policy
+from services.publish_policy import PublishPolicy
+from services.tank_temp_service import TankTempService
+from test.mock.bus import MockBus
+from test.mock.temperature_sensor import MockTemperatureSensor
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(publish_policy.time, 'monotonic', fake)
+    return fake
+
+
+def _ok(temperature):
+    return {'status': 'ok', 'temperature': temperature}
+
+
+def test_deadband(clock):
+    policy = PublishPolicy('temperature', abs_deadband=0.1)
+    assert policy.should_publish(_ok(90.0)) is True
+    assert policy.should_publish(_ok(90.05)) is False
+    assert policy.should_publish(_ok(90.1)) is False
+    # Compare with the last published value, slow drift is published
+    assert policy.should_publish(_ok(90.15)) is True
+    assert policy.should_publish(_ok(85)) is True
+    assert policy.published == 3
+    assert policy.suppressed == 2
+
+
+def test_relative_deadband(clock):
+    policy = PublishPolicy('temperature', rel_deadband=0.01)
+    assert policy.should_publish(_ok(90.0)) is True
+    assert policy.should_publish(_ok(90.8)) is False
+    assert policy.should_publish(_ok(91.0)) is True
+
+
+def test_max_silence(clock):
+    policy = PublishPolicy('temperature', abs_deadband=1, max_silence_ms=5000)
+    assert policy.should_publish(_ok(90.0)) is True
+    clock.now += 4.9
+    assert policy.should_publish(_ok(90.0)) is False
+    clock.now += 0.1
+    assert policy.should_publish(_ok(90.0)) is True
+
+
+def test_min_interval_and_status_change(clock):
+    policy = PublishPolicy('temperature', min_interval_ms=1000)
+    assert policy.should_publish(_ok(90.0)) is True
+    clock.now += 0.5
+    assert policy.should_publish(_ok(95.0)) is False
+
+    # Status changes are never delayed
+    error = {'status': 'error', 'message': 'sensor lost'}
+    assert policy.should_publish(error) is True
+    clock.now += 0.1
+    assert policy.should_publish(error) is False
+    assert policy.should_publish(_ok(95.0)) is True
+
+    # The suppressed step change is published after the interval
+    clock.now += 0.5
+    assert policy.should_publish(_ok(99.0)) is False
+    clock.now += 0.5
+    assert policy.should_publish(_ok(99.0)) is True
+
+
+def test_from_config():
+    assert PublishPolicy.from_config('temperature', None) is None
+    policy = PublishPolicy.from_config('temperature', {'abs_deadband': 0.5})
+    assert policy.should_publish(_ok(90.0)) is True
+    assert policy.should_publish(_ok(90.4)) is False
+
+
+@pytest.mark.asyncio
+async def test_tank_temp_service_publish_on_change(clock):
+    published = []
+
+    async def _pub_cb(path, data):
+        published.append(data)
+
+    bus = MockBus()
+    bus.pub_cb = _pub_cb
+
+    sensor = MockTemperatureSensor()
+    sensor.temp = 90
+    service = TankTempService(sensor, 1000, bus,
+                              PublishPolicy('temperature', abs_deadband=0.1))
+    await service.pub_tank_temperature()
+    await service.pub_tank_temperature()
+    sensor.temp = 92
+    await service.pub_tank_temperature()
+    assert [status['temperature'] for status in published] == [90, 92]
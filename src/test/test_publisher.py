@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import pytest
+from bus.bus_manager import BusManager
+from bus.publisher import PublishPipeline
+from services.cadence import Cadence
+from test.mock.nats import MockNatsClient
+
+
+@pytest.mark.asyncio
+async def test_publish_pipeline_coalesce_and_drop():
+    sent = []
+
+    async def send(payload):
+        sent.append(payload)
+
+    pipeline = PublishPipeline(max_depth=2, batch_size=1)
+    assert pipeline.publish('tank.pub', 1, send) is True
+    assert pipeline.publish('tank.pub', 2, send) is True
+    assert pipeline.publish('output.pub', 3, send) is True
+    assert pipeline.publish('water.pub', 4, send) is False
+    assert pipeline.depth == 2
+    assert sent == []
+
+    await asyncio.sleep(0.01)
+    assert sent == [2, 3]
+    assert pipeline.stats() == {"depth": 0, "published": 2, "coalesced": 1,
+                                "dropped": 1, "failed": 0}
+    await pipeline.close()
+
+
+@pytest.mark.asyncio
+async def test_nats_bus_pub_does_not_wait_for_broker():
+    manager = BusManager()
+    manager.import_config({'host': 'localhost', 'port': 4222,
+                           'publisher': {'enable': True}})
+    bus = manager.create_bus_client('tank.temperature')
+    client = MockNatsClient()
+    bus._connection._nats_client = client
+    await bus.start()
+
+    release = asyncio.Event()
+    publish = client.publish
+
+    async def slow_publish(subject, payload):
+        await release.wait()
+        await publish(subject, payload)
+
+    client.publish = slow_publish
+    assert await bus.pub('tank.temperature', {'temperature': 0}) is True
+    await asyncio.sleep(0.01)
+    # The first pub is on the wire, the others are coalesced behind it
+    for temperature in range(1, 5):
+        assert await bus.pub('tank.temperature',
+                             {'temperature': temperature}) is True
+    publisher = manager.get_publisher(
+        manager.traffic_classes.classify('tank.temperature'))
+    assert publisher.depth == 1
+    assert publisher.coalesced == 3
+
+    release.set()
+    await asyncio.sleep(0.01)
+    await bus.close()
+    assert [payload for _, payload in client.published] == [
+        b'{"temperature":0}', b'{"temperature":4}']
+
+
+@pytest.mark.asyncio
+async def test_cadence_does_not_drift():
+    loop = asyncio.get_event_loop()
+    cadence = Cadence(50)
+    start = loop.time()
+    for _ in range(4):
+        await asyncio.sleep(0.025)
+        await cadence.wait()
+    # Sleeping the interval after the work would take 0.3s
+    assert loop.time() - start == pytest.approx(0.2, abs=0.04)
+
+    await asyncio.sleep(0.12)
+    await cadence.wait()
+    assert cadence.missed == 2
+
+
+@pytest.mark.asyncio
+async def test_aligned_cadences_tick_together():
+    loop = asyncio.get_event_loop()
+    first = Cadence(50, align=True)
+    await first.wait()
+    await asyncio.sleep(0.02)
+    second = Cadence(50, align=True)
+    await second.wait()
+    # The ticks are on the multiples of the interval, not the first wait
+    assert first._next / 0.05 == pytest.approx(round(first._next / 0.05))
+    assert second._next == pytest.approx(first._next + 0.05)
+    assert loop.time() >= second._next
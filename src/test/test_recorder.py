@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import pytest
+from bus.bus_manager import BusManager
+from bus.recorder import (IN, OUT, BusRecorder, BusReplayer, read_index,
+                          read_records)
+from test.mock.nats import MockNatsClient
+
+
+def test_recorder_segments(tmp_path):
+    path = str(tmp_path / 'bus.rec')
+    recorder = BusRecorder(path, segment_records=2)
+    for index in range(5):
+        recorder.record(OUT, 'tank.temp.pub', b'%d' % index)
+    recorder.close()
+
+    # Append after a restart, with a torn record at the end
+    recorder = BusRecorder(path, segment_records=2)
+    recorder.record(IN, 'barista', b'5')
+    recorder.close()
+    with open(path, 'ab') as log:
+        log.write(b'\x01\x00')
+
+    records = list(read_records(path))
+    assert [record.data for record in records] == [
+        b'0', b'1', b'2', b'3', b'4', b'5']
+    assert records[-1].direction == IN
+    assert records[-1].subject == 'barista'
+
+    index = read_index(path)
+    assert len(index) == 4
+    start_time = index[2][1]
+    assert [record.data for record in read_records(path, start_time)][0] == b'4'
+
+
+@pytest.mark.asyncio
+async def test_record_and_replay(tmp_path):
+    path = str(tmp_path / 'bus.rec')
+    manager = BusManager()
+    manager.import_config({'host': 'localhost', 'port': 4222,
+                           'recorder': {'enable': True, 'path': path}})
+    tank = manager.create_bus_client('tank.temp')
+    heater = manager.create_bus_client('tank.heater')
+    client = MockNatsClient()
+    tank._connection._nats_client = client
+
+    async def get(_):
+        return {'status': 'ok', 'temperature': 90}
+
+    await tank.start()
+    await heater.start()
+    await tank.reg_rpc_api('get', get)
+    await heater.reg_sub('tank.temp', lambda _: None)
+
+    await tank.pub('tank.temp', {'temperature': 90})
+    await asyncio.sleep(0.02)
+    await heater.call('tank.temp', 'get', None)
+    await tank.pub('tank.temp', {'temperature': 91})
+    manager.recorder.close()
+
+    directions = [(record.direction, record.subject.split('.')[0])
+                  for record in read_records(path)]
+    # pub, sub, request, request on the server, reply, reply on the client
+    assert directions == [(OUT, 'tank'), (IN, 'tank'), (OUT, 'tank'),
+                          (IN, 'tank'), (OUT, '_INBOX'), (IN, '_INBOX'),
+                          (OUT, 'tank'), (IN, 'tank')]
+
+    client.published.clear()
+    manager.recorder = None
+    replayer = BusReplayer(path)
+    loop = asyncio.get_event_loop()
+    start = loop.time()
+    await replayer.replay(heater, speed=2)
+    assert loop.time() - start >= 0.01
+    assert (replayer.published, replayer.requested, replayer.failed) == (2, 1, 0)
+    # The requests are sent from their own task, they may go out later
+    assert sorted(subject for subject, _ in client.published
+                  if not subject.startswith('_INBOX.')) == [
+                      'tank.temp', 'tank.temp.pub', 'tank.temp.pub']
+
+    await heater.close()
+    await tank.close()
+
+
+@pytest.mark.asyncio
+async def test_replay_after_the_recorded_deadline(tmp_path):
+    path = str(tmp_path / 'bus.rec')
+    manager = BusManager()
+    manager.import_config({'host': 'localhost', 'port': 4222,
+                           'recorder': {'enable': True, 'path': path}})
+    tank = manager.create_bus_client('tank.temp')
+    heater = manager.create_bus_client('tank.heater')
+    tank._connection._nats_client = MockNatsClient()
+
+    calls = []
+
+    async def get(parameters):
+        calls.append(parameters)
+        return {'status': 'ok'}
+
+    await tank.start()
+    await heater.start()
+    await tank.reg_rpc_api('get', get)
+    await heater.call('tank.temp', 'get', 1, timeout=0.05)
+    manager.recorder.close()
+    manager.recorder = None
+    await asyncio.sleep(0.1)
+
+    replayer = BusReplayer(path)
+    await replayer.replay(heater, speed=None)
+    assert (replayer.requested, replayer.failed) == (1, 0)
+    assert tank.expired_requests == 0
+    assert calls == [1, 1]
+
+    await heater.close()
+    await tank.close()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import pytest
+from lib.retrying import retry, AsyncRetrying, RetryError
+
+
+@pytest.mark.asyncio
+async def test_async_retry_until_success():
+    attempts = []
+    before = []
+    after = []
+
+    @retry(stop_max_attempt_number=5, wait_fixed=1,
+           before_attempts=before.append, after_attempts=after.append)
+    async def connect():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ConnectionError()
+        return 'connected'
+
+    assert asyncio.iscoroutinefunction(connect)
+    assert await connect() == 'connected'
+    assert before == [1, 2, 3]
+    assert after == [1, 2]
+
+
+@pytest.mark.asyncio
+async def test_async_retry_not_block_event_loop():
+    ticks = []
+
+    async def ticker():
+        while True:
+            ticks.append(1)
+            await asyncio.sleep(0.01)
+
+    @retry(stop_max_attempt_number=3, wait_fixed=50)
+    async def always_fail():
+        raise ConnectionError()
+
+    task = asyncio.ensure_future(ticker())
+    with pytest.raises(ConnectionError):
+        await always_fail()
+    task.cancel()
+    assert len(ticks) > 5
+
+
+@pytest.mark.asyncio
+async def test_async_retry_attempt_timeout():
+    attempts = []
+
+    async def slow():
+        attempts.append(1)
+        await asyncio.sleep(1)
+
+    retrying = AsyncRetrying(stop_max_attempt_number=2, wait_fixed=0,
+                             attempt_timeout=10, wrap_exception=True)
+    with pytest.raises(RetryError):
+        await retrying.call(slow)
+    assert len(attempts) == 2
+
+
+@pytest.mark.asyncio
+async def test_async_retry_cancel():
+    attempts = []
+
+    @retry(wait_fixed=1000)
+    async def always_fail():
+        attempts.append(1)
+        raise ConnectionError()
+
+    task = asyncio.ensure_future(always_fail())
+    await asyncio.sleep(0.05)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert attempts == [1]
+
+
+def test_sync_retry():
+    attempts = []
+
+    @retry(stop_max_attempt_number=3, wait_fixed=0)
+    def fail_twice():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ValueError()
+        return True
+
+    assert fail_twice() is True
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import ctypes
+import threading
+import pytest
+from hardware import spi as hwspi
+from hardware.spi import HWSPI, SPIConfig, SPIController
+
+
+class FakeSpiDev(object):
+    opened = []
+
+    def __init__(self):
+        self.mode = None
+
+    def open(self, device, ce):
+        FakeSpiDev.opened.append((device, ce))
+
+    def close(self):
+        FakeSpiDev.opened.remove((0, 0))
+
+    def fileno(self):
+        return 3
+
+
+@pytest.fixture
+def transfers(monkeypatch):
+    """ A chip which answers every byte with the byte sent plus one """
+    sent_data = []
+
+    def ioctl(fd, request, transfer):
+        assert request == hwspi.SPI_IOC_MESSAGE_1
+        sent = ctypes.string_at(transfer.tx_buf, transfer.len)
+        sent_data.append(sent)
+        answer = bytes((byte + 1) & 0xff for byte in sent)
+        ctypes.memmove(transfer.rx_buf, answer, transfer.len)
+        return 0
+
+    FakeSpiDev.opened = []
+    monkeypatch.setattr(hwspi.fcntl, 'ioctl', ioctl)
+    monkeypatch.setattr(hwspi, 'SpiDev', FakeSpiDev)
+    return sent_data
+
+
+def test_hwspi_transfer_reuses_buffers(transfers):
+    spi = HWSPI(0, 0, SPIConfig())
+    spi.open()
+
+    rx = spi._rx
+    assert bytes(spi.transfer_into(bytearray(b'\x01\x02'), 2)) == b'\x01\x01'
+    assert spi.transfer([0x0c], 3) == [1, 1, 1]
+    # The zeros clocked out while reading are cleared after a longer write
+    assert transfers == [b'\x01\x02\x00\x00', b'\x0c\x00\x00\x00']
+    assert spi._rx is rx
+
+    # A transfer longer than the buffers grows them
+    data = spi.transfer_into(bytes(range(100)), 1)
+    assert len(data) == 1 and data[0] == 1
+    assert len(transfers[-1]) == 101
+
+
+def test_controller_shares_chip_select(transfers):
+    controller = SPIController(0)
+    config1 = SPIConfig()
+    config1.mode = 1
+    spi1 = HWSPI(0, 0, config1, controller)
+    spi2 = HWSPI(0, 0, SPIConfig(), controller)
+    spi1.open()
+    spi2.open()
+    assert FakeSpiDev.opened == [(0, 0)]
+
+    spi1.transfer([0], 1)
+    spi1.transfer([0], 1)
+    assert controller.reconfigurations == 1
+    spi2.transfer([0], 1)
+    spi1.transfer([0], 1)
+    assert controller.reconfigurations == 3
+
+    spi1.close()
+    assert FakeSpiDev.opened == [(0, 0)]
+    spi2.close()
+    assert FakeSpiDev.opened == []
+
+
+@pytest.mark.asyncio
+async def test_controller_runs_by_priority():
+    controller = SPIController(0)
+    release = threading.Event()
+    order = []
+
+    blocked = controller.run_async(release.wait)
+    task = asyncio.ensure_future(blocked)
+    await asyncio.sleep(0.01)
+
+    # Queued while the thread is busy
+    calls = [
+        controller.run_async(order.append, 'telemetry-1', priority=2),
+        controller.run_async(order.append, 'control', priority=0),
+        controller.run_async(order.append, 'telemetry-2', priority=2),
+        controller.run_async(order.append, 'sensor', priority=1),
+        controller.run_async(lambda: 1 / 0, priority=1),
+    ]
+    futures = [asyncio.ensure_future(call) for call in calls]
+    await asyncio.sleep(0.01)
+    release.set()
+    await task
+    results = await asyncio.gather(*futures, return_exceptions=True)
+
+    assert order == ['control', 'sensor', 'telemetry-1', 'telemetry-2']
+    assert isinstance(results[4], ZeroDivisionError)
+    assert controller.transactions == 6
+    controller.stop()
+
+
+@pytest.mark.asyncio
+async def test_controller_ages_waiting_transactions():
+    controller = SPIController(0, aging=0.01)
+    release = threading.Event()
+    order = []
+
+    task = asyncio.ensure_future(controller.run_async(release.wait))
+    await asyncio.sleep(0.01)
+
+    telemetry = asyncio.ensure_future(
+        controller.run_async(order.append, 'telemetry', priority=2))
+    # Waited long enough to pass the control calls queued after it
+    await asyncio.sleep(0.05)
+    controls = [asyncio.ensure_future(
+        controller.run_async(order.append, 'control', priority=0))
+        for _ in range(3)]
+    await asyncio.sleep(0.01)
+    release.set()
+    await asyncio.gather(task, telemetry, *controls)
+
+    assert order == ['telemetry', 'control', 'control', 'control']
+    controller.stop()
+    assert controller._thread is None
+
+
+@pytest.mark.asyncio
+async def test_controller_batches_slot_calls(transfers):
+    controller = SPIController(0)
+    tank = HWSPI(0, 0, SPIConfig(), controller, priority=2)
+    output = HWSPI(0, 0, SPIConfig(), controller, priority=1)
+    tank.open()
+    output.open()
+
+    # Sampled at the same tick, the reads take one slot
+    results = await asyncio.gather(
+        tank.slot_async(tank.transfer, [0x01], 1),
+        output.slot_async(output.transfer, [0x02], 1),
+        output.slot_async(lambda: 1 / 0),
+        return_exceptions=True)
+    assert results[:2] == [[1], [1]]
+    assert isinstance(results[2], ZeroDivisionError)
+    assert controller.transactions == 1
+    assert transfers == [b'\x01\x00', b'\x02\x00']
+
+    assert await controller.batch_async([lambda: 1, lambda: 2]) == [1, 2]
+    assert controller.transactions == 2
+    controller.stop()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import pytest
+import asyncio
+from bus.bus_manager import BusManager
+from test.mock.bus import MockBus
+from test.mock.nats import MockNatsClient
+from test.mock.temperature_sensor import MockTemperatureSensor
+from services.tank_temp_service import TankTempClient, TankTempService
+from services.tank_water_service import TankWaterClient
+
+
+def _create_bus(requests, subscriptions):
+    async def _req_cb(path, data, timeout):
+        requests.append(path)
+        return {'status': 'ok', 'temperature': 30, 'water': False}
+
+    async def _pub_cb(path, data):
+        assert False
+
+    async def _reg_rep_cb(path, callback):
+        assert False
+
+    async def _reg_sub_cb(path, callback):
+        subscriptions[path] = callback
+
+    bus = MockBus()
+    bus.req_cb = _req_cb
+    bus.pub_cb = _pub_cb
+    bus.reg_rep_cb = _reg_rep_cb
+    bus.reg_sub_cb = _reg_sub_cb
+    return bus
+
+
+@pytest.mark.asyncio
+async def test_client_get_from_cache():
+    requests = []
+    subscriptions = {}
+    client = TankTempClient(_create_bus(requests, subscriptions), 1000)
+
+    await client.subscribe()
+    assert 'tank.temperature' in subscriptions
+
+    # Nothing published yet, fall back to request
+    assert await client.get_temperature() == 30
+    assert requests == ['tank.temperature']
+
+    await subscriptions['tank.temperature']({'status': 'ok',
+                                             'temperature': 90})
+    assert await client.get_temperature() == 90
+    assert requests == ['tank.temperature']
+
+
+@pytest.mark.asyncio
+async def test_client_stale_cache():
+    requests = []
+    subscriptions = {}
+    client = TankWaterClient(_create_bus(requests, subscriptions), 50)
+    await client.subscribe()
+
+    await subscriptions['tank.water']({'status': 'ok', 'water': True})
+    assert await client.get_water_level() is True
+
+    await asyncio.sleep(0.1)
+    assert await client.get_water_level() is False
+    assert requests == ['tank.water']
+
+
+@pytest.mark.asyncio
+async def test_client_without_cache():
+    requests = []
+    subscriptions = {}
+    client = TankTempClient(_create_bus(requests, subscriptions))
+
+    await client.subscribe()
+    assert subscriptions == {}
+    assert await client.get_temperature() == 30
+    assert requests == ['tank.temperature']
+
+
+@pytest.mark.asyncio
+async def test_client_cache_fed_through_nats_bus():
+    manager = BusManager()
+    manager.import_config({'host': 'localhost', 'port': 4222, 'type': 'nats'})
+    server = manager.create_bus_client('tank.temp')
+    client_bus = manager.create_bus_client('barista')
+    nats_client = MockNatsClient()
+    server._connection._nats_client = nats_client
+    await server.start()
+    await client_bus.start()
+
+    client = TankTempClient(client_bus, 1000)
+    await client.subscribe()
+    sensor = MockTemperatureSensor()
+    sensor.temp = 90
+    await TankTempService(sensor, 1000, server).pub_tank_temperature()
+    # The subscriber task delivers it
+    await asyncio.sleep(0.01)
+
+    assert nats_client.published[-1][0] == 'tank.temperature.pub'
+    assert client._cache.get() == {'status': 'ok', 'temperature': 90}
+    assert await client.get_temperature() == 90
+
+    await server.close()
+    await client_bus.close()
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import pytest
+from bus.bus_manager import BusManager
+from bus.subscriber import Subscriber
+from test.mock.nats import MockNatsClient
+
+
+@pytest.mark.asyncio
+async def test_subscriber_drop_policy():
+    received = []
+    subscriber = Subscriber('tank.pub', received.append, max_pending=2)
+    for index in range(4):
+        subscriber.put(index)
+    assert subscriber.pending == 2
+    await asyncio.sleep(0)
+    assert received == [0, 1]
+    assert subscriber.stats()['dropped'] == 2
+    await subscriber.close()
+
+
+@pytest.mark.asyncio
+async def test_subscriber_conflate_policy():
+    received = []
+
+    async def callback(payload):
+        received.append(payload)
+
+    subscriber = Subscriber('tank.pub', callback, decode=int,
+                            policy=Subscriber.CONFLATE)
+    for index in range(4):
+        subscriber.put(b'%d' % index)
+    await asyncio.sleep(0)
+    assert received == [3]
+    assert subscriber.delivered == 1
+    assert subscriber.dropped == 3
+
+    with pytest.raises(ValueError):
+        Subscriber('tank.pub', callback, policy='unknown')
+    await subscriber.close()
+
+
+@pytest.mark.asyncio
+async def test_nats_bus_slow_subscriber_does_not_stall_others():
+    manager = BusManager()
+    manager.import_config({'host': 'localhost', 'port': 4222,
+                           'subscriber': {'policy': 'conflate'}})
+    tank = manager.create_bus_client('tank.temperature')
+    heater = manager.create_bus_client('tank.heater')
+    tank._connection._nats_client = MockNatsClient()
+    await tank.start()
+    await heater.start()
+
+    release = asyncio.Event()
+    slow = []
+    fast = []
+
+    async def slow_callback(status):
+        await release.wait()
+        slow.append(status['temperature'])
+
+    await heater.reg_sub('tank.temperature', slow_callback)
+    await heater.reg_sub('tank.temperature', fast.append, policy='drop')
+
+    for temperature in range(5):
+        await tank.pub('tank.temperature', {'temperature': temperature})
+        await asyncio.sleep(0)
+    assert [status['temperature'] for status in fast] == [0, 1, 2, 3, 4]
+    assert slow == []
+
+    release.set()
+    await asyncio.sleep(0.01)
+    # The slow subscriber skips to the latest status
+    assert slow == [0, 4]
+    slow_stats, fast_stats = heater.subscriber_stats()
+    assert slow_stats['subject'] == 'tank.temperature.pub'
+    assert slow_stats['dropped'] == 3
+    assert fast_stats['dropped'] == 0
+
+    await heater.close()
+    await tank.close()
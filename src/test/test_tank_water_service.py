@@ -6,6 +6,7 @@ import asyncio
 from test.mock.pwm import MockPWM
 from test.mock.bus import MockBus
 from test.mock.water_detector import MockWaterDetector
+from services.publish_policy import PublishPolicy
 from services.tank_water_service import TankWaterService
 
 
@@ -70,3 +71,34 @@ async def test_tank_water_service_command():
     assert sensor.is_connected() is True
     assert response['status'] == 'ok'
     assert response['water'] is True
+
+
+@pytest.mark.asyncio
+async def test_tank_water_service_heartbeat():
+    pubs = []
+
+    async def _pub_cb(path, data):
+        pubs.append(data['water'])
+
+    bus = MockBus()
+    bus.pub_cb = _pub_cb
+    sensor = MockWaterDetector()
+
+    # Without a policy only the changes are published
+    service = TankWaterService(sensor, 1000, bus)
+    await service.pub_water_status()
+    await service.pub_water_status()
+    assert pubs == [False]
+
+    # The heartbeat keeps the status caches of the clients fresh
+    pubs.clear()
+    policy = PublishPolicy('water', max_silence_ms=20)
+    service = TankWaterService(sensor, 1000, bus, policy)
+    await service.pub_water_status()
+    await service.pub_water_status()
+    assert pubs == [False]
+    await asyncio.sleep(0.03)
+    await service.pub_water_status()
+    sensor._is_water_full = True
+    await service.pub_water_status()
+    assert pubs == [False, False, True]
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+import json
+import pytest
+from lib import tracing
+from bus.bus_manager import BusManager
+from test.mock.nats import MockNatsClient
+
+
+def _load_events(path):
+    # The exporter never closes the array
+    with open(path) as file:
+        content = file.read().rstrip().rstrip(',')
+    return [event for event in json.loads(content + ']')
+            if event['ph'] == 'X']
+
+
+@pytest.fixture
+def trace_path(tmpdir):
+    path = str(tmpdir.join('trace.json'))
+    yield path
+    tracing.set_tracer(None)
+
+
+def test_nested_spans(trace_path):
+    assert tracing.span('off') is tracing.span('off too')
+
+    tracing.configure({'enable': True, 'path': trace_path,
+                       'process_name': 'test'})
+    with tracing.span('brew', 'barista'):
+        with tracing.span('spi.transfer', 'spi', {'ce': 0}):
+            pass
+        with pytest.raises(ValueError):
+            with tracing.span('smoothie.send', 'serial'):
+                raise ValueError('broken')
+    tracing.set_tracer(None)
+
+    transfer, send, brew = _load_events(trace_path)
+    assert brew['args']['parent_id'] is None
+    assert transfer['args']['ce'] == 0
+    assert transfer['args']['parent_id'] == brew['args']['span_id']
+    assert send['args']['trace_id'] == brew['args']['trace_id']
+    assert 'broken' in send['args']['error']
+    assert brew['ts'] <= transfer['ts'] and brew['dur'] >= transfer['dur']
+
+
+def test_unsampled_trace(trace_path):
+    tracing.configure({'enable': True, 'path': trace_path,
+                       'sample_rate': 0})
+    with tracing.span('brew') as root:
+        assert root.context() == {'sampled': False}
+        # The children follow the decision of the root
+        with tracing.span('spi.transfer'):
+            assert tracing.current_context() == {'sampled': False}
+    assert tracing.current_context() is None
+    # So do the handlers in other services
+    with tracing.span('stop', parent={'sampled': False}):
+        with tracing.span('pwm.stop'):
+            pass
+    tracing.set_tracer(None)
+    assert _load_events(trace_path) == []
+
+
+@pytest.mark.asyncio
+async def test_nats_bus_propagate_trace(trace_path):
+    tracing.configure({'enable': True, 'path': trace_path})
+    manager = BusManager()
+    manager.import_config({'host': 'localhost', 'port': 4222, 'type': 'nats'})
+    server = manager.create_bus_client('tank.refill')
+    client = manager.create_bus_client('barista')
+    server._connection._nats_client = MockNatsClient()
+
+    async def stop(_):
+        with tracing.span('pwm.stop', 'hardware'):
+            return {'status': 'ok'}
+
+    await server.start()
+    await client.start()
+    await server.reg_rpc_api('stop', stop)
+    with tracing.span('brew', 'barista'):
+        await client.call('tank.refill', 'stop', None)
+    await server.close()
+    await client.close()
+    tracing.set_tracer(None)
+
+    events = {event['name']: event for event in _load_events(trace_path)}
+    assert set(events) == {'brew', 'tank.refill', 'stop', 'pwm.stop'}
+    assert len({event['args']['trace_id'] for event in events.values()}) == 1
+    assert events['tank.refill']['args']['parent_id'] == \
+        events['brew']['args']['span_id']
+    assert events['stop']['args']['parent_id'] == \
+        events['tank.refill']['args']['span_id']
+    assert events['pwm.stop']['args']['parent_id'] == \
+        events['stop']['args']['span_id']
+
+
+@pytest.mark.asyncio
+async def test_nats_bus_propagate_unsampled_trace(trace_path, monkeypatch):
+    # Only the first root span is dropped, a fresh decision would sample
+    samples = iter([0.9])
+    monkeypatch.setattr(tracing.random, 'random', lambda: next(samples, 0.0))
+    manager = BusManager()
+    manager.import_config({'host': 'localhost', 'port': 4222, 'type': 'nats'})
+    server = manager.create_bus_client('tank.refill')
+    client = manager.create_bus_client('barista')
+    server._connection._nats_client = MockNatsClient()
+
+    async def stop(_):
+        with tracing.span('pwm.stop', 'hardware'):
+            return {'status': 'ok'}
+
+    await server.start()
+    await client.start()
+    await server.reg_rpc_api('stop', stop)
+    # Start the handler workers outside the trace, as in another process
+    await client.call('tank.refill', 'stop', None)
+
+    tracing.configure({'enable': True, 'path': trace_path,
+                       'sample_rate': 0.5})
+    with tracing.span('brew', 'barista'):
+        await client.call('tank.refill', 'stop', None)
+        await client.req_batch('tank.refill', [{'method': 'stop'}])
+    await server.close()
+    await client.close()
+    tracing.set_tracer(None)
+
+    assert _load_events(trace_path) == []
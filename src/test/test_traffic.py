@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import pytest
+from bus.bus_manager import BusManager
+from bus.publisher import PublishPipeline
+from bus.traffic import TrafficClasses, subject_match
+from test.mock.nats import MockNatsClient
+
+TRAFFIC_CLASSES = {
+    'control': {'priority': 0, 'dedicated_connection': True,
+                'paths': ['tank.refill', 'tank.heater'],
+                'dispatch': {'workers': 2}},
+    'telemetry': {'priority': 2, 'paths': ['*.temp', 'tank.water']},
+}
+BULK_TRAFFIC_CLASSES = dict(TRAFFIC_CLASSES, bulk={
+    'dedicated_connection': True, 'paths': ['barista']})
+
+
+def test_subject_match():
+    assert subject_match('tank.*', 'tank.water')
+    assert subject_match('tank.>', 'tank.water.pub')
+    assert not subject_match('tank.*', 'tank.water.pub')
+
+
+def test_classify():
+    classes = TrafficClasses(TRAFFIC_CLASSES)
+    assert classes.classify('tank.refill').name == 'control'
+    assert classes.classify('output.temp').name == 'telemetry'
+    assert classes.classify('barista').name == TrafficClasses.DEFAULT
+    assert classes.classify_subject('tank.refill.rep').name == 'control'
+    assert classes.classify_subject('tank.water.pub').name == 'telemetry'
+
+    control = classes.classify('tank.heater')
+    config = control.dispatch_config(
+        {'workers': 1, 'max_pending': 4, 'methods': {'brew': {'workers': 1}}})
+    assert config == {'workers': 2, 'max_pending': 4,
+                      'methods': {'brew': {'workers': 1}}}
+
+
+def test_bus_manager_dedicated_connection():
+    manager = BusManager()
+    manager.import_config({'host': 'localhost', 'port': 4222,
+                           'traffic_classes': TRAFFIC_CLASSES})
+    refill = manager.create_bus_client('tank.refill')
+    heater = manager.create_bus_client('tank.heater')
+    tank = manager.create_bus_client('tank.temp')
+    barista = manager.create_bus_client('barista')
+
+    assert refill._connection is heater._connection
+    assert tank._connection is barista._connection
+    assert refill._connection is not tank._connection
+    assert refill.rpc_stats() == {}
+    assert refill._dispatcher._workers == 2
+    assert tank._dispatcher._workers == 1
+
+
+@pytest.mark.asyncio
+async def test_publish_pipeline_priority():
+    sent = []
+
+    async def send(payload):
+        sent.append(payload)
+
+    pipeline = PublishPipeline()
+    pipeline.publish('tank.temp.pub', 'telemetry', send, priority=2)
+    pipeline.publish('barista.pub', 'default', send)
+    pipeline.publish('tank.refill.pub', 'control', send, priority=0)
+    await asyncio.sleep(0.01)
+    assert sent == ['control', 'default', 'telemetry']
+
+    pipeline.publish('tank.temp.pub', 'telemetry', send, priority=2)
+    await pipeline.flush('tank.temp.pub')
+    assert pipeline.depth == 0
+    await pipeline.close()
+
+
+@pytest.mark.asyncio
+async def test_route_by_target_subject():
+    manager = BusManager()
+    manager.import_config({'host': 'localhost', 'port': 4222,
+                           'traffic_classes': BULK_TRAFFIC_CLASSES,
+                           'publisher': {'enable': True}})
+    refill = manager.create_bus_client('tank.refill')
+    barista = manager.create_bus_client('barista')
+    # One broker behind the two connections
+    control_client = MockNatsClient()
+    bulk_client = MockNatsClient()
+    bulk_client._subs = control_client._subs
+    bulk_client._next_sid = 1000
+    refill._connection._nats_client = control_client
+    barista._connection._nats_client = bulk_client
+    await refill.start()
+    await barista.start()
+
+    async def command(_):
+        return {'status': 'ok'}
+
+    await refill.reg_rep('tank.refill', command)
+    assert await barista.req('tank.refill', {'command': 'stop'}) == {
+        'status': 'ok'}
+    # Not behind the brew frames of the bulk connection
+    assert ('tank.refill.rep' in
+            [subject for subject, _ in control_client.published])
+    assert ('tank.refill.rep' not in
+            [subject for subject, _ in bulk_client.published])
+    assert refill._connection.ref_count == 2
+
+    # Every class has its own writer task
+    classes = manager.traffic_classes
+    _, publisher, priority = barista._route_of('tank.heater.pub')
+    assert priority == 0
+    assert publisher is manager.get_publisher(classes.classify('tank.heater'))
+    assert publisher is not manager.get_publisher(classes.classify('barista'))
+
+    await barista.close()
+    assert refill._connection.ref_count == 1
+    await refill.close()
+
+
+def test_spill_file_per_connection(tmp_path):
+    spill_path = str(tmp_path / 'outbox.bin')
+    manager = BusManager()
+    manager.import_config({'host': 'localhost', 'port': 4222,
+                           'traffic_classes': BULK_TRAFFIC_CLASSES,
+                           'outbox': {'policy': 'spill_file',
+                                      'spill_path': spill_path}})
+    # Only checked, no outbox touches the file yet
+    assert list(tmp_path.iterdir()) == []
+
+    refill = manager.create_bus_client('tank.refill')
+    tank = manager.create_bus_client('tank.temp')
+    barista = manager.create_bus_client('barista')
+    outboxes = [bus._connection.outbox for bus in [refill, tank, barista]]
+    assert len(set(id(outbox) for outbox in outboxes)) == 3
+    assert sorted(outbox._path for outbox in outboxes) == [
+        spill_path, spill_path + '.bulk', spill_path + '.control']